@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import (
     Flask,
+    make_response,
     render_template,
     redirect,
     request,
@@ -9,21 +10,32 @@ from flask import (
     flash,
 )
 from werkzeug.security import check_password_hash
-from identification_client import IdentificationClient
+from client_pool import ClientPool
 from models.candidates import Candidate
-from data_collection import DataCollection
-from models.db import UsersDb
-from voting_client import VotingClient
+from models.storage import open_users_db
+from results_cache import ResultsCache
+from utils.session_tokens import INVALID_TOKEN
 
 app = Flask(__name__)
 app.secret_key = "your-secret-key"
 
+# Persistent connections to the voting and identification servers, shared
+# by all requests in this process.
+clients = ClientPool()
+
+# One storage backend for the process, shared by admin logins and the
+# results cache instead of being opened per request.
+users_db = open_users_db("voting_db.sqlite")
+
+# Tally shared by all /results views; recomputed only when votes change.
+results_cache = ResultsCache(db=users_db)
+
 
 # Define the login_required decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not session.get("cnp") or not session.get("pin"):
+        if not session.get("token"):
             flash("Please log in first.")
             return redirect(url_for("login"))
         return f(*args, **kwargs)
@@ -45,8 +57,10 @@ def register():
         first_name = request.form.get("first_name").strip()
         last_name = request.form.get("last_name").strip()
 
-        ident_client = IdentificationClient()
-        response = ident_client.register_citizen(cnp, first_name, last_name)
+        with clients.identification_client() as ident_client:
+            response = ident_client.register_citizen(
+                cnp, first_name, last_name
+            )
 
         if isinstance(response, dict) and response.get("status") == "ERROR":
             flash(f"Registration error: {response.get('message')}")
@@ -66,12 +80,13 @@ def login():
         cnp = request.form.get("cnp").strip()
         pin = request.form.get("pin").strip()
 
-        voting_client = VotingClient(cnp=cnp, pin=pin)
-        voting_client.get_public_key()
+        with clients.voting_client(cnp, pin) as voting_client:
+            # The PIN is checked once here; later requests use the token.
+            voting_client.login()
 
-        if voting_client.public_key:
+        if voting_client.token:
             session["cnp"] = cnp
-            session["pin"] = pin
+            session["token"] = voting_client.token
             flash("Login successful. You can now cast your vote.")
             return redirect(url_for("vote"))
         else:
@@ -83,11 +98,7 @@ def login():
 @app.route("/vote", methods=["GET", "POST"])
 @login_required
 def vote():
-    cnp = session["cnp"]
-    pin = session["pin"]
-    voting_client = VotingClient(cnp=cnp, pin=pin)
-    voting_client.get_public_key()
-
+    token = session["token"]
     candidates = [
         Candidate("A", "Donald Trump"),
         Candidate("B", "Boris Johnson"),
@@ -98,9 +109,17 @@ def vote():
         selected_vote = request.form.get("vote")
         valid_codes = [c.code for c in candidates]
         if selected_vote in valid_codes:
-            voting_client.cast_vote(selected_vote)
-            flash("Vote cast successfully.")
-            return redirect(url_for("thankyou"))
+            with clients.voting_client(token=token) as voting_client:
+                # The key comes from the pool's key cache.
+                response = voting_client.cast_vote(selected_vote)
+            if response == INVALID_TOKEN.decode():
+                session.clear()
+                flash("Your session has expired. Please log in again.")
+                return redirect(url_for("login"))
+            if isinstance(response, str) and "VOTE_ACCEPTED" in response:
+                flash("Vote cast successfully.")
+                return redirect(url_for("thankyou"))
+            flash(f"Vote not recorded: {response}")
         else:
             flash("Invalid vote. Please try again.")
 
@@ -119,20 +138,39 @@ def logout():
     return redirect(url_for("index"))
 
 
-# Protected results route (unchanged)
+# Protected results route
 @app.route("/results")
 def results():
     if not session.get("admin"):
         flash("Please log in as admin to access results.")
         return redirect(url_for("admin_login"))
     try:
-        data_collector = DataCollection("voting_db.sqlite")
-        stats = data_collector.get_statistics()
-        data_collector.close()
+        etag, last_modified = results_cache.validators()
+        not_modified = request.if_none_match.contains(etag) or (
+            not request.if_none_match
+            and request.if_modified_since is not None
+            and request.if_modified_since.timestamp() >= last_modified
+        )
+        stats = None if not_modified else results_cache.stats(etag)
     except Exception as e:
         flash(f"Error collecting votes: {e}")
         return redirect(url_for("index"))
 
+    if not_modified:
+        response = make_response("", 304)
+    else:
+        response = make_response(
+            _render_results(stats, results_cache.provisional)
+        )
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Admin-only page: browsers may keep it but must revalidate each time.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _render_results(stats, provisional=False):
     candidate_map = {
         "A": "Donald Trump",
         "B": "Boris Johnson",
@@ -142,7 +180,11 @@ def results():
     labels = list(mapped_stats.keys())
     values = list(mapped_stats.values())
     return render_template(
-        "results.html", labels=labels, values=values, stats=mapped_stats
+        "results.html",
+        labels=labels,
+        values=values,
+        stats=mapped_stats,
+        provisional=provisional,
     )
 
 
@@ -152,9 +194,7 @@ def admin_login():
         username = request.form.get("username").strip()
         password = request.form.get("password").strip()
 
-        db = UsersDb()
-        admin = db.get_admin(username)
-        db.close()
+        admin = users_db.get_admin(username)
 
         if admin and check_password_hash(admin[2], password):
             session["admin"] = True
@@ -0,0 +1,229 @@
+"""
+Export the encrypted ballots to a fixed-width, memory-mappable ballot file
+(see utils/ballot_file.py), tally such a file offline, or import it into
+another database for audit. Tallying a file only needs the file and a key
+file, not the live database.
+
+Usage (from src/):
+    python ballot_export.py export ballots.evb --db voting_db.sqlite \
+        --key-out trustee.key
+    python ballot_export.py tally ballots.evb --key trustee.key
+    python ballot_export.py import ballots.evb --db audit.sqlite
+"""
+
+import argparse
+import os
+import pickle
+import sys
+from functools import partial
+from data_collection import count_votes, decrypt_vote_blob
+from models.candidates import BALLOT_CODES
+from models.storage import open_users_db
+from utils import paillier_utils
+from utils.ballot_file import (
+    BallotFileReader,
+    BallotFileWriter,
+    ballot_size,
+)
+from utils.rsa_utils import key_fingerprint
+
+
+def load_ballot_keys(db):
+    """
+    Return (scheme, public_key, private_key) for the ballots in this
+    database: the ballot keys if there are any, else the RSA keys.
+    """
+    ballot_keys = db.load_ballot_keys()
+    if ballot_keys:
+        return ballot_keys
+    keys = db.load_keys()
+    if not keys:
+        raise ValueError("[BallotExport] No keys found in DB.")
+    return ("rsa",) + tuple(keys)
+
+
+def export_ballots(
+    db_file, out_path, key_out=None, batch_size=1000, storage=None
+):
+    """
+    Write every ballot in db_file (from every partition of its storage
+    backend) to a new ballot file at out_path, and optionally the ballot
+    key pair to key_out. Returns the ballot count.
+    """
+    db = open_users_db(db_file, storage)
+    try:
+        scheme, public_key, private_key = load_ballot_keys(db)
+        tmp_path = out_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        count = 0
+        with BallotFileWriter(
+            tmp_path,
+            ballot_size(public_key, len(BALLOT_CODES)),
+            scheme,
+            key_fingerprint(public_key),
+        ) as writer:
+            for partition in db.vote_partitions():
+                for vote_id, ciphertext in partition.iter_votes(
+                    batch_size=batch_size
+                ):
+                    writer.write(vote_id, ciphertext)
+                    count += 1
+        os.replace(tmp_path, out_path)
+    finally:
+        db.close()
+
+    if key_out:
+        write_key_file(key_out, (scheme, public_key, private_key))
+    print(f"[BallotExport] Exported {count} ballots to {out_path}.")
+    return count
+
+
+def write_key_file(path, keys):
+    """
+    Pickle `keys` (it includes the private key) to a file only its owner
+    can read. The file is written under a temporary name and renamed into
+    place, so a reader never sees a partial key and an existing key file
+    is replaced rather than rewritten with its old, possibly wider,
+    permissions.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(keys, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def tally_file(path, key_file, per_ballot=False):
+    """
+    Count the ballots in a ballot file. Paillier ballots are summed
+    homomorphically and decrypted once per candidate unless per_ballot is
+    set; RSA ballots are always decrypted one by one.
+    """
+    with open(key_file, "rb") as f:
+        scheme, public_key, private_key = pickle.load(f)
+    with BallotFileReader(path) as reader:
+        expected = (scheme, key_fingerprint(public_key))
+        if (reader.scheme, reader.fingerprint) != expected:
+            raise ValueError(
+                "[BallotExport] Key file does not match the ballot file."
+            )
+        if scheme == paillier_utils.PAILLIER and not per_ballot:
+            aggregate = None
+            for _, ciphertext in reader:
+                aggregate = paillier_utils.add_vectors(
+                    aggregate,
+                    paillier_utils.unpack_vector(ciphertext, public_key),
+                    public_key,
+                )
+            stats = {}
+            for code, total in zip(BALLOT_CODES, aggregate or []):
+                count = paillier_utils.decrypt(total, private_key)
+                if count:
+                    stats[code] = count
+            return stats
+        return count_votes(
+            decrypt_vote_blob(ciphertext, private_key)
+            for _, ciphertext in reader
+        )
+
+
+def import_ballots(path, db_file, batch_size=1000, storage=None):
+    """
+    Insert the ballots of a ballot file into db_file's votes, keeping their
+    vote_ids; ids already present are skipped. If db_file holds keys they
+    must match the file. Paillier ballots are also added to db_file's
+    encrypted tally, so its ballot keys must be saved first; to tally a
+    file without a database use tally_file(). Returns the number of
+    ballots inserted.
+    """
+    db = open_users_db(db_file, storage)
+    try:
+        with BallotFileReader(path) as reader:
+            try:
+                scheme, public_key, _ = load_ballot_keys(db)
+                expected = (scheme, key_fingerprint(public_key))
+            except ValueError:
+                expected = None  # No keys in this database.
+            if expected and expected != (reader.scheme, reader.fingerprint):
+                raise ValueError(
+                    "[BallotExport] Ballot file was encrypted for other keys."
+                )
+            if reader.scheme == paillier_utils.PAILLIER and not expected:
+                raise ValueError(
+                    "[BallotExport] Importing Paillier ballots updates the "
+                    "encrypted tally, which needs the ballot keys in the "
+                    "database; save them first, or tally the file with "
+                    "'tally'."
+                )
+            inserted = 0
+            for start in range(0, len(reader), batch_size):
+                records = reader.records(start, start + batch_size)
+                if reader.scheme == paillier_utils.PAILLIER:
+                    records = _with_tally_updates(records, public_key)
+                inserted += db.insert_votes(records)
+    finally:
+        db.close()
+    print(f"[BallotExport] Imported {inserted} ballots into {db_file}.")
+    return inserted
+
+
+def _with_tally_updates(records, public_key):
+    """(vote_id, ciphertext, add_to_tally) for Paillier ballot records."""
+    for vote_id, ciphertext in records:
+        vector = paillier_utils.unpack_vector(ciphertext, public_key)
+        yield vote_id, ciphertext, partial(
+            paillier_utils.add_vectors, vector=vector, pub_key=public_key
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ballot file export/tally.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_p = sub.add_parser("export", help="write ballots to a file")
+    export_p.add_argument("out")
+    export_p.add_argument("--db", default="voting_db.sqlite")
+    export_p.add_argument("--key-out", help="also write the ballot key pair")
+    export_p.add_argument("--batch-size", type=int, default=1000)
+    export_p.add_argument("--storage", help="sqlite or sharded[:N]")
+
+    tally_p = sub.add_parser("tally", help="count the ballots in a file")
+    tally_p.add_argument("path")
+    tally_p.add_argument("--key", required=True, help="key file from export")
+    tally_p.add_argument(
+        "--per-ballot",
+        action="store_true",
+        help="decrypt every Paillier ballot instead of the homomorphic sum",
+    )
+
+    import_p = sub.add_parser("import", help="load a file into a database")
+    import_p.add_argument("path")
+    import_p.add_argument("--db", default="voting_db.sqlite")
+    import_p.add_argument("--batch-size", type=int, default=1000)
+    import_p.add_argument("--storage", help="sqlite or sharded[:N]")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_ballots(
+            args.db, args.out, args.key_out, args.batch_size, args.storage
+        )
+    elif args.command == "import":
+        import_ballots(args.path, args.db, args.batch_size, args.storage)
+    else:
+        stats = tally_file(args.path, args.key, args.per_ballot)
+        print("[BallotExport] Stats:", stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Key-generation benchmark: the sieved generate_prime() against the original
+independent-candidate search, plus serial vs parallel generate_rsa_keys().
+
+Run from src/:  python -m benchmarks.bench_keygen [--bits 2048 3072] [--reps 5]
+"""
+
+import argparse
+import secrets
+import statistics
+import time
+from utils.rsa_utils import generate_prime, generate_rsa_keys, miller_rabin
+
+
+def legacy_generate_prime(bits=2048):
+    """The original generate_prime: independent random odd candidates."""
+    while True:
+        candidate = secrets.randbits(bits) | 1
+        candidate |= 1 << (bits - 1)
+        if miller_rabin(candidate):
+            return candidate
+
+
+def measure(fn, reps):
+    times = []
+    for _ in range(reps):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.mean(times), statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("--bits", type=int, nargs="+", default=[2048, 3072])
+    parser.add_argument("--reps", type=int, default=5)
+    args = parser.parse_args()
+
+    for key_bits in args.bits:
+        prime_bits = key_bits // 2
+        # (baseline, contender) pairs; speedup is baseline / contender.
+        pairs = [
+            (
+                (
+                    "legacy generate_prime",
+                    lambda: legacy_generate_prime(prime_bits),
+                ),
+                ("sieved generate_prime", lambda: generate_prime(prime_bits)),
+            ),
+            (
+                (
+                    "generate_rsa_keys serial",
+                    lambda: generate_rsa_keys(key_bits),
+                ),
+                (
+                    "generate_rsa_keys parallel",
+                    lambda: generate_rsa_keys(key_bits, parallel=True),
+                ),
+            ),
+        ]
+        print(
+            f"== {key_bits}-bit keys ({prime_bits}-bit primes), {args.reps} reps"
+        )
+        for baseline, contender in pairs:
+            base_mean = None
+            for name, fn in (baseline, contender):
+                mean, median = measure(fn, args.reps)
+                base_mean = base_mean or mean
+                print(
+                    f"{name:28s} mean {mean:8.3f}s  median {median:8.3f}s  "
+                    f"speedup {base_mean / mean:4.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Microbenchmarks for utils/rsa_utils primitives and DataCollection.decrypt_vote.
+
+Each benchmark is warmed up, then timed for --repeat rounds of `number`
+calls; per-call statistics (min/median/mean/stdev) are reported and can be
+written as JSON. With --compare, per-call minimums are checked against an
+earlier JSON run and anything slower by more than --threshold is flagged
+(exit 1).
+
+A default run (1024 to 4096 bits) takes a few minutes, most of it in
+4096-bit key generation.
+
+Run from src/:
+    python -m benchmarks.bench_rsa --out base.json
+    python -m benchmarks.bench_rsa --compare base.json --threshold 0.10
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from data_collection import DataCollection
+from models.storage import MemoryUsersDb
+from utils.rsa_utils import (
+    crt_private_key,
+    decrypt,
+    encrypt,
+    extended_gcd,
+    generate_prime,
+    generate_rsa_keys,
+    int_to_str,
+    miller_rabin,
+    str_to_int,
+)
+
+DEFAULT_BITS = [1024, 2048, 3072, 4096]
+
+
+def run_benchmark(fn, number, repeat, warmup):
+    """Per-call timing stats for `repeat` rounds of `number` calls each."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.mean(timings),
+        "stdev_s": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "ops_per_s": 1 / statistics.median(timings),
+    }
+
+
+# Benchmarks whose cost depends on a random prime search; their timings
+# are noisy, so --compare only reports them unless --strict is given.
+STOCHASTIC = ("generate_prime/", "generate_rsa_keys/")
+
+
+def cases_for(bits, scale, repeat):
+    """
+    Yield (name, fn, number, repeat) for one key size. `scale` multiplies
+    the call counts of the cheap benchmarks.
+    """
+    public_key, private_key = generate_rsa_keys(bits)
+    prime = private_key[2]
+    e = public_key[0]
+    phi = (private_key[2] - 1) * (private_key[3] - 1)
+    message = str_to_int("A")
+    ciphertext = encrypt(message, public_key)
+    text = "x" * (bits // 8 - 11)
+    text_int = str_to_int(text)
+    slow = max(1, scale // 10)
+    fast = 100 * scale
+
+    # Prime-level cases are named by the prime size, half the key size.
+    half = bits // 2
+    yield f"miller_rabin/{half}", lambda: miller_rabin(prime), slow, repeat
+    yield f"generate_prime/{half}", lambda: generate_prime(half), 1, 3
+    yield f"generate_rsa_keys/{bits}", lambda: generate_rsa_keys(bits), 1, 3
+    yield f"extended_gcd/{bits}", lambda: extended_gcd(e, phi), scale, repeat
+    # qInv = q^-1 mod p: equal-sized operands, the deepest Euclid case.
+    yield (
+        f"crt_private_key/{bits}",
+        lambda: crt_private_key(private_key[0], prime, private_key[3]),
+        scale,
+        repeat,
+    )
+    yield f"encrypt/{bits}", lambda: encrypt(
+        message, public_key
+    ), scale, repeat
+    yield (
+        f"decrypt_crt/{bits}",
+        lambda: decrypt(ciphertext, private_key),
+        scale,
+        repeat,
+    )
+    yield (
+        f"decrypt_plain/{bits}",
+        lambda: decrypt(ciphertext, private_key[:2]),
+        slow,
+        repeat,
+    )
+    yield f"str_to_int/{bits}", lambda: str_to_int(text), fast, repeat
+    yield f"int_to_str/{bits}", lambda: int_to_str(text_int), fast, repeat
+
+    # In-memory backend holding just the keys, enough for DataCollection.
+    db = MemoryUsersDb()
+    db.save_keys(public_key, private_key)
+    collector = DataCollection(db=db)
+    blob = ciphertext.to_bytes((ciphertext.bit_length() + 7) // 8, "big")
+    yield (
+        f"DataCollection.decrypt_vote/{bits}",
+        lambda: collector.decrypt_vote(blob),
+        scale,
+        repeat,
+    )
+    db.close()
+
+
+def compare(results, baseline, threshold, strict=False):
+    """Print per-benchmark ratios; return the names that regressed."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        # min is the least noise-sensitive estimate of the true cost.
+        ratio = result["min_s"] / base["min_s"]
+        flag = ""
+        if ratio > 1 + threshold:
+            if strict or not name.startswith(STOCHASTIC):
+                flag = "  REGRESSION"
+                regressions.append(name)
+            else:
+                flag = "  slower (random search, not counted)"
+        print(f"{name:40s} {ratio:6.2f}x baseline{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rsa_utils microbenchmarks.")
+    parser.add_argument("--bits", type=int, nargs="+", default=DEFAULT_BITS)
+    parser.add_argument(
+        "--scale", type=int, default=20, help="call-count multiplier"
+    )
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--out", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="also fail on key-generation benchmarks",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for bits in args.bits:
+        for name, fn, number, repeat in cases_for(
+            bits, args.scale, args.repeat
+        ):
+            results[name] = run_benchmark(fn, number, repeat, args.warmup)
+            r = results[name]
+            print(
+                f"{name:40s} median {r['median_s'] * 1e6:12.1f}us  "
+                f"{r['ops_per_s']:12.1f}/s  (n={number}x{repeat})"
+            )
+
+    output = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.strict)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""
+End-to-end load generator for the identification and voting servers.
+
+Starts both servers in child processes on a temporary SQLite file, creates
+N synthetic citizens and drives each through the real client flow:
+REGISTER -> LOGIN -> GET_KEYINFO -> CAST_VOTE. Reports throughput and
+p50/p95/p99 latency per action and writes the results as JSON.
+
+Closed loop: --concurrency workers run voters back to back.
+Open loop:   voters arrive at --rate per second regardless of completions.
+             FLOW latency is measured from the scheduled arrival time, and
+             QUEUE_WAIT reports how long arrivals waited for one of the
+             --concurrency client slots; the per-action latencies exclude
+             that wait.
+
+Run from src/:  python -m benchmarks.load_test --voters 200 --out run.json
+With --profile-dir the servers also write per-action profiles there
+(--profile-every N for cProfile, --profile-slow-ms T for stack samples of
+slow requests; see utils/profiling.py).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from identification_client import IdentificationClient
+from identification_server import IdentificationServer
+from models.storage import open_users_db
+from utils.key_cache import KeyCache
+from utils.profiling import RequestProfiler
+from utils.protocol import FramedConnection
+from utils.rsa_utils import generate_rsa_keys
+from voting_client import VotingClient
+from voting_server import VotingServer
+
+ACTIONS = [
+    "REGISTER",
+    "LOGIN",
+    "GET_KEYINFO",
+    "CAST_VOTE",
+    "FLOW",
+    "QUEUE_WAIT",
+]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _run_server(
+    server_cls, port, db_file, workers, storage=None, profile=None
+):
+    profiler = None
+    if profile:
+        # (out_dir, sample_every, slow_ms), see utils/profiling.py.
+        out_dir, sample_every, slow_ms = profile
+        profiler = RequestProfiler(
+            out_dir, sample_every, slow_ms, name=server_cls.__name__
+        )
+
+        def stop(signum, frame):
+            # terminate() below: write the profiles before exiting.
+            profiler.close()
+            os._exit(0)
+
+        signal.signal(signal.SIGTERM, stop)
+    server_cls(
+        port=port,
+        db_file=db_file,
+        workers=workers,
+        storage=storage,
+        profiler=profiler,
+    ).start()
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadTest:
+    def __init__(self, ident_port, voting_port):
+        self.ident_port = ident_port
+        self.voting_port = voting_port
+        self.latencies = {action: [] for action in ACTIONS}
+        self.errors = {action: 0 for action in ACTIONS}
+        self._lock = threading.Lock()
+        # One key cache for the run, as a long-lived front end would have.
+        self.key_cache = KeyCache()
+
+    def _record(self, action, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self.latencies[action].append(seconds)
+            else:
+                self.errors[action] += 1
+
+    def _timed(self, action, fn, ok=bool):
+        """
+        Run fn() and record its latency under `action` if ok(result) holds,
+        otherwise count an error. Returns the result, or None on failure.
+        """
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            result = None
+        if not ok(result):
+            self._record(action, 0, ok=False)
+            return None
+        self._record(action, time.perf_counter() - start)
+        return result
+
+    def run_voter(self, citizen, scheduled=None):
+        """
+        One voter's full flow. For open-loop runs `scheduled` is the
+        perf_counter time the voter was due to arrive.
+        """
+        flow_start = time.perf_counter()
+        if scheduled is not None:
+            # Time spent waiting for a free slot after the arrival time.
+            self._record("QUEUE_WAIT", max(0, flow_start - scheduled))
+            flow_start = scheduled
+        cnp, first_name, last_name = citizen
+        ident = IdentificationClient(
+            port=self.ident_port, key_cache=self.key_cache
+        )
+        # A fresh key cache per voter, so GET_KEYINFO is really sent.
+        voter = VotingClient(
+            port=self.voting_port, cnp=cnp, key_cache=KeyCache(max_age=0)
+        )
+        try:
+            response = self._timed(
+                "REGISTER",
+                lambda: ident.register_citizen(cnp, first_name, last_name),
+                lambda r: isinstance(r, dict) and r.get("status") == "OK",
+            )
+            if not response:
+                return
+            voter.pin = response["pin"]
+
+            if not self._timed("LOGIN", voter.login):
+                return
+            if not self._timed("GET_KEYINFO", voter.load_public_key):
+                return
+            result = self._timed(
+                "CAST_VOTE",
+                lambda: voter.cast_vote(random.choice("ABC")),
+                lambda r: isinstance(r, str) and "VOTE_ACCEPTED" in r,
+            )
+            if result:
+                self._record("FLOW", time.perf_counter() - flow_start)
+        finally:
+            ident.close()
+            voter.close()
+
+    def closed_loop(self, citizens, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.run_voter, citizens))
+
+    def open_loop(self, citizens, rate, max_in_flight):
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            start = time.perf_counter()
+            for i, citizen in enumerate(citizens):
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.run_voter, citizen, scheduled)
+
+    def report(self, elapsed):
+        summary = {}
+        for action in ACTIONS:
+            values = sorted(self.latencies[action])
+            summary[action] = {
+                "count": len(values),
+                "errors": self.errors[action],
+                "throughput_per_s": len(values) / elapsed if elapsed else 0,
+                "p50_ms": _ms(percentile(values, 50)),
+                "p95_ms": _ms(percentile(values, 95)),
+                "p99_ms": _ms(percentile(values, 99)),
+                "max_ms": _ms(values[-1] if values else None),
+            }
+        return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket server load test.")
+    parser.add_argument("--voters", type=int, default=100)
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--rate", type=float, default=20.0, help="open-loop arrivals/s"
+    )
+    parser.add_argument("--server-workers", type=int, default=8)
+    parser.add_argument("--key-bits", type=int, default=1024)
+    parser.add_argument("--storage", help="sqlite or sharded[:N]")
+    parser.add_argument("--out", help="write JSON results to this file")
+    parser.add_argument(
+        "--profile-dir", help="profile the servers into this directory"
+    )
+    parser.add_argument(
+        "--profile-every", type=int, help="cProfile one request in N"
+    )
+    parser.add_argument(
+        "--profile-slow-ms",
+        type=float,
+        help="sample the stacks of requests slower than this",
+    )
+    args = parser.parse_args()
+    # RequestProfiler would raise inside the server processes, and the run
+    # would only show up as a startup timeout.
+    profiling = (
+        args.profile_every is not None or args.profile_slow_ms is not None
+    )
+    if args.profile_dir and not profiling:
+        parser.error(
+            "--profile-dir needs --profile-every and/or --profile-slow-ms"
+        )
+    if profiling and not args.profile_dir:
+        parser.error("--profile-every/--profile-slow-ms need --profile-dir")
+    if args.profile_every is not None and args.profile_every < 1:
+        parser.error("--profile-every must be at least 1")
+
+    tmp_dir = tempfile.mkdtemp(prefix="evote-load-")
+    db_file = os.path.join(tmp_dir, "load.sqlite")
+    # Create schema and keys up front so both servers share one key pair.
+    db = open_users_db(db_file, args.storage)
+    db.save_keys(*generate_rsa_keys(args.key_bits))
+    db.close()
+
+    profile = None
+    if args.profile_dir:
+        profile = (args.profile_dir, args.profile_every, args.profile_slow_ms)
+
+    ident_port, voting_port = _free_port(), _free_port()
+    servers = [
+        multiprocessing.Process(
+            target=_run_server,
+            args=(
+                cls,
+                port,
+                db_file,
+                args.server_workers,
+                args.storage,
+                profile,
+            ),
+            daemon=True,
+        )
+        for cls, port in (
+            (IdentificationServer, ident_port),
+            (VotingServer, voting_port),
+        )
+    ]
+    for server in servers:
+        server.start()
+    _wait_for_port(ident_port)
+    _wait_for_port(voting_port)
+
+    citizens = [
+        (str(6000000000000 + i), f"First{i}", f"Last{i}")
+        for i in range(args.voters)
+    ]
+    test = LoadTest(ident_port, voting_port)
+    start = time.perf_counter()
+    try:
+        if args.mode == "closed":
+            test.closed_loop(citizens, args.concurrency)
+        else:
+            test.open_loop(citizens, args.rate, args.concurrency)
+    finally:
+        elapsed = time.perf_counter() - start
+        # Server-side view of the run (request latency, PIN hashing,
+        # commits), read before the servers are stopped.
+        server_stats = {}
+        for name, port in (
+            ("identification", ident_port),
+            ("voting", voting_port),
+        ):
+            conn = FramedConnection("localhost", port)
+            try:
+                server_stats[name] = conn.request({"action": "STATS"})
+            except (OSError, EOFError) as e:
+                server_stats[name] = {"error": str(e)}
+            finally:
+                conn.close()
+        for server in servers:
+            server.terminate()
+            server.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "actions": test.report(elapsed),
+        "server_stats": server_stats,
+    }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Bulk voter import: stream (cnp, first_name, last_name) records from a CSV
+or JSONL file, hash PINs in a process pool and insert them in large
+executemany batches. The generated PINs are written to a CSV
+distribution file (cnp,pin) for mailing to voters.
+
+Usage: python bulk_import.py citizens.csv pins.csv [--db voting_db.sqlite]
+"""
+
+import argparse
+import csv
+import json
+import secrets
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash
+from models.db import deterministic_hash
+from models.storage import open_users_db
+
+
+def read_records(path):
+    """
+    Yield (cnp, first_name, last_name) tuples from a .jsonl file (one object
+    per line) or a CSV file with a cnp,first_name,last_name header.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    obj = json.loads(line)
+                    yield obj["cnp"], obj["first_name"], obj["last_name"]
+        else:
+            for row in csv.DictReader(f):
+                yield row["cnp"], row["first_name"], row["last_name"]
+
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_voters(
+    db,
+    records,
+    pin_writer,
+    batch_size=5000,
+    commit_every=20,
+    workers=None,
+    duplicates_writer=None,
+):
+    """
+    Import voters from an iterable of (cnp, first_name, last_name).
+    Duplicate CNPs (already in users, or repeated in the input) are skipped
+    and optionally written to duplicates_writer. A commit is issued every
+    `commit_every` batches, and PINs are written to pin_writer only once
+    their voters are committed: an import that fails part way never hands
+    out PINs for voters missing from the database, and a rerun issues PINs
+    for exactly those voters. Returns (imported, duplicates).
+    """
+    imported = duplicates = batches = 0
+    uncommitted_pins = []  # (cnp, pin) rows waiting for the next commit
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(records, batch_size):
+            fresh = {}
+            for cnp, first_name, last_name in batch:
+                cnp = cnp.strip()
+                fresh.setdefault(deterministic_hash(cnp), []).append(
+                    (cnp, first_name.strip(), last_name.strip())
+                )
+            existing = db.existing_cnps(fresh)
+
+            accepted = []
+            for hashed_cnp, entries in fresh.items():
+                skipped = entries if hashed_cnp in existing else entries[1:]
+                if hashed_cnp not in existing:
+                    accepted.append((hashed_cnp, entries[0]))
+                duplicates += len(skipped)
+                if duplicates_writer:
+                    for cnp, _, _ in skipped:
+                        duplicates_writer.writerow([cnp])
+
+            pins = [
+                "".join(str(secrets.randbelow(10)) for _ in range(4))
+                for _ in accepted
+            ]
+            # PBKDF2 dominates; spread it across processes.
+            hashed_pins = pool.map(
+                generate_password_hash,
+                pins,
+                chunksize=max(1, len(pins) // (4 * (workers or 4))),
+            )
+            voters = [
+                (
+                    hashed_cnp,
+                    deterministic_hash(first_name),
+                    deterministic_hash(last_name),
+                    hashed_pin,
+                )
+                for (
+                    hashed_cnp,
+                    (_, first_name, last_name),
+                ), hashed_pin in zip(accepted, hashed_pins)
+            ]
+
+            batches += 1
+            commit = batches % commit_every == 0
+            db.bulk_insert_voters(voters, commit=commit)
+            uncommitted_pins += [
+                (cnp, pin) for (_, (cnp, _, _)), pin in zip(accepted, pins)
+            ]
+            if commit:
+                pin_writer.writerows(uncommitted_pins)
+                uncommitted_pins = []
+            imported += len(voters)
+
+            elapsed = time.perf_counter() - started
+            print(
+                f"[BulkImport] {imported} imported, {duplicates} duplicates, "
+                f"{imported / elapsed:.0f} voters/s"
+            )
+    db.commit()
+    pin_writer.writerows(uncommitted_pins)
+    return imported, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk voter import.")
+    parser.add_argument("source", help="CSV or .jsonl file of citizens")
+    parser.add_argument("pins_out", help="CSV file to write cnp,pin rows to")
+    parser.add_argument("--db", default="voting_db.sqlite")
+    parser.add_argument("--storage", help="sqlite or sharded[:N]")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--commit-every", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--duplicates-out", help="CSV file to list skipped duplicate CNPs"
+    )
+    args = parser.parse_args()
+
+    db = open_users_db(args.db, args.storage)
+    dup_file = None
+    if args.duplicates_out:
+        dup_file = open(args.duplicates_out, "w", newline="")
+    try:
+        # Line-buffered: PINs of committed voters reach the file at once.
+        with open(args.pins_out, "w", newline="", buffering=1) as pins_file:
+            pin_writer = csv.writer(pins_file)
+            pin_writer.writerow(["cnp", "pin"])
+            imported, duplicates = import_voters(
+                db,
+                read_records(args.source),
+                pin_writer,
+                batch_size=args.batch_size,
+                commit_every=args.commit_every,
+                workers=args.workers,
+                duplicates_writer=csv.writer(dup_file) if dup_file else None,
+            )
+    finally:
+        if dup_file:
+            dup_file.close()
+        db.close()
+    print(f"[BulkImport] Done: {imported} imported, {duplicates} duplicates.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import queue
+import threading
+from contextlib import contextmanager
+from identification_client import IdentificationClient
+from utils.protocol import FramedConnection
+from utils.key_cache import KeyCache
+from voting_client import VotingClient
+
+
+class BackendPool:
+    """
+    Bounded set of persistent framed connections to one backend server.
+    At most max_connections are open at once; borrowers wait for a free one.
+    """
+
+    def __init__(self, host, port, max_connections=8, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(
+                f"[ClientPool] No free connection to {self.host}:{self.port}"
+            )
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = FramedConnection(self.host, self.port, self.timeout)
+            try:
+                yield conn
+            except Exception:
+                # The stream may be mid-response; never hand it out again.
+                conn.close()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ClientPool:
+    """
+    Process-wide pool of backend connections for the web tier, plus a
+    shared cache of the servers' public keys.
+    """
+
+    def __init__(
+        self,
+        voting_host="localhost",
+        voting_port=65432,
+        ident_host="localhost",
+        ident_port=65430,
+        max_connections=8,
+        key_cache_path=None,
+    ):
+        self.voting = BackendPool(voting_host, voting_port, max_connections)
+        self.identification = BackendPool(
+            ident_host, ident_port, max_connections
+        )
+        self.key_cache = KeyCache(key_cache_path)
+
+    @contextmanager
+    def voting_client(self, cnp="", pin="", token=None):
+        """
+        Borrow a VotingClient for one voter over a pooled connection,
+        authenticated either by CNP+PIN or by a session token.
+        """
+        with self.voting.connection() as conn:
+            client = VotingClient(
+                self.voting.host,
+                self.voting.port,
+                cnp,
+                pin,
+                conn=conn,
+                key_cache=self.key_cache,
+            )
+            client.token = token
+            yield client
+
+    @contextmanager
+    def identification_client(self):
+        with self.identification.connection() as conn:
+            yield IdentificationClient(
+                self.identification.host,
+                self.identification.port,
+                conn=conn,
+                key_cache=self.key_cache,
+            )
+
+    def close(self):
+        self.voting.close()
+        self.identification.close()
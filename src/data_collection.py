@@ -1,81 +1,343 @@
-import sqlite3
-import pickle
+import os
+from concurrent.futures import ProcessPoolExecutor
+from models.candidates import BALLOT_CODES
+from models.db import UsersDb
+from models.storage import open_users_db
+from utils.rsa_utils import decrypt
+from utils import paillier_utils
+
+
+def decrypt_vote_blob(ciphertext_blob, private_key):
+    """
+    Convert the BLOB -> int -> decrypt -> retrieve the plaintext string.
+    """
+    if paillier_utils.is_paillier_key(private_key):
+        return decrypt_one_hot_blob(ciphertext_blob, private_key)
+
+    # Convert bytes to an integer
+    ciphertext_int = int.from_bytes(ciphertext_blob, 'big')
+
+    # RSA decryption: m = c^d mod n (CRT path when the key supports it)
+    decrypted_int = decrypt(ciphertext_int, private_key)
+
+    # Convert decrypted int back to bytes
+    vote_bytes = decrypted_int.to_bytes(
+        (decrypted_int.bit_length() + 7) // 8, 'big')
+
+    # Decode to get the original vote string (e.g. "A")
+    return vote_bytes.decode(errors='ignore')
+
+
+def decrypt_one_hot_blob(ciphertext_blob, private_key):
+    """
+    Decrypt a stored Paillier ballot (one ciphertext per candidate) and return
+    the chosen candidate code, or 'INVALID' if the vector is not one-hot.
+    """
+    vector = paillier_utils.unpack_vector(ciphertext_blob, private_key)
+    plain = [paillier_utils.decrypt(c, private_key) for c in vector]
+    if len(plain) == len(BALLOT_CODES) and sum(plain) == 1 and 1 in plain:
+        return BALLOT_CODES[plain.index(1)]
+    return 'INVALID'
+
+
+def count_votes(votes):
+    """
+    Streaming tally: count an iterable of decrypted votes without
+    materialising it.
+    """
+    counts = {}
+    for v in votes:
+        counts[v] = counts.get(v, 0) + 1
+    return counts
+
+
+def merge_counts(total, counts):
+    for v, count in counts.items():
+        total[v] = total.get(v, 0) + count
+    return total
+
+
+# Per-process state for the parallel tally workers (set by _init_tally_worker).
+_worker_private_key = None
+_worker_partitions = {}
+
+
+def _init_tally_worker(private_key):
+    global _worker_private_key
+    _worker_private_key = private_key
+
+
+def _tally_vote_range(spec, first_id, last_id):
+    """
+    Decrypt and count the votes with first_id <= vote_id <= last_id of the
+    partition described by `spec` (UsersDb.partition_spec). Runs inside a
+    worker process, which opens each partition once.
+    """
+    partition = _worker_partitions.get(spec)
+    if partition is None:
+        db_file, id_stride, id_offset = spec
+        partition = UsersDb(db_file, id_stride=id_stride, id_offset=id_offset)
+        _worker_partitions[spec] = partition
+    return count_votes(
+        decrypt_vote_blob(enc_blob, _worker_private_key)
+        for _, enc_blob in partition.iter_votes(first_id - 1, last_id))
 
 
 class DataCollection:
-    def __init__(self, db_file="voting_db.sqlite"):
+    def __init__(self, db_file="voting_db.sqlite", db=None, storage=None,
+                 profiler=None):
         self.db_file = db_file
+        # Optional utils.profiling.RequestProfiler for tally runs.
+        self.profiler = profiler
+        # Votes and keys are read through a storage backend
+        # (models/storage.py); `db` shares one that is already open.
+        self._owns_db = db is None
+        self.db = db if db is not None else open_users_db(db_file, storage)
         # We load the RSA private key from the 'keys' table
         self.private_key = None
-        self._connect_and_load_key()
+        self._load_keys()
 
-    def _connect_and_load_key(self):
+    def _load_keys(self):
         """
-        Connect to the DB and load the private key from the 'keys' table at row id=1.
+        Load the private key (and the ballot key, if ballots use their own
+        scheme) from the storage backend.
         """
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-        cursor = self.conn.cursor()
-
-        # keys table must have (public_key, private_key) as pickled BLOBs
-        cursor.execute("SELECT private_key FROM keys WHERE id = 1")
-        row = cursor.fetchone()
-        if not row:
+        keys = self.db.load_keys()
+        if not keys:
             raise ValueError(
                 "[DataCollection] No keys found in DB. Cannot decrypt votes.")
+        self.private_key = keys[1]
+        # self.private_key is (d, n, p, q, dP, dQ, qInv), or (d, n) for old keys
 
-        pickled_priv = row[0]
-        self.private_key = pickle.loads(pickled_priv)
-        # self.private_key should now be (d, n)
+        # Ballots use the RSA key unless a separate ballot scheme was chosen
+        # at key generation (see UsersDb.save_ballot_keys).
+        self.ballot_scheme = 'rsa'
+        self.vote_key = self.private_key
+        ballot_keys = self.db.load_ballot_keys()
+        if ballot_keys:
+            self.ballot_scheme, _, self.vote_key = ballot_keys
 
     def decrypt_vote(self, ciphertext_blob):
         """
         Convert the BLOB -> int -> decrypt -> retrieve the plaintext string.
         """
-        # Convert bytes to an integer
-        ciphertext_int = int.from_bytes(ciphertext_blob, 'big')
-
-        # RSA decryption: m = c^d mod n
-        d, n = self.private_key
-        decrypted_int = pow(ciphertext_int, d, n)
+        return decrypt_vote_blob(ciphertext_blob, self.vote_key)
 
-        # Convert decrypted int back to bytes
-        vote_bytes = decrypted_int.to_bytes(
-            (decrypted_int.bit_length() + 7) // 8, 'big')
-
-        # Decode to get the original vote string (e.g. "A")
-        return vote_bytes.decode(errors='ignore')
+    def iter_votes(self, after_id=0, up_to_id=None, batch_size=1000):
+        """
+        Generator over the decrypted votes with after_id < vote_id <= up_to_id,
+        streamed from every partition of the backend in batches.
+        """
+        for partition in self.db.vote_partitions():
+            for _, enc_blob in partition.iter_votes(
+                    after_id, up_to_id, batch_size):
+                yield self.decrypt_vote(enc_blob)
 
     def collect_votes(self):
         """
         Fetch all encrypted votes from 'votes' table, decrypt them, and return a list of strings.
         """
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT encrypted_vote FROM votes")
-        rows = cursor.fetchall()
+        return list(self.iter_votes())
 
-        decrypted_votes = []
-        for (enc_blob,) in rows:
-            vote_str = self.decrypt_vote(enc_blob)
-            decrypted_votes.append(vote_str)
-        return decrypted_votes
+    def _profiled(self, label, tally):
+        if self.profiler is None:
+            return tally()
+        with self.profiler.request(label):
+            return tally()
+
+    @property
+    def provisional(self):
+        """
+        True when get_statistics() and get_statistics_incremental() return
+        the homomorphic tally (Paillier ballots). Ballots are not proven to
+        be one-hot, so those counts are provisional until recount() has
+        decrypted every ballot.
+        """
+        return self.ballot_scheme == paillier_utils.PAILLIER
 
     def get_statistics(self):
         """
         Decrypt all votes, tally them, and return a dictionary of counts, e.g.: {'A': 5, 'B': 2, ...}.
+        See `provisional` for Paillier ballots.
+        """
+        return self._profiled('get_statistics', self._get_statistics)
+
+    def _get_statistics(self):
+        if self.ballot_scheme == paillier_utils.PAILLIER:
+            return self.get_homomorphic_statistics()
+        return count_votes(self.iter_votes())
+
+    def get_homomorphic_statistics(self, check=True):
+        """
+        Paillier mode: decrypt the running encrypted tally kept by the voting
+        server. One decryption per candidate, however many ballots were cast.
+
+        The server only checks a ballot's shape, so a ballot worth more than
+        one vote would inflate the tally. With check=True the counts must
+        add up to the number of ballots in the tally, or ValueError is
+        raised; recount() decrypts the ballots one by one to find the
+        culprits. The check only catches ballots that change the total:
+        invalid ballots that cancel out (e.g. (2, 0, 0) and (0, 0, 0)) pass
+        it, which is why these results are provisional.
         """
-        all_votes = self.collect_votes()
+        aggregate = None
+        ballots = 0
+        for partition in self.db.vote_partitions():
+            tally = partition.load_encrypted_tally()
+            if tally is not None:
+                # Partitions keep separate tallies; add them up first.
+                ciphertexts, count = tally
+                aggregate = paillier_utils.add_vectors(
+                    aggregate, ciphertexts, self.vote_key)
+                ballots += count
         stats = {}
-        for v in all_votes:
-            stats[v] = stats.get(v, 0) + 1
+        for code, ciphertext in zip(BALLOT_CODES, aggregate or []):
+            count = paillier_utils.decrypt(ciphertext, self.vote_key)
+            if count:
+                stats[code] = count
+        if check and sum(stats.values()) != ballots:
+            raise ValueError(
+                f'[DataCollection] Encrypted tally holds '
+                f'{sum(stats.values())} votes for {ballots} ballots; '
+                f'run a recount')
+        return stats
+
+    def _tally_range(self, partition, after_id, up_to_id):
+        """
+        Decrypt and count the votes of one partition with
+        after_id < vote_id <= up_to_id.
+        """
+        return count_votes(
+            self.decrypt_vote(enc_blob)
+            for _, enc_blob in partition.iter_votes(after_id, up_to_id))
+
+    def load_checkpoint(self, partition):
+        """
+        Return (last_vote_id, counts) from a partition's tally checkpoint,
+        or (0, {}).
+        """
+        return partition.load_tally_checkpoint()
+
+    def save_checkpoint(self, partition, last_vote_id, counts):
+        partition.save_tally_checkpoint(last_vote_id, counts)
+
+    def get_statistics_incremental(self):
+        """
+        Same result as get_statistics(), but only the votes above the stored
+        watermark are decrypted; the running counts are persisted afterwards.
+        Each partition keeps its own watermark. In Paillier mode the
+        encrypted tally already is incremental.
+        """
+        return self._profiled('get_statistics_incremental',
+                              self._get_statistics_incremental)
+
+    def _get_statistics_incremental(self):
+        if self.ballot_scheme == paillier_utils.PAILLIER:
+            return self.get_homomorphic_statistics()
+
+        stats = {}
+        for partition in self.db.vote_partitions():
+            last_vote_id, counts = self.load_checkpoint(partition)
+            max_id = partition.max_vote_id()
+            if max_id < last_vote_id:
+                # The votes table was reset since the checkpoint was taken.
+                last_vote_id, counts = 0, {}
+
+            if max_id > last_vote_id:
+                merge_counts(
+                    counts, self._tally_range(partition, last_vote_id, max_id))
+                self.save_checkpoint(partition, max_id, counts)
+            merge_counts(stats, counts)
+        return stats
+
+    def recount(self):
+        """
+        Full from-scratch tally, checked against the incremental checkpoint.
+        Returns (stats, checkpoint_ok); the checkpoint is rewritten from the
+        fresh tally either way. In Paillier mode every ballot is decrypted and
+        checked against the encrypted tally instead.
+        """
+        if self.ballot_scheme == paillier_utils.PAILLIER:
+            stats = count_votes(self.iter_votes())
+            tally = self.get_homomorphic_statistics(check=False)
+            if stats != tally:
+                print("[DataCollection] Encrypted tally mismatch:",
+                      tally, "!= recount", stats)
+            return stats, stats == tally
+
+        stats = {}
+        checkpoint_ok = True
+        for partition in self.db.vote_partitions():
+            last_vote_id, counts = self.load_checkpoint(partition)
+            max_id = partition.max_vote_id()
+            upto = min(last_vote_id, max_id)
+
+            partial = self._tally_range(partition, 0, upto)
+            if last_vote_id > max_id or partial != counts:
+                checkpoint_ok = False
+                print("[DataCollection] Checkpoint mismatch:",
+                      counts, "!= recount", partial)
+
+            merge_counts(partial, self._tally_range(partition, upto, max_id))
+            self.save_checkpoint(partition, max_id, partial)
+            merge_counts(stats, partial)
+        return stats, checkpoint_ok
+
+    def get_statistics_parallel(self, workers=None, chunk_size=5000):
+        """
+        Same result as get_statistics(), but every partition is split into
+        vote_id ranges of chunk_size rows which are decrypted in a process
+        pool of `workers` processes (default: os.cpu_count()). Partitions
+        that cannot be reopened in another process (the in-memory backend)
+        are tallied here instead.
+        """
+        stats = {}
+        jobs = []
+        for partition in self.db.vote_partitions():
+            spec = partition.partition_spec()
+            if spec is None:
+                merge_counts(stats, self._tally_range(partition, 0, None))
+                continue
+            jobs += [(spec, first, last)
+                     for first, last in partition.vote_id_chunks(chunk_size)]
+        if not jobs:
+            return stats
+
+        workers = workers or os.cpu_count() or 1
+        workers = min(workers, len(jobs))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_tally_worker,
+            initargs=(self.vote_key,),
+        ) as pool:
+            for partial in pool.map(_tally_vote_range, *zip(*jobs)):
+                merge_counts(stats, partial)
         return stats
 
     def close(self):
-        self.conn.close()
+        if self._owns_db:
+            self.db.close()
 
 
 if __name__ == "__main__":
+    import sys
+
     data_collector = DataCollection("voting_db.sqlite")
-    stats = data_collector.get_statistics()
+    if sys.argv[1:2] == ["recount"]:
+        # python data_collection.py recount
+        stats, checkpoint_ok = data_collector.recount()
+        print("[DataCollection] Checkpoint matches recount:", checkpoint_ok)
+    elif len(sys.argv) > 1:
+        # python data_collection.py <workers> [chunk_size]
+        stats = data_collector.get_statistics_parallel(
+            workers=int(sys.argv[1]),
+            chunk_size=int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+        )
+    else:
+        stats = data_collector.get_statistics()
+        if data_collector.provisional:
+            print("[DataCollection] Provisional: from the encrypted tally; "
+                  "run 'recount' to check every ballot.")
     data_collector.close()
 
     print("[DataCollection] Stats:", stats)
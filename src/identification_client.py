@@ -1,22 +1,68 @@
 import socket
 import pickle
 from utils.rsa_utils import encrypt, str_to_int
+from utils.protocol import FramedConnection
+from utils.key_cache import default_key_cache
 
 
 class IdentificationClient:
-    def __init__(self, host="localhost", port=65430, server_pub_key=None):
+    def __init__(
+        self,
+        host="localhost",
+        port=65430,
+        server_pub_key=None,
+        framed=True,
+        conn=None,
+        key_cache=None,
+    ):
         self.host = host
         self.port = port
         self.server_pub_key = server_pub_key
+        # framed=True reuses one persistent connection for every request;
+        # framed=False sends one pickle per connection (legacy protocol).
+        # `conn` lets a caller lend an existing FramedConnection (see ClientPool).
+        self.framed = framed or conn is not None
+        if conn is None and framed:
+            conn = FramedConnection(host, port)
+        self._conn = conn
+        self.key_cache = key_cache or default_key_cache
+
+    def _send_request(self, request):
+        """
+        Send one request and return the raw response: bytes for server
+        status messages, otherwise the decoded value.
+        """
+        if self.framed:
+            return self._conn.request(request)
 
-    def get_public_key(self):
-        request = {"action": "GET_PUBKEY"}
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.host, self.port))
             s.sendall(pickle.dumps(request))
             response_data = s.recv(4096)
         try:
-            pub_key = pickle.loads(response_data)
+            return pickle.loads(response_data)
+        except Exception:
+            return response_data
+
+    def get_public_key(self):
+        # Cached, fingerprint-validated lookup first; plain GET_PUBKEY is the
+        # fallback for servers without GET_KEYINFO.
+        pub_key = self.key_cache.get(
+            self.host,
+            self.port,
+            lambda fingerprint: self._send_request(
+                {"action": "GET_KEYINFO", "fingerprint": fingerprint}
+            ),
+        )
+        if pub_key:
+            self.server_pub_key = pub_key
+            return pub_key
+
+        request = {"action": "GET_PUBKEY"}
+        try:
+            pub_key = self._send_request(request)
+            if not isinstance(pub_key, tuple):
+                raise ValueError(pub_key)
             self.server_pub_key = pub_key
             print("[Client] Public key retrieved:", self.server_pub_key)
             return pub_key
@@ -44,18 +90,64 @@ class IdentificationClient:
             "first_name": encrypted_first_name,
             "last_name": encrypted_last_name,
         }
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.host, self.port))
-            s.sendall(pickle.dumps(request))
-            response_data = s.recv(4096)
-        try:
-            response = pickle.loads(response_data)
-            return response
-        except Exception:
+        response = self._send_request(request)
+        if isinstance(response, bytes):
             return {
                 "status": "ERROR",
-                "message": response_data.decode(errors="ignore"),
+                "message": response.decode(errors="ignore"),
             }
+        return response
+
+    def register_citizens(self, citizens):
+        """
+        Register many (cnp, first_name, last_name) citizens with a single
+        REGISTER_BATCH request. Returns one result dict per citizen.
+        """
+        if not self.server_pub_key:
+            self.get_public_key()
+            if not self.server_pub_key:
+                raise Exception("Server public key not available.")
+
+        registrations = [
+            {
+                "cnp": encrypt(str_to_int(cnp), self.server_pub_key),
+                "first_name": encrypt(
+                    str_to_int(first_name), self.server_pub_key
+                ),
+                "last_name": encrypt(
+                    str_to_int(last_name), self.server_pub_key
+                ),
+            }
+            for cnp, first_name, last_name in citizens
+        ]
+        response = self._send_request(
+            {"action": "REGISTER_BATCH", "registrations": registrations}
+        )
+        if isinstance(response, dict) and "results" in response:
+            return response["results"]
+        message = (
+            response.decode(errors="ignore")
+            if isinstance(response, bytes)
+            else str(response)
+        )
+        return [{"status": "ERROR", "message": message} for _ in citizens]
+
+    def get_stats(self):
+        """
+        The server's metrics snapshot (STATS action). Always sent framed: a
+        snapshot can be larger than the legacy protocol's single read.
+        """
+        if self.framed:
+            return self._conn.request({"action": "STATS"})
+        conn = FramedConnection(self.host, self.port)
+        try:
+            return conn.request({"action": "STATS"})
+        finally:
+            conn.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
 
 
 if __name__ == "__main__":
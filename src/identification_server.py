@@ -1,16 +1,96 @@
+import multiprocessing
 import socket
 import pickle
-from models.db import UsersDb
-from utils.rsa_utils import generate_rsa_keys, decrypt, int_to_str
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from models.storage import open_users_db
+from utils.worker_pool import ConnectionWorkerPool
+from utils.protocol import is_framed, serve_framed
+from utils.rsa_utils import (
+    generate_rsa_keys,
+    decrypt,
+    int_to_str,
+    key_fingerprint,
+)
+from utils.event_log import LOG
+from utils.key_cache import key_info
+from utils.metrics import REGISTRY, serve_metrics
+
+
+# Actions with their own request metrics; anything else counts as "OTHER".
+ACTIONS = ("GET_PUBKEY", "GET_KEYINFO", "REGISTER", "REGISTER_BATCH")
+
+# Private key of a REGISTER_BATCH decryption worker process.
+_worker_private_key = None
+
+
+def _init_decrypt_worker(private_key):
+    global _worker_private_key
+    _worker_private_key = private_key
+
+
+def _decrypt_registration(fields, private_key=None):
+    """
+    Decrypt one (cnp, first_name, last_name) triple of RSA ciphertexts with
+    private_key, or in a worker process with the key it was started with.
+    Returns the plaintext tuple, or an error string.
+    """
+    if private_key is None:
+        private_key = _worker_private_key
+    try:
+        return tuple(int_to_str(decrypt(c, private_key)) for c in fields)
+    except Exception as e:
+        return f"[IDServer] Decryption error: {e}"
 
 
 class IdentificationServer:
     def __init__(
-        self, host="localhost", port=65430, db_file="voting_db.sqlite"
+        self,
+        host="localhost",
+        port=65430,
+        db_file="voting_db.sqlite",
+        workers=8,
+        queue_depth=64,
+        idle_timeout=60,
+        read_timeout=5,
+        batch_pool_threshold=64,
+        batch_workers=None,
+        storage=None,
+        db=None,
+        metrics_port=None,
+        profiler=None,
     ):
         self.host = host
         self.port = port
-        self.db = UsersDb(db_file)
+        # Metrics for the STATS action and, with metrics_port, a Prometheus
+        # text endpoint at http://host:metrics_port/metrics.
+        self.metrics = REGISTRY
+        self.metrics_port = metrics_port
+        # Optional utils.profiling.RequestProfiler (cProfile on 1-in-N
+        # requests and/or stack samples of slow ones, per action).
+        self.profiler = profiler
+        # Concurrency: worker threads handling connections, and how many
+        # accepted connections may wait for a free worker.
+        self.workers = workers
+        self.queue_depth = queue_depth
+        # Seconds a persistent (framed) connection may sit idle; idle
+        # connections wait in the pool's selector, not in a worker.
+        self.idle_timeout = idle_timeout
+        # Seconds a client may take to send its first bytes, or the rest of
+        # a request it has started.
+        self.read_timeout = read_timeout
+        # REGISTER_BATCH requests with at least batch_pool_threshold records
+        # are decrypted and PIN-hashed in a process pool of batch_workers.
+        self.batch_pool_threshold = batch_pool_threshold
+        self.batch_workers = batch_workers
+        self._batch_pool = None
+        self._batch_pool_lock = threading.Lock()
+        # Storage backend: "sqlite" or "sharded:N" (default from
+        # EVOTE_STORAGE, see models/storage.py); `db` shares one that is
+        # already open, such as a MemoryUsersDb used by a test.
+        self.db = db if db is not None else open_users_db(db_file, storage)
         keys = self.db.load_keys()
         if keys is None:
             print("[IDServer] No keys found in DB, generating new RSA keys...")
@@ -21,19 +101,81 @@ class IdentificationServer:
         else:
             self.public_key, self.private_key = keys
             print("[IDServer] Loaded RSA keys from DB.")
+        self.key_fingerprint = key_fingerprint(self.public_key)
+
+    def _get_batch_pool(self):
+        with self._batch_pool_lock:
+            if self._batch_pool is None:
+                # Workers are not forked from this process: it runs worker
+                # threads, the log writer and open database connections,
+                # whose locks a forked child could inherit mid-use.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                )
+                self._batch_pool = ProcessPoolExecutor(
+                    max_workers=self.batch_workers,
+                    mp_context=context,
+                    initializer=_init_decrypt_worker,
+                    initargs=(self.private_key,),
+                )
+            return self._batch_pool
+
+    def _shutdown_batch_pool(self):
+        with self._batch_pool_lock:
+            if self._batch_pool is not None:
+                self._batch_pool.shutdown()
+                self._batch_pool = None
 
     def start(self):
+        pool = ConnectionWorkerPool(
+            self.handle_client,
+            self.workers,
+            self.queue_depth,
+            "IDServer",
+            self.idle_timeout,
+        )
+        self.metrics.set_gauge(
+            "active_connections", lambda: pool.active, server="identification"
+        )
+        self.metrics.set_gauge(
+            "queue_depth", pool.pending, server="identification"
+        )
+        self.metrics.set_gauge(
+            "idle_connections", pool.idle, server="identification"
+        )
+        if self.metrics_port:
+            serve_metrics(self.host, self.metrics_port, self.metrics)
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((self.host, self.port))
-            s.listen()
-            print(f"[IDServer] Listening on {self.host}:{self.port}")
-            while True:
-                conn, addr = s.accept()
-                print(f"[IDServer] Connection from {addr}")
-                self.handle_client(conn)
-                conn.close()
+            s.listen(self.queue_depth)
+            print(
+                f"[IDServer] Listening on {self.host}:{self.port} "
+                f"({self.workers} workers)"
+            )
+            try:
+                while True:
+                    conn, addr = s.accept()
+                    LOG.debug(
+                        "connection",
+                        server="identification",
+                        addr=addr[0],
+                        port=addr[1],
+                    )
+                    pool.submit(conn, addr)
+            finally:
+                pool.shutdown()
+                self._shutdown_batch_pool()
 
     def handle_client(self, conn):
+        try:
+            framed = is_framed(conn, self.read_timeout)
+        except (socket.timeout, ConnectionError):
+            return None
+        # Framed clients keep the connection open for many requests.
+        if framed:
+            return self.serve_framed(conn)
+
         data = conn.recv(4096)
         if not data:
             return
@@ -44,10 +186,63 @@ class IdentificationServer:
             conn.sendall(f"[IDServer] Invalid request: {e}".encode())
             return
 
+        response = self.process_request(request)
+        if isinstance(response, bytes):
+            conn.sendall(response)
+        else:
+            conn.sendall(pickle.dumps(response))
+
+    def serve_framed(self, conn):
+        """
+        Answer the requests waiting on a framed connection. Returns itself
+        so the worker pool calls it again when the next request arrives.
+        """
+        if serve_framed(
+            conn,
+            self.process_request,
+            self.read_timeout,
+            lambda e: f"[IDServer] Invalid request: {e}".encode(),
+        ):
+            return self.serve_framed
+        return None
+
+    def process_request(self, request):
+        """
+        Handle one decoded request and return the response: bytes for
+        status/error messages, otherwise a value to be serialised.
+        """
+        action = request.get("action") if isinstance(request, dict) else None
+        if action == "STATS":
+            return self.metrics.snapshot()
+        if action not in ACTIONS:
+            action = "OTHER"
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                return self._process_request(request)
+            with self.profiler.request(action):
+                return self._process_request(request)
+        finally:
+            us = int((time.perf_counter() - start) * 1e6)
+            labels = {"server": "identification", "action": action}
+            self.metrics.inc("requests", **labels)
+            self.metrics.observe("request_latency", us, **labels)
+            LOG.debug("request", us=us, **labels)
+
+    def _process_request(self, request):
+        if not isinstance(request, dict):
+            return b"[IDServer] Invalid request: expected a dict"
+
         action = request.get("action")
         if action == "GET_PUBKEY":
             # Send the server's public key to the client.
-            conn.sendall(pickle.dumps(self.public_key))
+            return self.public_key
+        elif action == "GET_KEYINFO":
+            return key_info(
+                self.public_key,
+                self.key_fingerprint,
+                request.get("fingerprint"),
+            )
         elif action == "REGISTER":
             try:
                 # Expect encrypted fields: they are integers encrypted with RSA.
@@ -56,36 +251,92 @@ class IdentificationServer:
                 encrypted_last_name = request.get("last_name")
 
                 # Decrypt each field using the private key.
-                cnp_int = decrypt(encrypted_cnp, self.private_key)
-                first_name_int = decrypt(
-                    encrypted_first_name, self.private_key
-                )
-                last_name_int = decrypt(encrypted_last_name, self.private_key)
+                with self.metrics.timer("rsa_decrypt"):
+                    cnp_int = decrypt(encrypted_cnp, self.private_key)
+                    first_name_int = decrypt(
+                        encrypted_first_name, self.private_key
+                    )
+                    last_name_int = decrypt(
+                        encrypted_last_name, self.private_key
+                    )
 
                 # Convert decrypted integers back to strings.
                 cnp = int_to_str(cnp_int)
                 first_name = int_to_str(first_name_int)
                 last_name = int_to_str(last_name_int)
             except Exception as e:
-                conn.sendall(f"[IDServer] Decryption error: {e}".encode())
-                return
+                return f"[IDServer] Decryption error: {e}".encode()
 
             if not (cnp and first_name and last_name):
-                conn.sendall(
-                    b"[IDServer] Missing required fields for registration"
-                )
-                return
+                return b"[IDServer] Missing required fields for registration"
 
             try:
                 # Register the citizen using UsersDb (which handles further hashing).
                 pin = self.db.register_citizen(cnp, first_name, last_name)
-                response = {"status": "OK", "pin": pin}
-                conn.sendall(pickle.dumps(response))
+                return {"status": "OK", "pin": pin}
             except ValueError as e:
-                response = {"status": "ERROR", "message": str(e)}
-                conn.sendall(pickle.dumps(response))
+                return {"status": "ERROR", "message": str(e)}
+        elif action == "REGISTER_BATCH":
+            return self._register_batch(request.get("registrations"))
         else:
-            conn.sendall(b"[IDServer] Unknown action")
+            return b"[IDServer] Unknown action"
+
+    def _register_batch(self, registrations):
+        """
+        Register many citizens in one request. Each registration is a dict of
+        encrypted cnp/first_name/last_name; the response carries one
+        {"status", "pin"/"message"} result per registration, in order.
+        """
+        if not isinstance(registrations, list):
+            return b"[IDServer] REGISTER_BATCH expects a list of registrations"
+
+        triples = []
+        for r in registrations:
+            if isinstance(r, dict):
+                triples.append(
+                    (r.get("cnp"), r.get("first_name"), r.get("last_name"))
+                )
+            else:
+                triples.append((None, None, None))
+
+        if len(triples) >= self.batch_pool_threshold:
+            pool = self._get_batch_pool()
+            chunksize = max(1, len(triples) // 32)
+            with self.metrics.timer("rsa_decrypt_batch"):
+                decrypted = list(
+                    pool.map(
+                        _decrypt_registration, triples, chunksize=chunksize
+                    )
+                )
+            hash_pins = partial(pool.map, chunksize=chunksize)
+        else:
+            decrypted = []
+            for fields in triples:
+                with self.metrics.timer("rsa_decrypt"):
+                    decrypted.append(
+                        _decrypt_registration(fields, self.private_key)
+                    )
+            hash_pins = None
+
+        results = [None] * len(triples)
+        citizens, positions = [], []
+        for i, fields in enumerate(decrypted):
+            if isinstance(fields, str):
+                results[i] = {"status": "ERROR", "message": fields}
+            elif not all(fields):
+                results[i] = {
+                    "status": "ERROR",
+                    "message": "[IDServer] Missing required fields for registration",
+                }
+            else:
+                citizens.append(fields)
+                positions.append(i)
+
+        if citizens:
+            registered = self.db.register_citizens(citizens, hash_pins)
+            for i, result in zip(positions, registered):
+                results[i] = result
+        return {"status": "OK", "results": results}
 
 
 if __name__ == "__main__":
@@ -5,3 +5,8 @@ class Candidate:
 
     def __str__(self):
         return f"{self.code}: {self.name}"
+
+
+# Fixed ballot order of the candidate codes. Homomorphic (Paillier) ballots
+# are one-hot vectors over this order, so clients and servers must agree on it.
+BALLOT_CODES = ("A", "B", "C")
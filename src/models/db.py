@@ -1,8 +1,16 @@
+import os
 import sqlite3
 import pickle
+import queue
 import random
+import threading
+import time
+from concurrent.futures import Future
 from werkzeug.security import generate_password_hash, check_password_hash
 import hashlib
+from utils.ballot_file import BallotFileReader, BallotFileWriter
+from utils.event_log import LOG
+from utils.metrics import REGISTRY
 
 
 # Deterministic hash function for non-secret fields that require lookup.
@@ -10,89 +18,257 @@ def deterministic_hash(s, salt="fixed_salt_value"):
     return hashlib.sha256((salt + s).encode()).hexdigest()
 
 
+def check_pin(hashed_pin, pin):
+    """check_password_hash, timed into the pin_check metric."""
+    with REGISTRY.timer("pin_check"):
+        return check_password_hash(hashed_pin, pin)
+
+
+def generate_pin():
+    """Random 4-digit PIN handed to a newly registered citizen."""
+    return "".join(str(random.randint(0, 9)) for _ in range(4))
+
+
+SAMPLE_CITIZENS = [
+    ("1234567890123", "John", "Doe"),
+    ("9876543210987", "Jane", "Smith"),
+    ("4567890123456", "Alice", "Johnson"),
+    ("3210987654321", "Bob", "Brown"),
+    ("1112223334445", "Michael", "Johnson"),
+    ("2223334445556", "Sarah", "Williams"),
+    ("3334445556667", "David", "Brown"),
+    ("4445556667778", "Emily", "Davis"),
+    ("5556667778889", "James", "Miller"),
+]
+
+# (cnp, pin, has_voted)
+SAMPLE_USERS = [
+    ("1234567890123", "1234", 0),
+    ("9876543210987", "5678", 0),
+    ("4567890123456", "9101", 0),
+    ("3210987654321", "1121", 0),
+]
+
+DEFAULT_ADMIN = ("admin", "secret")
+
+
+# Schema migrations, applied in order by UsersDb.init_db(). The
+# schema_version table records how many have been applied, so opening an
+# up-to-date database costs a single SELECT. Only ever append: a migration
+# that has shipped must not change.
+MIGRATIONS = [
+    # 1: the original schema
+    [
+        # citizens (personal information) – all fields are hashed
+        # deterministically.
+        """
+        CREATE TABLE IF NOT EXISTS citizens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cnp TEXT UNIQUE NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL
+        )
+        """,
+        # users (authentication and voting status). The cnp is the
+        # deterministic hash (to match the citizens table) and the PIN is a
+        # salted hash from generate_password_hash.
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cnp TEXT UNIQUE NOT NULL,
+            pin TEXT NOT NULL,
+            has_voted INTEGER DEFAULT 0,
+            FOREIGN KEY(cnp) REFERENCES citizens(cnp)
+        )
+        """,
+        # votes (encrypted votes)
+        """
+        CREATE TABLE IF NOT EXISTS votes (
+            vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            encrypted_vote BLOB NOT NULL
+        )
+        """,
+        # keys (RSA keys storage)
+        """
+        CREATE TABLE IF NOT EXISTS keys (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            public_key BLOB NOT NULL,
+            private_key BLOB NOT NULL
+        )
+        """,
+        # admins (admin credentials storage)
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+        """,
+    ],
+    # 2: tally_checkpoint (DataCollection's incremental tally: the last
+    # vote_id counted and the pickled counts up to it)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS tally_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_vote_id INTEGER NOT NULL,
+            counts BLOB NOT NULL
+        )
+        """,
+    ],
+    # 3: homomorphic ballots
+    [
+        # ballot_keys (ballot encryption scheme and its keys, when ballots
+        # are not encrypted with the RSA keys)
+        """
+        CREATE TABLE IF NOT EXISTS ballot_keys (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            scheme TEXT NOT NULL,
+            public_key BLOB NOT NULL,
+            private_key BLOB NOT NULL
+        )
+        """,
+        # encrypted_tally (running homomorphic sum of all ballots, one
+        # pickled ciphertext per candidate)
+        """
+        CREATE TABLE IF NOT EXISTS encrypted_tally (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            ciphertexts BLOB NOT NULL,
+            ballots INTEGER NOT NULL
+        )
+        """,
+    ],
+    # 4: vote_log (ballot log file used instead of the votes table, and how
+    # many of its records are committed)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS vote_log (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            path TEXT NOT NULL,
+            committed INTEGER NOT NULL
+        )
+        """,
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 class UsersDb:
-    def __init__(self, db_file="voting_db.sqlite"):
+    """
+    SQLite storage backend. models/storage.py has the other backends and
+    open_users_db(), which picks one from configuration.
+
+    With id_stride/id_offset the database is one shard of several: a row
+    with local id L is known to callers as L * id_stride + id_offset, so
+    user and vote ids stay unique across shards.
+    """
+
+    def __init__(
+        self,
+        db_file="voting_db.sqlite",
+        wal=True,
+        id_stride=1,
+        id_offset=0,
+    ):
         self.db_file = db_file
+        self.id_stride = id_stride
+        self.id_offset = id_offset
         self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        # The connection is shared by the server's worker threads; every
+        # statement/commit sequence runs under this lock.
+        self.lock = threading.RLock()
+        # Ballot log file replacing the votes table (see attach_vote_log).
+        self.vote_log = None
+        if wal:
+            self._configure_wal()
         self.init_db()
 
-    def init_db(self):
-        cursor = self.conn.cursor()
+    def _global_id(self, local_id):
+        return local_id * self.id_stride + self.id_offset
 
-        # 1) Table: citizens (personal information) – all fields are hashed deterministically.
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS citizens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cnp TEXT UNIQUE NOT NULL,
-                first_name TEXT NOT NULL,
-                last_name TEXT NOT NULL
-            )
-            """
-        )
+    def _local_id(self, global_id):
+        # Floor division also maps a range bound onto the local id space:
+        # local > _local_id(g) <=> global > g (and likewise for <=).
+        return (global_id - self.id_offset) // self.id_stride
 
-        # 2) Table: users (authentication and voting status)
-        # Note: The cnp here is stored as the deterministic hash (to match the citizens table)
-        # and the PIN is stored as a salted hash using generate_password_hash.
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cnp TEXT UNIQUE NOT NULL,
-                pin TEXT NOT NULL,
-                has_voted INTEGER DEFAULT 0,
-                FOREIGN KEY(cnp) REFERENCES citizens(cnp)
-            )
-            """
-        )
+    def _configure_wal(self):
+        """
+        WAL lets readers (e.g. DataCollection) run alongside the writer.
+        synchronous=FULL fsyncs the WAL on every commit, so a vote that has
+        been answered with VOTE_ACCEPTED survives a power failure; the
+        GroupCommitter spreads that fsync over a batch of ballots.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=FULL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
 
-        # 3) Table: votes (encrypted votes)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS votes (
-                vote_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                encrypted_vote BLOB NOT NULL
-            )
-            """
-        )
+    def schema_version(self):
+        """Number of MIGRATIONS applied to this database (0 if new)."""
+        try:
+            cursor = self.conn.execute("SELECT version FROM schema_version")
+        except sqlite3.OperationalError:
+            return 0
+        row = cursor.fetchone()
+        return row[0] if row else 0
 
-        # 4) Table: keys (RSA keys storage)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS keys (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                public_key BLOB NOT NULL,
-                private_key BLOB NOT NULL
+    def init_db(self):
+        """
+        Apply the migrations this database has not seen yet; on an
+        up-to-date database this is one SELECT. Sample data is inserted
+        separately (seed_samples, seed_db.py).
+        """
+        if self.schema_version() >= SCHEMA_VERSION:
+            return
+        with self.lock:
+            cursor = self.conn.cursor()
+            # Take the write lock before re-reading the version, so servers
+            # starting together on a new database migrate it once.
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER NOT NULL
+                    )
+                    """
+                )
+                version = self.schema_version()
+                for statements in MIGRATIONS[version:]:
+                    for statement in statements:
+                        cursor.execute(statement)
+                cursor.execute("DELETE FROM schema_version")
+                cursor.execute(
+                    "INSERT INTO schema_version (version) VALUES (?)",
+                    (max(version, SCHEMA_VERSION),),
+                )
+                self._commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        if version < SCHEMA_VERSION:
+            print(
+                f"[UsersDb] Schema migrated from version {version} "
+                f"to {SCHEMA_VERSION}."
             )
-            """
-        )
 
-        # 5) Table: admins (admin credentials storage)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL
-            )
-            """
-        )
+    def seed_samples(
+        self,
+        citizens=SAMPLE_CITIZENS,
+        users=SAMPLE_USERS,
+        admin=DEFAULT_ADMIN,
+    ):
+        """
+        Insert the sample citizens, sample users and default admin into
+        whichever of those tables is still empty. `admin` may be None.
+        """
+        cursor = self.conn.cursor()
 
         # Insert sample citizens if empty – hash each field deterministically.
         cursor.execute("SELECT COUNT(*) FROM citizens")
         (citizens_count,) = cursor.fetchone()
-        if citizens_count == 0:
-            sample_citizens = [
-                ("1234567890123", "John", "Doe"),
-                ("9876543210987", "Jane", "Smith"),
-                ("4567890123456", "Alice", "Johnson"),
-                ("3210987654321", "Bob", "Brown"),
-                ("1112223334445", "Michael", "Johnson"),
-                ("2223334445556", "Sarah", "Williams"),
-                ("3334445556667", "David", "Brown"),
-                ("4445556667778", "Emily", "Davis"),
-                ("5556667778889", "James", "Miller"),
-            ]
+        if citizens_count == 0 and citizens:
             # Hash each value deterministically
             hashed_citizens = [
                 (
@@ -100,7 +276,7 @@ class UsersDb:
                     deterministic_hash(first_name),
                     deterministic_hash(last_name),
                 )
-                for cnp, first_name, last_name in sample_citizens
+                for cnp, first_name, last_name in citizens
             ]
             cursor.executemany(
                 """
@@ -109,21 +285,15 @@ class UsersDb:
                 """,
                 hashed_citizens,
             )
-            self.conn.commit()
+            self._commit()
             print("[UsersDb] Sample citizens inserted.")
 
         # Insert sample users if empty – hash the CNP deterministically and the PIN using generate_password_hash.
         cursor.execute("SELECT COUNT(*) FROM users")
         (users_count,) = cursor.fetchone()
-        if users_count == 0:
-            sample_users = [
-                ("1234567890123", "1234", 0),
-                ("9876543210987", "5678", 0),
-                ("4567890123456", "9101", 0),
-                ("3210987654321", "1121", 0),
-            ]
+        if users_count == 0 and users:
             hashed_users = []
-            for cnp, pin, voted in sample_users:
+            for cnp, pin, voted in users:
                 hashed_cnp = deterministic_hash(cnp)
                 hashed_pin = generate_password_hash(pin)
                 hashed_users.append((hashed_cnp, hashed_pin, voted))
@@ -134,15 +304,14 @@ class UsersDb:
                 """,
                 hashed_users,
             )
-            self.conn.commit()
+            self._commit()
             print("[UsersDb] Sample users inserted.")
 
         # Insert default admin if none exists (admin password is hashed via generate_password_hash)
         cursor.execute("SELECT COUNT(*) FROM admins")
         (admin_count,) = cursor.fetchone()
-        if admin_count == 0:
-            default_username = "admin"
-            default_password = "secret"
+        if admin_count == 0 and admin:
+            default_username, default_password = admin
             hashed_password = generate_password_hash(default_password)
             cursor.execute(
                 """
@@ -151,78 +320,398 @@ class UsersDb:
                 """,
                 (default_username, hashed_password),
             )
-            self.conn.commit()
+            self._commit()
             print("[UsersDb] Default admin inserted.")
 
-        self.conn.commit()
-
     def register_citizen(self, cnp, first_name, last_name):
-        cursor = self.conn.cursor()
         # Check if this citizen is already registered based on the deterministic hash of the CNP.
         hashed_cnp = deterministic_hash(cnp)
-        cursor.execute("SELECT id FROM users WHERE cnp = ?", (hashed_cnp,))
-        if cursor.fetchone():
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id FROM users WHERE cnp = ?", (hashed_cnp,))
+            exists = cursor.fetchone()
+        if exists:
             raise ValueError(f"[UsersDb] CNP {cnp} is already registered.")
 
         # Generate a random 4-digit PIN, hash it using generate_password_hash for secure storage,
-        # and insert into users table (using the hashed CNP)
-        pin = "".join(str(random.randint(0, 9)) for _ in range(4))
+        # and insert into users table (using the hashed CNP). Hashing happens outside the lock.
+        pin = generate_pin()
         hashed_pin = generate_password_hash(pin)
-        cursor.execute(
-            """
-            INSERT INTO users (cnp, pin, has_voted)
-            VALUES (?, ?, 0)
-            """,
-            (hashed_cnp, hashed_pin),
-        )
-        self.conn.commit()
-        print(f"[UsersDb] Citizen registered: CNP={cnp}, PIN={pin}")
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    INSERT INTO users (cnp, pin, has_voted)
+                    VALUES (?, ?, 0)
+                    """,
+                    (hashed_cnp, hashed_pin),
+                )
+            except sqlite3.IntegrityError:
+                # A concurrent registration for the same CNP won the race.
+                self.conn.rollback()
+                raise ValueError(f"[UsersDb] CNP {cnp} is already registered.")
+            user_id = self._global_id(cursor.lastrowid)
+            self._commit()
+        # Neither the CNP nor the PIN is logged.
+        LOG.info("citizen_registered", user_id=user_id)
         return pin
 
+    def register_citizens(self, citizens, hash_pins=None):
+        """
+        Batch version of register_citizen for (cnp, first_name, last_name)
+        tuples. PINs are hashed with `hash_pins` (a map-like callable, e.g. a
+        process pool's map; defaults to the built-in map) and every new user
+        is inserted in a single transaction. Returns one result per citizen:
+        {"status": "OK", "pin": ...} or {"status": "ERROR", "message": ...}.
+        """
+        hashed_cnps = [deterministic_hash(cnp) for cnp, _, _ in citizens]
+        existing = self.existing_cnps(hashed_cnps)
+
+        results = [None] * len(citizens)
+        accepted = []
+        seen = set()
+        for i, ((cnp, _, _), hashed_cnp) in enumerate(
+            zip(citizens, hashed_cnps)
+        ):
+            if hashed_cnp in existing or hashed_cnp in seen:
+                results[i] = {
+                    "status": "ERROR",
+                    "message": f"[UsersDb] CNP {cnp} is already registered.",
+                }
+                continue
+            seen.add(hashed_cnp)
+            accepted.append(i)
+
+        pins = [generate_pin() for _ in accepted]
+        hashed_pins = list((hash_pins or map)(generate_password_hash, pins))
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            for i, pin, hashed_pin in zip(accepted, pins, hashed_pins):
+                try:
+                    cursor.execute(
+                        """
+                        INSERT INTO users (cnp, pin, has_voted)
+                        VALUES (?, ?, 0)
+                        """,
+                        (hashed_cnps[i], hashed_pin),
+                    )
+                    results[i] = {"status": "OK", "pin": pin}
+                except sqlite3.IntegrityError:
+                    # Registered concurrently since existing_cnps() ran.
+                    results[i] = {
+                        "status": "ERROR",
+                        "message": f"[UsersDb] CNP {citizens[i][0]} is already registered.",
+                    }
+            self._commit()
+        LOG.info(
+            "citizens_registered",
+            accepted=len(accepted),
+            requested=len(citizens),
+        )
+        return results
+
+    def existing_cnps(self, hashed_cnps):
+        """
+        Return the subset of the given deterministic CNP hashes that already
+        have a users row.
+        """
+        found = set()
+        hashed_cnps = list(hashed_cnps)
+        with self.lock:
+            cursor = self.conn.cursor()
+            # Stay under SQLite's default bound-parameter limit.
+            for i in range(0, len(hashed_cnps), 900):
+                chunk = hashed_cnps[i : i + 900]
+                cursor.execute(
+                    "SELECT cnp FROM users WHERE cnp IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    chunk,
+                )
+                found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def bulk_insert_voters(self, voters, commit=True):
+        """
+        Insert pre-hashed voters with executemany. `voters` holds tuples
+        (hashed_cnp, hashed_first_name, hashed_last_name, hashed_pin); the
+        caller is expected to have filtered out existing CNPs.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO citizens (cnp, first_name, last_name)
+                VALUES (?, ?, ?)
+                """,
+                [v[:3] for v in voters],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO users (cnp, pin, has_voted)
+                VALUES (?, ?, 0)
+                """,
+                [(v[0], v[3]) for v in voters],
+            )
+            if commit:
+                self._commit()
+
+    def commit(self):
+        with self.lock:
+            self._commit()
+
+    def _commit(self):
+        with REGISTRY.timer("sqlite_commit"):
+            self.conn.commit()
+
     def authenticate_user(self, cnp, pin):
-        cursor = self.conn.cursor()
         hashed_cnp = deterministic_hash(cnp)
-        cursor.execute(
-            """
-            SELECT id, cnp, has_voted, pin
-            FROM users
-            WHERE cnp = ?
-            """,
-            (hashed_cnp,),
-        )
-        row = cursor.fetchone()
-        # row[3] is the stored hashed PIN
-        if row and check_password_hash(row[3], pin):
-            return row[:3]  # Return id, cnp, has_voted
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, cnp, has_voted, pin
+                FROM users
+                WHERE cnp = ?
+                """,
+                (hashed_cnp,),
+            )
+            row = cursor.fetchone()
+        # row[3] is the stored hashed PIN; checked without holding the lock.
+        if row and check_pin(row[3], pin):
+            # Return id, cnp, has_voted
+            return self._global_id(row[0]), row[1], row[2]
         return None
 
+    def has_voted(self, user_id):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT has_voted FROM users WHERE id = ?",
+                (self._local_id(user_id),),
+            )
+            row = cursor.fetchone()
+        return bool(row and row[0] == 1)
+
+    def voted_users(self):
+        """Return (id, cnp) for every user that has already voted."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id, cnp FROM users WHERE has_voted = 1")
+            rows = cursor.fetchall()
+        return [(self._global_id(id_), cnp) for id_, cnp in rows]
+
+    def get_user_cnp(self, user_id):
+        """Return the stored (hashed) CNP of a user, or None."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT cnp FROM users WHERE id = ?",
+                (self._local_id(user_id),),
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
     def mark_user_has_voted(self, user_id):
-        cursor = self.conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                UPDATE users
+                   SET has_voted = 1
+                 WHERE id = ?
+                """,
+                (self._local_id(user_id),),
+            )
+            self._commit()
+        # Ballot events name neither the voter nor the ballot (see
+        # cast_vote).
+        LOG.info("user_voted")
+
+    def attach_vote_log(self, path, ciphertext_size, scheme, fingerprint):
+        """
+        Store ballots in an append-only ballot log (utils/ballot_file.py)
+        instead of the votes table. The choice is recorded in the database,
+        so a store is never half in SQLite and half in a log file.
+
+        vote_ids are dense: ballot k sits in slot k - 1. Records are written
+        while the transaction holds SQLite's write lock, so writers in
+        several processes never overlap, and the log is fsynced before the
+        transaction commits. Only vote_log.committed records are valid; an
+        uncommitted record past it is overwritten by the next ballot.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT path FROM vote_log WHERE id = 1")
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("SELECT COUNT(*) FROM votes")
+                if cursor.fetchone()[0]:
+                    raise ValueError(
+                        "[UsersDb] The votes table already holds ballots."
+                    )
+                cursor.execute(
+                    "INSERT INTO vote_log (id, path, committed) VALUES (1, ?, 0)",
+                    (path,),
+                )
+                self._commit()
+            elif row[0] != path:
+                raise ValueError(
+                    f"[UsersDb] Ballots are stored in {row[0]}, not {path}."
+                )
+            self.vote_log = BallotFileWriter(
+                path, ciphertext_size, scheme, fingerprint
+            )
+        print(f"[UsersDb] Ballots are appended to {path}.")
+
+    def vote_log_path(self):
+        """Path of the ballot log recorded in the database, or None."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT path FROM vote_log WHERE id = 1")
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _insert_ballot(self, cursor, ciphertext):
+        """Add a ballot inside the caller's transaction; returns its vote_id."""
+        if self.vote_log is None:
+            cursor.execute(
+                """
+                INSERT INTO votes (encrypted_vote)
+                VALUES (?)
+                """,
+                (ciphertext,),
+            )
+            return self._global_id(cursor.lastrowid)
+        # The UPDATE takes the write lock before the slot is read.
+        cursor.execute(
+            "UPDATE vote_log SET committed = committed + 1 WHERE id = 1"
+        )
+        cursor.execute("SELECT committed FROM vote_log WHERE id = 1")
+        (slot,) = cursor.fetchone()
+        vote_id = self._global_id(slot)
+        self.vote_log.write_at(slot - 1, vote_id, ciphertext)
+        return vote_id
+
+    def _commit_ballots(self):
+        # One fsync of the log covers every ballot in the transaction.
+        if self.vote_log is not None:
+            with REGISTRY.timer("ballot_log_fsync"):
+                self.vote_log.sync()
+        self._commit()
+
+    def store_encrypted_vote(self, ciphertext):
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                vote_id = self._insert_ballot(cursor, ciphertext)
+                self._commit_ballots()
+            except Exception:
+                self.conn.rollback()
+                raise
+        LOG.info("vote_stored")
+        return vote_id
+
+    def _record_vote(self, cursor, user_id, ciphertext, add_to_tally=None):
+        """
+        Flip has_voted and insert the ballot inside the caller's transaction.
+        With `add_to_tally` (a function of the current encrypted tally, None
+        when empty, returning the new one) the running tally is updated in the
+        same transaction. Returns the new vote_id, or None if the user had
+        already voted.
+        """
         cursor.execute(
             """
             UPDATE users
                SET has_voted = 1
-             WHERE id = ?
+             WHERE id = ? AND has_voted = 0
             """,
-            (user_id,),
+            (self._local_id(user_id),),
         )
-        self.conn.commit()
-        print(f"[UsersDb] User with ID={user_id} has voted.")
+        if cursor.rowcount != 1:
+            return None
+        vote_id = self._insert_ballot(cursor, ciphertext)
+        if add_to_tally is not None:
+            # The UPDATE above already holds SQLite's write lock, so this
+            # read-modify-write is safe across processes too.
+            self._update_tally(cursor, [add_to_tally])
+        return vote_id
 
-    def store_encrypted_vote(self, ciphertext):
-        cursor = self.conn.cursor()
+    def _update_tally(self, cursor, updates):
+        """
+        Apply each add_to_tally function in `updates` to the running
+        encrypted tally and count one ballot per function, inside the
+        caller's transaction (which must already hold the write lock).
+        """
+        cursor.execute("SELECT ciphertexts FROM encrypted_tally WHERE id = 1")
+        row = cursor.fetchone()
+        tally = pickle.loads(row[0]) if row else None
+        for add_to_tally in updates:
+            tally = add_to_tally(tally)
         cursor.execute(
             """
-            INSERT INTO votes (encrypted_vote)
-            VALUES (?)
+            INSERT INTO encrypted_tally (id, ciphertexts, ballots)
+            VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE
+               SET ciphertexts = excluded.ciphertexts,
+                   ballots = ballots + excluded.ballots
             """,
-            (ciphertext,),
+            (pickle.dumps(tally), len(updates)),
         )
-        self.conn.commit()
-        print("[UsersDb] Encrypted vote stored.")
-        return cursor.lastrowid
+
+    def cast_vote(self, user_id, ciphertext, add_to_tally=None):
+        """
+        Store a ballot and mark the user as having voted in one transaction.
+        Returns the vote_id, or None if the user had already voted.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                vote_id = self._record_vote(
+                    cursor, user_id, ciphertext, add_to_tally
+                )
+                self._commit_ballots()
+            except Exception:
+                self.conn.rollback()
+                raise
+        if vote_id is not None:
+            # No user_id or vote_id: the votes table deliberately has no user
+            # column, and with both in the log (or either, given the order
+            # of events) ballots could be tied back to voters.
+            LOG.info("vote_stored")
+        return vote_id
+
+    def cast_votes(self, ballots):
+        """
+        Group commit: record many (user_id, ciphertext[, add_to_tally])
+        ballots in a single transaction. Returns one vote_id (or None if
+        already voted) per ballot.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                results = [
+                    self._record_vote(cursor, *ballot) for ballot in ballots
+                ]
+                self._commit_ballots()
+            except Exception:
+                self.conn.rollback()
+                raise
+        LOG.info(
+            "group_commit",
+            votes=len(results),
+            ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+        return results
 
     def save_keys(self, public_key, private_key):
+        """
+        Persists the key pair. The private key tuple is pickled as-is, so CRT
+        keys (d, n, p, q, dP, dQ, qInv) keep their extra components.
+        """
         cursor = self.conn.cursor()
         pickled_pub = pickle.dumps(public_key)
         pickled_priv = pickle.dumps(private_key)
@@ -247,9 +736,13 @@ class UsersDb:
                 (pickled_pub, pickled_priv),
             )
             print("[UsersDb] RSA keys updated in DB.")
-        self.conn.commit()
+        self._commit()
 
     def load_keys(self):
+        """
+        Returns (public_key, private_key) or None. Older databases may hold a
+        plain (d, n) private key; rsa_utils.decrypt accepts both layouts.
+        """
         cursor = self.conn.cursor()
         cursor.execute("SELECT public_key, private_key FROM keys WHERE id = 1")
         row = cursor.fetchone()
@@ -262,20 +755,311 @@ class UsersDb:
         print("[UsersDb] No RSA keys found in DB.")
         return None
 
+    def save_ballot_keys(self, scheme, public_key, private_key):
+        """
+        Persists the ballot scheme (e.g. "paillier") with its key pair. The
+        scheme is fixed once votes exist, so this is only called at setup.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO ballot_keys
+                    (id, scheme, public_key, private_key)
+                VALUES (1, ?, ?, ?)
+                """,
+                (scheme, pickle.dumps(public_key), pickle.dumps(private_key)),
+            )
+            self._commit()
+        print(f"[UsersDb] Ballot keys ({scheme}) stored in DB.")
+
+    def load_ballot_keys(self):
+        """
+        Returns (scheme, public_key, private_key), or None when ballots are
+        encrypted with the RSA keys from load_keys().
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT scheme, public_key, private_key
+                  FROM ballot_keys
+                 WHERE id = 1
+                """
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        scheme, pickled_pub, pickled_priv = row
+        return scheme, pickle.loads(pickled_pub), pickle.loads(pickled_priv)
+
+    def insert_votes(self, rows):
+        """
+        Insert (vote_id, ciphertext[, add_to_tally]) rows keeping their ids,
+        e.g. ballots imported for an audit; ids already present are skipped.
+        Each inserted row's add_to_tally (see _record_vote) is applied to the
+        encrypted tally in the same transaction. Returns the number of rows
+        inserted.
+        """
+        if self.vote_log is not None or self.vote_log_state():
+            raise ValueError(
+                "[UsersDb] This database stores ballots in a log file."
+            )
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                inserted = 0
+                updates = []
+                for vote_id, ciphertext, *rest in rows:
+                    cursor.execute(
+                        """
+                        INSERT OR IGNORE INTO votes (vote_id, encrypted_vote)
+                        VALUES (?, ?)
+                        """,
+                        (self._local_id(vote_id), bytes(ciphertext)),
+                    )
+                    if cursor.rowcount != 1:
+                        continue
+                    inserted += 1
+                    if rest and rest[0] is not None:
+                        updates.append(rest[0])
+                if updates:
+                    self._update_tally(cursor, updates)
+                self._commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return inserted
+
+    # Vote partitions: the read side DataCollection tallies through. A
+    # backend returns its partitions from vote_partitions(); vote ids are
+    # unique across partitions and increase within each one.
+
+    def vote_partitions(self):
+        return [self]
+
+    def partition_spec(self):
+        """
+        Picklable arguments to reopen this partition in another process
+        (see DataCollection.get_statistics_parallel).
+        """
+        return self.db_file, self.id_stride, self.id_offset
+
+    def vote_log_state(self):
+        """
+        (path, committed) of the ballot log file when ballots are stored
+        there (see attach_vote_log), else None.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT path, committed FROM vote_log WHERE id = 1")
+            return cursor.fetchone()
+
+    def iter_votes(self, after_id=0, up_to_id=None, batch_size=1000):
+        """
+        Yield (vote_id, encrypted_vote) with after_id < vote_id <= up_to_id
+        in vote_id order. Rows are fetched batch_size at a time so memory
+        stays flat; from a ballot log the ciphertexts are memoryviews into
+        the mapped file.
+        """
+        after = max(self._local_id(after_id), 0)
+        state = self.vote_log_state()
+        if state is not None:
+            path, committed = state
+            stop = committed
+            if up_to_id is not None:
+                stop = min(stop, self._local_id(up_to_id))
+            # Slot k - 1 holds the ballot with local id k.
+            with BallotFileReader(path, limit=committed) as reader:
+                yield from reader.records(after, stop)
+            return
+
+        # A separate connection: the shared one would interleave this
+        # long-running SELECT with the writers' transactions.
+        conn = sqlite3.connect(self.db_file)
+        try:
+            cursor = conn.cursor()
+            if up_to_id is None:
+                cursor.execute(
+                    "SELECT vote_id, encrypted_vote FROM votes"
+                    " WHERE vote_id > ? ORDER BY vote_id",
+                    (after,),
+                )
+            else:
+                cursor.execute(
+                    "SELECT vote_id, encrypted_vote FROM votes"
+                    " WHERE vote_id > ? AND vote_id <= ? ORDER BY vote_id",
+                    (after, self._local_id(up_to_id)),
+                )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for vote_id, ciphertext in rows:
+                    yield self._global_id(vote_id), ciphertext
+        finally:
+            conn.close()
+
+    def _local_vote_bounds(self):
+        """(count, min, max) of the local vote ids."""
+        state = self.vote_log_state()
+        if state is not None:
+            committed = state[1]
+            return committed, (1 if committed else None), committed
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), MIN(vote_id), MAX(vote_id) FROM votes"
+            )
+            return cursor.fetchone()
+
+    def max_vote_id(self):
+        _, _, last = self._local_vote_bounds()
+        return self._global_id(last) if last else 0
+
+    def vote_version(self):
+        """
+        (ballot count, highest vote_id): cheap, and changes whenever a
+        ballot is added.
+        """
+        count, _, last = self._local_vote_bounds()
+        return count, self._global_id(last) if last else 0
+
+    def vote_id_chunks(self, chunk_size):
+        """Split the votes into (first_id, last_id) ranges of chunk_size."""
+        _, first, last = self._local_vote_bounds()
+        if first is None:
+            return []
+        return [
+            (
+                self._global_id(start),
+                self._global_id(min(start + chunk_size - 1, last)),
+            )
+            for start in range(first, last + 1, chunk_size)
+        ]
+
+    def load_encrypted_tally(self):
+        """
+        The running Paillier tally as (one ciphertext per candidate, number
+        of ballots added to it), or None.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT ciphertexts, ballots FROM encrypted_tally WHERE id = 1"
+            )
+            row = cursor.fetchone()
+        return (pickle.loads(row[0]), row[1]) if row else None
+
+    def load_tally_checkpoint(self):
+        """(last_vote_id, counts) of the incremental tally, or (0, {})."""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT last_vote_id, counts FROM tally_checkpoint WHERE id = 1"
+            )
+            row = cursor.fetchone()
+        if not row:
+            return 0, {}
+        return row[0], pickle.loads(row[1])
+
+    def save_tally_checkpoint(self, last_vote_id, counts):
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO tally_checkpoint
+                    (id, last_vote_id, counts)
+                VALUES (1, ?, ?)
+                """,
+                (last_vote_id, pickle.dumps(counts)),
+            )
+            self._commit()
+
     def get_admin(self, username):
         """
         Retrieves the admin record for the given username.
         Returns a tuple (id, username, password) if found, else None.
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, username, password FROM admins WHERE username = ?
-            """,
-            (username,),
-        )
-        return cursor.fetchone()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, username, password FROM admins WHERE username = ?
+                """,
+                (username,),
+            )
+            return cursor.fetchone()
 
     def close(self):
+        if self.vote_log is not None:
+            self.vote_log.close()
         self.conn.close()
         print("[UsersDb] Database connection closed.")
+
+
+class GroupCommitter:
+    """
+    Batches votes arriving from concurrent requests into one transaction.
+    submit() blocks the caller until its ballot is committed. The writer
+    thread waits up to max_delay seconds (or until max_batch ballots are
+    queued) before committing, so one fsync covers the whole batch.
+    """
+
+    def __init__(self, db, max_batch=256, max_delay=0.002):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="GroupCommitter", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, user_id, ciphertext, add_to_tally=None):
+        """
+        Same contract as UsersDb.cast_vote: the vote_id, or None if the
+        user had already voted.
+        """
+        future = Future()
+        self._queue.put((user_id, ciphertext, add_to_tally, future))
+        return future.result()
+
+    def pending(self):
+        """Number of ballots waiting to be committed."""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            stop = False
+            # The batch closes max_delay after its first ballot, however
+            # many more trickle in meanwhile.
+            deadline = time.monotonic() + self.max_delay
+            try:
+                while len(batch) < self.max_batch:
+                    item = self._queue.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            try:
+                results = self.db.cast_votes([item[:3] for item in batch])
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+            else:
+                for (*_, future), vote_id in zip(batch, results):
+                    future.set_result(vote_id)
+            if stop:
+                return
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,523 @@
+import os
+import random
+import threading
+from werkzeug.security import generate_password_hash
+from models.db import (
+    DEFAULT_ADMIN,
+    SAMPLE_CITIZENS,
+    SAMPLE_USERS,
+    UsersDb,
+    check_pin,
+    deterministic_hash,
+    generate_pin,
+)
+
+# Storage backends.
+#
+# Every backend offers UsersDb's public interface:
+#   citizens/users: register_citizen, register_citizens, existing_cnps,
+#                   bulk_insert_voters, authenticate_user, has_voted,
+#                   voted_users, get_user_cnp, mark_user_has_voted
+#   votes:          store_encrypted_vote, cast_vote, cast_votes,
+#                   insert_votes, attach_vote_log, vote_log_path
+#   keys/admins:    save_keys, load_keys, save_ballot_keys,
+#                   load_ballot_keys, get_admin
+#   reading votes:  vote_partitions, vote_version; each partition has
+#                   iter_votes, max_vote_id, vote_id_chunks,
+#                   load_encrypted_tally, load/save_tally_checkpoint and
+#                   partition_spec
+#   lifecycle:      seed_samples, commit, close
+#
+# open_users_db() picks the backend from configuration. MemoryUsersDb is
+# only reachable in-process: build one and hand it to each component as
+# `db`.
+
+
+def open_users_db(db_file="voting_db.sqlite", storage=None):
+    """
+    Open the storage backend named by `storage`, or by the EVOTE_STORAGE
+    environment variable when it is None:
+      "sqlite"     - one SQLite file (default)
+      "sharded:N"  - users and votes spread over N SQLite files
+    "memory" is refused: each caller would get its own empty store.
+    """
+    storage = storage or os.environ.get("EVOTE_STORAGE", "sqlite")
+    kind, _, arg = storage.partition(":")
+    if kind == "sqlite":
+        return UsersDb(db_file)
+    if kind == "memory":
+        raise ValueError(
+            "[Storage] The memory backend cannot be opened by name: every "
+            "server, tally and tool would get its own empty store. Create "
+            "one MemoryUsersDb and pass it to each component as db=."
+        )
+    if kind == "sharded":
+        return ShardedUsersDb(db_file, int(arg) if arg else 4)
+    raise ValueError(f"Unknown storage backend: {storage}")
+
+
+class MemoryUsersDb:
+    """
+    In-memory backend: nothing is persisted and the data is only visible to
+    the object itself, so it is for use inside one process (benchmarks and
+    tests). Components share it through their `db` argument, e.g.
+    VotingServer(db=store), IdentificationServer(db=store) and
+    DataCollection(db=store); open_users_db() does not offer it. A new
+    store is empty: call seed_samples() for the sample users and admin.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.vote_log = None
+        self.citizens = {}  # hashed cnp -> (hashed first, hashed last)
+        self.users = {}  # id -> [hashed cnp, hashed pin, has_voted]
+        self.user_ids = {}  # hashed cnp -> id
+        self.votes = {}  # vote_id -> ciphertext, in vote_id order
+        # Above every id in votes, including ones insert_votes loaded with
+        # gaps, so a new ballot never reuses an id.
+        self.next_vote_id = 1
+        self.admins = {}  # username -> (id, username, hashed password)
+        self.keys = None
+        self.ballot_keys = None
+        self.encrypted_tally = None
+        self.tally_ballots = 0  # ballots added to encrypted_tally
+        self.tally_checkpoint = (0, {})
+
+    def seed_samples(
+        self,
+        citizens=SAMPLE_CITIZENS,
+        users=SAMPLE_USERS,
+        admin=DEFAULT_ADMIN,
+    ):
+        with self.lock:
+            if not self.citizens:
+                for cnp, first_name, last_name in citizens:
+                    self.citizens[deterministic_hash(cnp)] = (
+                        deterministic_hash(first_name),
+                        deterministic_hash(last_name),
+                    )
+            if not self.users:
+                for cnp, pin, voted in users:
+                    self._insert_user(
+                        deterministic_hash(cnp),
+                        generate_password_hash(pin),
+                        voted,
+                    )
+            if not self.admins and admin:
+                username, password = admin
+                self.admins[username] = (
+                    1,
+                    username,
+                    generate_password_hash(password),
+                )
+
+    def _insert_user(self, hashed_cnp, hashed_pin, has_voted=0):
+        user_id = len(self.users) + 1
+        self.users[user_id] = [hashed_cnp, hashed_pin, has_voted]
+        self.user_ids[hashed_cnp] = user_id
+        return user_id
+
+    def register_citizen(self, cnp, first_name, last_name):
+        hashed_cnp = deterministic_hash(cnp)
+        if hashed_cnp in self.user_ids:
+            raise ValueError(f"[UsersDb] CNP {cnp} is already registered.")
+        pin = generate_pin()
+        hashed_pin = generate_password_hash(pin)
+        with self.lock:
+            if hashed_cnp in self.user_ids:
+                raise ValueError(f"[UsersDb] CNP {cnp} is already registered.")
+            self._insert_user(hashed_cnp, hashed_pin)
+        return pin
+
+    def register_citizens(self, citizens, hash_pins=None):
+        hashed_cnps = [deterministic_hash(cnp) for cnp, _, _ in citizens]
+        accepted = []
+        seen = set()
+        results = [None] * len(citizens)
+        for i, hashed_cnp in enumerate(hashed_cnps):
+            if hashed_cnp in self.user_ids or hashed_cnp in seen:
+                results[i] = {
+                    "status": "ERROR",
+                    "message": f"[UsersDb] CNP {citizens[i][0]} is already registered.",
+                }
+                continue
+            seen.add(hashed_cnp)
+            accepted.append(i)
+        pins = [generate_pin() for _ in accepted]
+        hashed_pins = list((hash_pins or map)(generate_password_hash, pins))
+        with self.lock:
+            for i, pin, hashed_pin in zip(accepted, pins, hashed_pins):
+                if hashed_cnps[i] in self.user_ids:
+                    results[i] = {
+                        "status": "ERROR",
+                        "message": f"[UsersDb] CNP {citizens[i][0]} is already registered.",
+                    }
+                    continue
+                self._insert_user(hashed_cnps[i], hashed_pin)
+                results[i] = {"status": "OK", "pin": pin}
+        return results
+
+    def existing_cnps(self, hashed_cnps):
+        return {h for h in hashed_cnps if h in self.user_ids}
+
+    def bulk_insert_voters(self, voters, commit=True):
+        with self.lock:
+            for hashed_cnp, first_name, last_name, hashed_pin in voters:
+                self.citizens.setdefault(hashed_cnp, (first_name, last_name))
+                if hashed_cnp in self.user_ids:
+                    raise ValueError("[UsersDb] Duplicate CNP in bulk insert.")
+                self._insert_user(hashed_cnp, hashed_pin)
+
+    def commit(self):
+        pass
+
+    def authenticate_user(self, cnp, pin):
+        hashed_cnp = deterministic_hash(cnp)
+        with self.lock:
+            user_id = self.user_ids.get(hashed_cnp)
+            if user_id is None:
+                return None
+            _, hashed_pin, has_voted = self.users[user_id]
+        if check_pin(hashed_pin, pin):
+            return user_id, hashed_cnp, has_voted
+        return None
+
+    def has_voted(self, user_id):
+        user = self.users.get(user_id)
+        return bool(user and user[2] == 1)
+
+    def voted_users(self):
+        with self.lock:
+            return [
+                (user_id, user[0])
+                for user_id, user in self.users.items()
+                if user[2] == 1
+            ]
+
+    def get_user_cnp(self, user_id):
+        user = self.users.get(user_id)
+        return user[0] if user else None
+
+    def mark_user_has_voted(self, user_id):
+        with self.lock:
+            if user_id in self.users:
+                self.users[user_id][2] = 1
+
+    def store_encrypted_vote(self, ciphertext):
+        with self.lock:
+            vote_id = self.next_vote_id
+            self.next_vote_id += 1
+            self.votes[vote_id] = bytes(ciphertext)
+        return vote_id
+
+    def cast_votes(self, ballots):
+        """
+        Same contract as UsersDb.cast_votes. Every ballot is checked and the
+        tally computed before anything is changed, so a failure leaves the
+        store untouched, like a rolled-back transaction.
+        """
+        with self.lock:
+            voted = set()
+            tally = self.encrypted_tally
+            tally_ballots = self.tally_ballots
+            accepted = []
+            for user_id, ciphertext, *rest in ballots:
+                user = self.users.get(user_id)
+                if user is None or user[2] == 1 or user_id in voted:
+                    accepted.append(None)
+                    continue
+                voted.add(user_id)
+                if rest and rest[0] is not None:
+                    tally = rest[0](tally)
+                    tally_ballots += 1
+                accepted.append(bytes(ciphertext))
+
+            results = []
+            for (user_id, *_), ciphertext in zip(ballots, accepted):
+                if ciphertext is None:
+                    results.append(None)
+                    continue
+                self.users[user_id][2] = 1
+                vote_id = self.next_vote_id
+                self.next_vote_id += 1
+                self.votes[vote_id] = ciphertext
+                results.append(vote_id)
+            self.encrypted_tally = tally
+            self.tally_ballots = tally_ballots
+            return results
+
+    def cast_vote(self, user_id, ciphertext, add_to_tally=None):
+        return self.cast_votes([(user_id, ciphertext, add_to_tally)])[0]
+
+    def insert_votes(self, rows):
+        inserted = 0
+        with self.lock:
+            for vote_id, ciphertext, *rest in rows:
+                if vote_id in self.votes:
+                    continue
+                if rest and rest[0] is not None:
+                    self.encrypted_tally = rest[0](self.encrypted_tally)
+                    self.tally_ballots += 1
+                self.votes[vote_id] = bytes(ciphertext)
+                inserted += 1
+            # Keep iteration in vote_id order.
+            self.votes = dict(sorted(self.votes.items()))
+            self.next_vote_id = max(self.votes, default=0) + 1
+        return inserted
+
+    def attach_vote_log(self, path, ciphertext_size, scheme, fingerprint):
+        raise ValueError(
+            "[MemoryUsersDb] Ballot logs need the SQLite backend."
+        )
+
+    def vote_log_path(self):
+        return None
+
+    def save_keys(self, public_key, private_key):
+        self.keys = (public_key, private_key)
+
+    def load_keys(self):
+        return self.keys
+
+    def save_ballot_keys(self, scheme, public_key, private_key):
+        self.ballot_keys = (scheme, public_key, private_key)
+
+    def load_ballot_keys(self):
+        return self.ballot_keys
+
+    def get_admin(self, username):
+        return self.admins.get(username)
+
+    def vote_partitions(self):
+        return [self]
+
+    def partition_spec(self):
+        # Not reachable from another process.
+        return None
+
+    def iter_votes(self, after_id=0, up_to_id=None, batch_size=1000):
+        with self.lock:
+            items = list(self.votes.items())
+        for vote_id, ciphertext in items:
+            if vote_id > after_id and (
+                up_to_id is None or vote_id <= up_to_id
+            ):
+                yield vote_id, ciphertext
+
+    def max_vote_id(self):
+        return max(self.votes, default=0)
+
+    def vote_version(self):
+        return len(self.votes), self.max_vote_id()
+
+    def vote_id_chunks(self, chunk_size):
+        if not self.votes:
+            return []
+        first, last = min(self.votes), max(self.votes)
+        return [
+            (start, min(start + chunk_size - 1, last))
+            for start in range(first, last + 1, chunk_size)
+        ]
+
+    def load_encrypted_tally(self):
+        if self.encrypted_tally is None:
+            return None
+        return self.encrypted_tally, self.tally_ballots
+
+    def load_tally_checkpoint(self):
+        last_vote_id, counts = self.tally_checkpoint
+        return last_vote_id, dict(counts)
+
+    def save_tally_checkpoint(self, last_vote_id, counts):
+        self.tally_checkpoint = (last_vote_id, dict(counts))
+
+    def close(self):
+        pass
+
+
+class ShardedUsersDb:
+    """
+    Hash-sharded SQLite backend. Citizens, users and votes are spread over
+    `shards` files ("voting_db.shard0.sqlite", ...) by CNP hash, so
+    registrations and ballots for different shards do not queue on one
+    SQLite write lock. Keys, ballot keys and admins stay in db_file.
+
+    Shard i hands out ids i, i + N, i + 2N, ... (see UsersDb.id_stride), so
+    a user id or vote id names its shard. A voter's ballot is stored in the
+    voter's shard, keeping the has_voted flip and the ballot insert in one
+    transaction. The shard count is fixed once the shard files exist.
+    """
+
+    def __init__(self, db_file="voting_db.sqlite", shards=4):
+        root, ext = os.path.splitext(db_file)
+        existing = 0
+        while os.path.exists(f"{root}.shard{existing}{ext}"):
+            existing += 1
+        if existing and existing != shards:
+            raise ValueError(
+                f"[ShardedUsersDb] {db_file} has {existing} shards, "
+                f"not {shards}."
+            )
+        self.meta = UsersDb(db_file)
+        self.shards = [
+            UsersDb(
+                f"{root}.shard{i}{ext}",
+                id_stride=shards,
+                id_offset=i,
+            )
+            for i in range(shards)
+        ]
+
+    def _shard_index(self, hashed_cnp):
+        return int(hashed_cnp[:16], 16) % len(self.shards)
+
+    def _shard_for_cnp(self, cnp):
+        return self.shards[self._shard_index(deterministic_hash(cnp))]
+
+    def _shard_for_id(self, id_):
+        return self.shards[id_ % len(self.shards)]
+
+    def _group(self, items, key):
+        """{shard index: [(position, item), ...]} for items in order."""
+        groups = {}
+        for pos, item in enumerate(items):
+            groups.setdefault(key(item), []).append((pos, item))
+        return groups
+
+    def seed_samples(
+        self,
+        citizens=SAMPLE_CITIZENS,
+        users=SAMPLE_USERS,
+        admin=DEFAULT_ADMIN,
+    ):
+        self.meta.seed_samples(citizens=[], users=[], admin=admin)
+        for i, shard in enumerate(self.shards):
+            shard.seed_samples(
+                citizens=[
+                    c
+                    for c in citizens
+                    if self._shard_index(deterministic_hash(c[0])) == i
+                ],
+                users=[
+                    u
+                    for u in users
+                    if self._shard_index(deterministic_hash(u[0])) == i
+                ],
+                admin=None,
+            )
+
+    def register_citizen(self, cnp, first_name, last_name):
+        return self._shard_for_cnp(cnp).register_citizen(
+            cnp, first_name, last_name
+        )
+
+    def register_citizens(self, citizens, hash_pins=None):
+        results = [None] * len(citizens)
+        groups = self._group(
+            citizens, lambda c: self._shard_index(deterministic_hash(c[0]))
+        )
+        for index, members in groups.items():
+            shard_results = self.shards[index].register_citizens(
+                [c for _, c in members], hash_pins
+            )
+            for (pos, _), result in zip(members, shard_results):
+                results[pos] = result
+        return results
+
+    def existing_cnps(self, hashed_cnps):
+        found = set()
+        for index, members in self._group(
+            list(hashed_cnps), self._shard_index
+        ).items():
+            found |= self.shards[index].existing_cnps([h for _, h in members])
+        return found
+
+    def bulk_insert_voters(self, voters, commit=True):
+        for index, members in self._group(
+            voters, lambda v: self._shard_index(v[0])
+        ).items():
+            self.shards[index].bulk_insert_voters(
+                [v for _, v in members], commit
+            )
+
+    def commit(self):
+        for shard in self.shards:
+            shard.commit()
+
+    def authenticate_user(self, cnp, pin):
+        return self._shard_for_cnp(cnp).authenticate_user(cnp, pin)
+
+    def has_voted(self, user_id):
+        return self._shard_for_id(user_id).has_voted(user_id)
+
+    def voted_users(self):
+        return [row for shard in self.shards for row in shard.voted_users()]
+
+    def get_user_cnp(self, user_id):
+        return self._shard_for_id(user_id).get_user_cnp(user_id)
+
+    def mark_user_has_voted(self, user_id):
+        self._shard_for_id(user_id).mark_user_has_voted(user_id)
+
+    def store_encrypted_vote(self, ciphertext):
+        # No voter to follow; any shard will do.
+        return random.choice(self.shards).store_encrypted_vote(ciphertext)
+
+    def cast_vote(self, user_id, ciphertext, add_to_tally=None):
+        return self._shard_for_id(user_id).cast_vote(
+            user_id, ciphertext, add_to_tally
+        )
+
+    def cast_votes(self, ballots):
+        """One transaction per shard touched by the batch."""
+        results = [None] * len(ballots)
+        for index, members in self._group(
+            ballots, lambda b: b[0] % len(self.shards)
+        ).items():
+            vote_ids = self.shards[index].cast_votes([b for _, b in members])
+            for (pos, _), vote_id in zip(members, vote_ids):
+                results[pos] = vote_id
+        return results
+
+    def insert_votes(self, rows):
+        return sum(
+            self.shards[index].insert_votes([r for _, r in members])
+            for index, members in self._group(
+                list(rows), lambda r: r[0] % len(self.shards)
+            ).items()
+        )
+
+    def attach_vote_log(self, path, ciphertext_size, scheme, fingerprint):
+        raise ValueError(
+            "[ShardedUsersDb] Ballot logs need the single-file SQLite backend."
+        )
+
+    def vote_log_path(self):
+        return None
+
+    def save_keys(self, public_key, private_key):
+        self.meta.save_keys(public_key, private_key)
+
+    def load_keys(self):
+        return self.meta.load_keys()
+
+    def save_ballot_keys(self, scheme, public_key, private_key):
+        self.meta.save_ballot_keys(scheme, public_key, private_key)
+
+    def load_ballot_keys(self):
+        return self.meta.load_ballot_keys()
+
+    def get_admin(self, username):
+        return self.meta.get_admin(username)
+
+    def vote_partitions(self):
+        return list(self.shards)
+
+    def vote_version(self):
+        versions = [shard.vote_version() for shard in self.shards]
+        return sum(v[0] for v in versions), max(v[1] for v in versions)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.meta.close()
@@ -0,0 +1,183 @@
+"""
+Pre-fork VotingServer: a supervisor binds the listening port once (or lets
+each worker bind it with SO_REUSEPORT) and forks N worker processes, each
+with its own UsersDb connection, accepting on the same port.
+
+The supervisor restarts crashed workers and, on SIGTERM/SIGINT, asks every
+worker to stop accepting and drain its queued connections. One-vote-per-user
+holds across processes because UsersDb.cast_vote flips has_voted with a
+conditional UPDATE inside SQLite's write lock. All workers share one
+session-token secret, so a token from LOGIN is valid on any worker.
+
+Usage: python prefork_server.py [processes]
+"""
+
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+from models.storage import open_users_db
+from utils.event_log import LOG
+from utils.paillier_utils import PAILLIER, generate_paillier_keys
+from utils.rsa_utils import generate_rsa_keys
+from voting_server import VotingServer
+
+
+class PreforkVotingServer:
+    def __init__(
+        self,
+        host="localhost",
+        port=65432,
+        db_file="voting_db.sqlite",
+        processes=None,
+        reuse_port=False,
+        shutdown_grace=30,
+        **server_kwargs,
+    ):
+        self.host = host
+        self.port = port
+        self.db_file = db_file
+        self.processes = processes or os.cpu_count() or 1
+        # reuse_port=True: each worker binds its own SO_REUSEPORT socket and
+        # the kernel balances new connections; otherwise workers inherit
+        # one listening socket from the supervisor.
+        self.reuse_port = reuse_port
+        self.shutdown_grace = shutdown_grace
+        self.server_kwargs = server_kwargs
+        self.server_kwargs.setdefault("token_secret", secrets.token_bytes(32))
+        self.children = {}  # pid -> (slot, start time)
+        self._listener = None
+        self._stopping = False
+
+    def _ensure_keys(self):
+        # Generate keys once here so workers don't race to create them.
+        db = open_users_db(self.db_file, self.server_kwargs.get("storage"))
+        try:
+            if db.load_keys() is None:
+                print("[Prefork] No keys found in DB, generating RSA keys...")
+                db.save_keys(*generate_rsa_keys(1024))
+            if (
+                self.server_kwargs.get("ballot_scheme") == PAILLIER
+                and db.load_ballot_keys() is None
+            ):
+                print("[Prefork] Generating Paillier ballot keys...")
+                db.save_ballot_keys(
+                    PAILLIER,
+                    *generate_paillier_keys(
+                        self.server_kwargs.get("ballot_key_bits", 2048)
+                    ),
+                )
+        finally:
+            db.close()
+
+    def _bind(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((self.host, self.port))
+        s.listen(self.server_kwargs.get("queue_depth", 64))
+        return s
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (slot, time.monotonic())
+            return
+        # Worker process.
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, _raise_system_exit)
+            listener = self._listener or self._bind()
+            kwargs = dict(self.server_kwargs)
+            if kwargs.get("metrics_port"):
+                # Each worker has its own metrics; worker i serves them on
+                # metrics_port + i.
+                kwargs["metrics_port"] += slot
+            server = VotingServer(self.host, self.port, self.db_file, **kwargs)
+            server.serve(listener)
+        except SystemExit:
+            pass
+        except BaseException as e:
+            print(f"[Prefork] Worker {slot} crashed: {e}")
+            code = 1
+        finally:
+            # os._exit skips atexit, so write out queued log records here.
+            LOG.close()
+            sys.stdout.flush()
+            os._exit(code)
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def start(self):
+        self._ensure_keys()
+        if not self.reuse_port:
+            self._listener = self._bind()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for slot in range(self.processes):
+            self._spawn(slot)
+        print(f"[Prefork] {self.processes} workers on {self.host}:{self.port}")
+
+        while not self._stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            slot, started = self.children.pop(pid)
+            if self._stopping:
+                break
+            print(f"[Prefork] Worker {slot} (pid {pid}) exited: {status}")
+            if time.monotonic() - started < 1:
+                # Crash loop guard.
+                time.sleep(1)
+            self._spawn(slot)
+
+        self.stop()
+
+    def stop(self):
+        """SIGTERM every worker, wait for them to drain, then SIGKILL."""
+        for pid in self.children:
+            _kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.shutdown_grace
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in self.children:
+            print(f"[Prefork] Worker pid {pid} did not drain, killing it")
+            _kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.clear()
+        if self._listener:
+            self._listener.close()
+        print("[Prefork] All workers stopped.")
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def _kill(pid, sig):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+if __name__ == "__main__":
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    PreforkVotingServer(processes=processes).start()
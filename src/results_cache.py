@@ -0,0 +1,75 @@
+import threading
+import time
+from data_collection import DataCollection
+from models.storage import open_users_db
+
+
+class ResultsCache:
+    """
+    Tally shared across /results requests. The ballot count and highest
+    vote_id (UsersDb.vote_version) form its version: while they are
+    unchanged the cached counts are served (optionally for at most `ttl`
+    seconds), and the version doubles as the HTTP ETag so unchanged pages
+    can return 304.
+    """
+
+    def __init__(
+        self, db_file="voting_db.sqlite", ttl=None, storage=None, db=None
+    ):
+        self.db_file = db_file
+        self.storage = storage
+        self.ttl = ttl
+        # `db` shares a backend that is already open.
+        self._db = db
+        self._lock = threading.Lock()
+        self._version = None
+        self._last_modified = None
+        self._stats = None
+        self._stats_version = None
+        self._computed_at = 0
+        # Whether the cached counts are provisional (see
+        # DataCollection.provisional).
+        self.provisional = False
+
+    def _backend(self):
+        # Opened on first use, so importing the app stays cheap.
+        with self._lock:
+            if self._db is None:
+                self._db = open_users_db(self.db_file, self.storage)
+            return self._db
+
+    def _read_version(self):
+        return tuple(self._backend().vote_version())
+
+    def validators(self):
+        """
+        One cheap COUNT/MAX query. Returns (etag, last_modified) where
+        last_modified is the unix time the version was first seen.
+        """
+        version = self._read_version()
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._last_modified = int(time.time())
+            return "%d-%d" % version, self._last_modified
+
+    def stats(self, etag):
+        """
+        The tally for the version named by `etag`; decrypts (incrementally)
+        only when the version changed or the TTL expired.
+        """
+        db = self._backend()
+        with self._lock:
+            expired = self.ttl is not None and (
+                time.time() - self._computed_at > self.ttl
+            )
+            if self._stats_version != etag or expired:
+                data_collector = DataCollection(db=db)
+                try:
+                    self._stats = data_collector.get_statistics_incremental()
+                    self.provisional = data_collector.provisional
+                finally:
+                    data_collector.close()
+                self._stats_version = etag
+                self._computed_at = time.time()
+            return dict(self._stats)
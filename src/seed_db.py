@@ -0,0 +1,51 @@
+"""
+One-time database setup: create (or migrate) the schema and insert the
+sample citizens, sample users and default admin. The servers only migrate
+the schema on startup; they no longer insert sample data.
+
+Usage (from src/):
+    python seed_db.py [--db voting_db.sqlite] [--storage sharded:4]
+    python seed_db.py --schema-only
+"""
+
+import argparse
+import os
+import sys
+from models.storage import open_users_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database setup.")
+    parser.add_argument("--db", default="voting_db.sqlite")
+    parser.add_argument("--storage", help="sqlite or sharded[:N]")
+    parser.add_argument(
+        "--schema-only",
+        action="store_true",
+        help="only create or migrate the schema",
+    )
+    parser.add_argument(
+        "--no-admin", action="store_true", help="skip the default admin"
+    )
+    args = parser.parse_args()
+    storage = args.storage or os.environ.get("EVOTE_STORAGE", "sqlite")
+    if storage.partition(":")[0] == "memory":
+        # Seeding a store that vanishes when this script exits does nothing.
+        parser.error(
+            "a memory store cannot be seeded from here; call seed_samples()"
+            " on the MemoryUsersDb in the process that uses it"
+        )
+
+    db = open_users_db(args.db, args.storage)
+    try:
+        if not args.schema_only:
+            if args.no_admin:
+                db.seed_samples(admin=None)
+            else:
+                db.seed_samples()
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
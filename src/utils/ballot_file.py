@@ -0,0 +1,179 @@
+import mmap
+import os
+import struct
+from utils.paillier_utils import ciphertext_size, is_paillier_key
+
+# Fixed-width ballot file.
+#
+# A 64-byte header, then one record per ballot:
+#   header: magic "EVB1", format version, ciphertext size in bytes, ballot
+#           scheme (e.g. "rsa", "paillier") and the 16-hex-char fingerprint
+#           of the public key the ballots were encrypted with;
+#   record: 8-byte big-endian vote_id + ciphertext left-padded with zero
+#           bytes to the ciphertext size.
+# Every record has the same size, so record i starts at
+# HEADER_SIZE + i * record_size and the file can be scanned through mmap
+# without parsing. A record's slot can also be computed from its vote_id
+# when ids are dense (see UsersDb.attach_vote_log).
+
+MAGIC = b"EVB1"
+VERSION = 1
+HEADER_SIZE = 64
+
+_HEADER = struct.Struct(">4sHI8s16s")
+_VOTE_ID = struct.Struct(">Q")
+
+
+class BallotFileError(Exception):
+    pass
+
+
+def ballot_size(public_key, candidates):
+    """
+    Ciphertext bytes needed for one ballot: the RSA modulus size, or one
+    Paillier ciphertext per candidate.
+    """
+    if is_paillier_key(public_key):
+        return candidates * ciphertext_size(public_key)
+    return (public_key[1].bit_length() + 7) // 8
+
+
+def _pack_header(ciphertext_size, scheme, fingerprint):
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        ciphertext_size,
+        scheme.encode(),
+        fingerprint.encode(),
+    )
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+def _unpack_header(data):
+    if len(data) < HEADER_SIZE:
+        raise BallotFileError("File too short for a ballot file header")
+    magic, version, size, scheme, fingerprint = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise BallotFileError("Not a ballot file")
+    if version != VERSION:
+        raise BallotFileError(f"Unsupported ballot file version {version}")
+    return size, scheme.rstrip(b"\0").decode(), fingerprint.decode()
+
+
+class BallotFileWriter:
+    """
+    Writes (vote_id, ciphertext) records. An existing file is reopened after
+    checking that its header matches; a partial record left at the end by
+    an interrupted write is overwritten by the next record.
+    """
+
+    def __init__(self, path, ciphertext_size, scheme, fingerprint):
+        self.path = path
+        self.ciphertext_size = ciphertext_size
+        self.record_size = _VOTE_ID.size + ciphertext_size
+        header = _pack_header(ciphertext_size, scheme, fingerprint)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            os.pwrite(self.fd, header, 0)
+            size = HEADER_SIZE
+        elif os.pread(self.fd, HEADER_SIZE, 0) != header:
+            os.close(self.fd)
+            raise BallotFileError(
+                f"{path} was written for a different key or scheme"
+            )
+        self.count = (size - HEADER_SIZE) // self.record_size
+
+    def write_at(self, index, vote_id, ciphertext):
+        """Write the record in slot `index` (0-based)."""
+        if len(ciphertext) > self.ciphertext_size:
+            raise BallotFileError(
+                f"Ciphertext of {len(ciphertext)} bytes exceeds "
+                f"{self.ciphertext_size}"
+            )
+        record = _VOTE_ID.pack(vote_id) + bytes(ciphertext).rjust(
+            self.ciphertext_size, b"\0"
+        )
+        os.pwrite(self.fd, record, HEADER_SIZE + index * self.record_size)
+        self.count = max(self.count, index + 1)
+
+    def write(self, vote_id, ciphertext):
+        """Append a record after the last one."""
+        self.write_at(self.count, vote_id, ciphertext)
+
+    def sync(self):
+        """fsync the records written so far."""
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BallotFileReader:
+    """
+    Memory-mapped view of a ballot file. Iterating yields (vote_id,
+    ciphertext) where the ciphertext is a memoryview into the mapping,
+    so records are not copied. `limit` caps the number of records read,
+    e.g. to the ones a database has committed.
+    """
+
+    def __init__(self, path, limit=None):
+        self.path = path
+        with open(path, "rb") as f:
+            self.ciphertext_size, self.scheme, self.fingerprint = (
+                _unpack_header(f.read(HEADER_SIZE))
+            )
+            self.record_size = _VOTE_ID.size + self.ciphertext_size
+            size = os.fstat(f.fileno()).st_size
+            # A trailing partial record (interrupted append) is ignored.
+            self.count = (size - HEADER_SIZE) // self.record_size
+            if limit is not None:
+                self.count = min(self.count, limit)
+            self._mmap = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if self.count
+                else None
+            )
+        self._view = memoryview(self._mmap) if self._mmap else None
+
+    def __len__(self):
+        return self.count
+
+    def records(self, start=0, stop=None):
+        """Yield (vote_id, ciphertext) for records start <= i < stop."""
+        stop = self.count if stop is None else min(stop, self.count)
+        offset = HEADER_SIZE + start * self.record_size
+        for _ in range(start, stop):
+            (vote_id,) = _VOTE_ID.unpack_from(self._view, offset)
+            body = offset + _VOTE_ID.size
+            yield vote_id, self._view[body : body + self.ciphertext_size]
+            offset += self.record_size
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Record views from records() are still referenced; the
+                # file is unmapped once the last of them is released.
+                pass
+            self._view = self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,210 @@
+import atexit
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from utils.metrics import REGISTRY
+
+# Non-blocking structured event log.
+#
+# Hot paths call LOG.info("citizen_registered", user_id=3): the record
+# is checked against the level and the event's sampling rate, then put on
+# a bounded queue without waiting. A background thread formats and writes
+# the records, so a slow stdout or log collector never stalls a request.
+# When the queue is full the record is dropped and counted in the
+# log_dropped metric (per event); records skipped by sampling are counted
+# in log_sampled_out.
+#
+# Configuration comes from the environment, like EVOTE_STORAGE:
+#   EVOTE_LOG_LEVEL   DEBUG, INFO (default), WARNING or ERROR
+#   EVOTE_LOG_FORMAT  text (default) or json (one object per line)
+#   EVOTE_LOG_SAMPLE  e.g. "request=100,connection=10": keep one record in
+#                     N of those events
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {
+    DEBUG: "DEBUG",
+    INFO: "INFO",
+    WARNING: "WARNING",
+    ERROR: "ERROR",
+}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+
+def _parse_sample(spec):
+    """'event=N,...' -> {event: N}."""
+    sample = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        event, _, every = item.partition("=")
+        try:
+            sample[event.strip()] = int(every)
+        except ValueError:
+            raise ValueError(
+                f"Invalid EVOTE_LOG_SAMPLE entry {item!r}: expected "
+                "event=N with an integer N"
+            ) from None
+    return sample
+
+
+def _format_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "='):
+        return json.dumps(text)
+    return text
+
+
+class EventLog:
+    def __init__(
+        self,
+        level=INFO,
+        fmt="text",
+        sample=None,
+        capacity=10000,
+        stream=None,
+        metrics=REGISTRY,
+    ):
+        self.level = level
+        self.fmt = fmt
+        self.capacity = capacity
+        # None: whatever sys.stdout is when a record is written.
+        self.stream = stream
+        self.metrics = metrics
+        self._sample = {}
+        self.set_sampling(sample or {})
+        self._lock = threading.Lock()
+        self._reset()
+        metrics.set_gauge("log_queue", lambda: self._queue.qsize())
+        # The writer thread does not survive fork(); a child starts its own.
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls):
+        level = os.environ.get("EVOTE_LOG_LEVEL", "INFO")
+        if level.upper() not in LEVELS:
+            raise ValueError(
+                f"Invalid EVOTE_LOG_LEVEL {level!r}: expected one of "
+                + ", ".join(LEVELS)
+            )
+        fmt = os.environ.get("EVOTE_LOG_FORMAT", "text")
+        if fmt not in ("text", "json"):
+            raise ValueError(
+                f"Invalid EVOTE_LOG_FORMAT {fmt!r}: expected text or json"
+            )
+        return cls(
+            level=LEVELS[level.upper()],
+            fmt=fmt,
+            sample=_parse_sample(os.environ.get("EVOTE_LOG_SAMPLE", "")),
+        )
+
+    def _reset(self):
+        self._queue = queue.Queue(maxsize=self.capacity)
+        self._thread = None
+
+    def set_sampling(self, sample):
+        """Keep one record in N for each {event: N}; N <= 1 keeps all."""
+        self._sample = {
+            event: (every, itertools.count())
+            for event, every in sample.items()
+            if every > 1
+        }
+
+    def log(self, level, event, **fields):
+        """Queue one record; never blocks."""
+        if level < self.level:
+            return
+        sampling = self._sample.get(event)
+        if sampling and next(sampling[1]) % sampling[0]:
+            self.metrics.inc("log_sampled_out", event=event)
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            self.metrics.inc("log_dropped", event=event)
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="event-log", daemon=True
+                )
+                self._thread.start()
+
+    def format(self, record):
+        ts, level, event, fields = record
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts))
+        stamp += f".{int(ts % 1 * 1000):03d}"
+        if self.fmt == "json":
+            return json.dumps(
+                {
+                    "ts": stamp,
+                    "level": LEVEL_NAMES.get(level, level),
+                    "event": event,
+                    **fields,
+                },
+                default=str,
+            )
+        parts = [stamp, LEVEL_NAMES.get(level, str(level)), event]
+        parts += [f"{k}={_format_value(v)}" for k, v in fields.items()]
+        return " ".join(parts)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Write whatever else is already queued in the same call.
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [self.format(r) + "\n" for r in batch if r is not None]
+            stream = self.stream or sys.stdout
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+            except (OSError, ValueError):
+                self.metrics.inc(
+                    "log_dropped", len(lines), event="write_error"
+                )
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout=1.0):
+        """Write what is queued (waiting at most `timeout`) and stop."""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._reset()
+
+
+LOG = EventLog.from_env()
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+
+# CAST_VOTE response when the ballot's key_fingerprint is not the server's
+# current key: the client should drop its cached key and encrypt again.
+STALE_KEY = b"[Server] ERROR: STALE_KEY ballot encrypted with an old key"
+
+
+def key_info(public_key, fingerprint, known_fingerprint=None):
+    """
+    Server-side GET_KEYINFO response. The key itself is omitted when the
+    client already holds the current version.
+    """
+    if known_fingerprint == fingerprint:
+        return {"fingerprint": fingerprint, "public_key": None}
+    return {"fingerprint": fingerprint, "public_key": public_key}
+
+
+class KeyCache:
+    """
+    Client-side cache of server public keys keyed by "host:port".
+    A cached key is used without asking the server for max_age seconds;
+    after that it is revalidated by sending its fingerprint, and the key is
+    only transferred again if the server reports a different one. Ballots
+    carry the fingerprint, so a key rotated within max_age is caught by the
+    server (STALE_KEY) rather than at tally time.
+    With `path`, entries are also persisted to a JSON file.
+    """
+
+    def __init__(self, path=None, max_age=300):
+        self.path = path
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[KeyCache] Ignoring unreadable cache {self.path}: {e}")
+            return
+        for server, entry in stored.items():
+            self._entries[server] = {
+                "fingerprint": entry["fingerprint"],
+                "public_key": tuple(entry["public_key"]),
+                # Keys read from disk are revalidated on first use.
+                "checked": 0,
+            }
+
+    def _save(self):
+        stored = {
+            server: {
+                "fingerprint": entry["fingerprint"],
+                "public_key": list(entry["public_key"]),
+            }
+            for server, entry in self._entries.items()
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, host, port, fetch):
+        """
+        Return the public key for host:port. `fetch(known_fingerprint)` is
+        called to ask the server when the entry is missing or stale; it must
+        return the server's GET_KEYINFO response. Returns None on failure.
+        """
+        server = f"{host}:{port}"
+        with self._lock:
+            entry = self._entries.get(server)
+            if entry and time.time() - entry["checked"] < self.max_age:
+                return entry["public_key"]
+
+        response = fetch(entry["fingerprint"] if entry else None)
+        if not isinstance(response, dict) or "fingerprint" not in response:
+            print("[KeyCache] Could not retrieve key info:", response)
+            return None
+
+        with self._lock:
+            if response.get("public_key") is None:
+                if (
+                    not entry
+                    or entry["fingerprint"] != response["fingerprint"]
+                ):
+                    return None
+                entry["checked"] = time.time()
+                return entry["public_key"]
+
+            self._entries[server] = {
+                "fingerprint": response["fingerprint"],
+                "public_key": tuple(response["public_key"]),
+                "checked": time.time(),
+            }
+            if self.path:
+                self._save()
+            return self._entries[server]["public_key"]
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop(f"{host}:{port}", None)
+
+
+# Shared by every client in the process unless one is passed explicitly.
+default_key_cache = KeyCache()
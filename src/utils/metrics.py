@@ -0,0 +1,214 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide metrics registry.
+#
+# Counters, gauges and latency histograms, each identified by a name and a
+# set of labels (e.g. action="CAST_VOTE"). Durations are kept in integer
+# microseconds so that a snapshot can be sent over the framed protocol,
+# which has no floats; the Prometheus text form converts them to seconds.
+# Every server in a process records into REGISTRY; a pre-forked worker
+# has its own.
+
+# Histogram bucket upper bounds in microseconds (100us .. 5s, then +Inf).
+LATENCY_BUCKETS_US = (
+    100,
+    250,
+    500,
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    500_000,
+    1_000_000,
+    2_500_000,
+    5_000_000,
+)
+
+PROMETHEUS_PREFIX = "evote_"
+
+
+def _series(name, labels):
+    """'name{k="v",...}' for a (name, labels tuple) key."""
+    if not labels:
+        return name
+    inner = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return f"{name}{{{inner}}}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum_us = 0
+
+    def observe(self, us):
+        self.counts[bisect.bisect_left(self.buckets, us)] += 1
+        self.count += 1
+        self.sum_us += us
+
+    def cumulative(self):
+        """[[upper bound in us, observations <= bound], ...] without +Inf."""
+        total, result = 0, []
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            result.append([bound, total])
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS_US):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}  # key -> int, or a function polled on read
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a number, or to a function returning one."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, us, **labels):
+        """Record one duration of `us` microseconds."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(us)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the body of a with-block into histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                name, int((time.perf_counter() - start) * 1e6), **labels
+            )
+
+    def _read(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {
+                key: (h.count, h.sum_us, h.cumulative())
+                for key, h in self._histograms.items()
+            }
+        # Gauge functions run outside the lock: they may take other locks.
+        gauges = {
+            key: int(value() if callable(value) else value)
+            for key, value in gauges.items()
+        }
+        return counters, gauges, histograms
+
+    def snapshot(self):
+        """
+        Plain dict of every metric keyed by its series name, e.g.
+        'request_latency{action="CAST_VOTE",server="voting"}'.
+        Histograms give count, sum_us and cumulative [bound_us, count]
+        buckets.
+        """
+        counters, gauges, histograms = self._read()
+        return {
+            "pid": os.getpid(),
+            "counters": {_series(*k): v for k, v in counters.items()},
+            "gauges": {_series(*k): v for k, v in gauges.items()},
+            "histograms": {
+                _series(*k): {"count": n, "sum_us": s, "buckets": buckets}
+                for k, (n, s, buckets) in histograms.items()
+            },
+        }
+
+    def render_prometheus(self):
+        """The registry in the Prometheus text exposition format."""
+        counters, gauges, histograms = self._read()
+        lines = []
+        typed = set()
+
+        def emit(kind, name, samples):
+            # One TYPE line per metric family, before its first series.
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        for (name, labels), value in sorted(counters.items()):
+            full = f"{PROMETHEUS_PREFIX}{name}_total"
+            emit("counter", full, [f"{_series(full, labels)} {value}"])
+        for (name, labels), value in sorted(gauges.items()):
+            full = PROMETHEUS_PREFIX + name
+            emit("gauge", full, [f"{_series(full, labels)} {value}"])
+        for (name, labels), (count, sum_us, buckets) in sorted(
+            histograms.items()
+        ):
+            full = f"{PROMETHEUS_PREFIX}{name}_seconds"
+            samples = [
+                "%s %d"
+                % (_series(full + "_bucket", labels + (("le", le / 1e6),)), n)
+                for le, n in buckets
+            ]
+            samples += [
+                "%s %d"
+                % (
+                    _series(full + "_bucket", labels + (("le", "+Inf"),)),
+                    count,
+                ),
+                f"{_series(full + '_sum', labels)} {sum_us / 1e6}",
+                f"{_series(full + '_count', labels)} {count}",
+            ]
+            emit("histogram", full, samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def serve_metrics(host, port, registry=REGISTRY):
+    """
+    Serve registry.render_prometheus() at GET /metrics from a daemon
+    thread. Returns the HTTP server (call shutdown() to stop it).
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # One line per scrape would drown the server's own log.
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics", daemon=True
+    ).start()
+    print(f"[Metrics] Serving /metrics on {host}:{port}")
+    return server
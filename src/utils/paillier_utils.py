@@ -0,0 +1,89 @@
+import secrets
+from math import gcd
+from utils.rsa_utils import extended_gcd, generate_prime
+
+# Paillier keys are tagged so they can travel through the same code paths
+# as RSA (e, n) keys: public = ("paillier", n),
+# private = ("paillier", n, phi, mu). The generator is fixed to g = n + 1.
+PAILLIER = "paillier"
+
+
+def is_paillier_key(key):
+    return isinstance(key, tuple) and len(key) > 0 and key[0] == PAILLIER
+
+
+def generate_paillier_keys(bits=2048):
+    """
+    Generate a Paillier key pair whose modulus n has the given bit size.
+    """
+    while True:
+        p = generate_prime(bits // 2)
+        q = generate_prime(bits // 2)
+        n = p * q
+        phi = (p - 1) * (q - 1)
+        # Equal-length primes make gcd(n, phi) == 1 unless p == q.
+        if p != q and gcd(n, phi) == 1:
+            break
+    _, mu, _ = extended_gcd(phi, n)
+    mu %= n
+    return (PAILLIER, n), (PAILLIER, n, phi, mu)
+
+
+def ciphertext_size(pub_key):
+    """Bytes needed for one ciphertext (an element of Z*_{n^2})."""
+    n = pub_key[1]
+    return ((n * n).bit_length() + 7) // 8
+
+
+def encrypt(message, pub_key):
+    """
+    Paillier encryption: c = (1 + n)^m * r^n mod n^2 = (1 + m*n) * r^n.
+    """
+    n = pub_key[1]
+    n_sq = n * n
+    while True:
+        r = secrets.randbelow(n - 1) + 1
+        if gcd(r, n) == 1:
+            break
+    return ((1 + message * n) * pow(r, n, n_sq)) % n_sq
+
+
+def decrypt(ciphertext, priv_key):
+    """
+    Paillier decryption: m = L(c^phi mod n^2) * mu mod n, L(x) = (x - 1) / n.
+    """
+    _, n, phi, mu = priv_key
+    x = pow(ciphertext, phi, n * n)
+    return ((x - 1) // n * mu) % n
+
+
+def add(c1, c2, pub_key):
+    """Homomorphic addition: E(m1) * E(m2) = E(m1 + m2)."""
+    n = pub_key[1]
+    return (c1 * c2) % (n * n)
+
+
+def encrypt_one_hot(index, length, pub_key):
+    """Encrypt a vector with 1 at `index` and 0 elsewhere."""
+    return [encrypt(int(i == index), pub_key) for i in range(length)]
+
+
+def add_vectors(aggregate, vector, pub_key):
+    """Element-wise homomorphic addition; aggregate None means all zeros."""
+    if aggregate is None:
+        return list(vector)
+    return [add(a, c, pub_key) for a, c in zip(aggregate, vector)]
+
+
+def pack_vector(vector, pub_key):
+    """Fixed-width big-endian encoding of a ciphertext vector."""
+    size = ciphertext_size(pub_key)
+    return b"".join(c.to_bytes(size, "big") for c in vector)
+
+
+def unpack_vector(blob, pub_key):
+    size = ciphertext_size(pub_key)
+    return [
+        int.from_bytes(blob[i : i + size], "big")
+        for i in range(0, len(blob), size)
+    ]
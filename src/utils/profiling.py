@@ -0,0 +1,182 @@
+import cProfile
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+def _collapse(codes):
+    """Folded stack line (root first) from innermost-first code objects."""
+    return ";".join(
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+        f"{code.co_firstlineno})"
+        for code in reversed(codes)
+    )
+
+
+class RequestProfiler:
+    """
+    Opt-in profiling of request handling, aggregated per action.
+
+    sample_every=N runs one request in N under cProfile; the profiles of an
+    action are merged and written as <name>-<pid>-<action>.pstats (load
+    with pstats.Stats or snakeviz). Only one request is under cProfile at
+    a time; a sample that would overlap is skipped.
+
+    slow_ms=T samples the stacks of request threads every sample_interval
+    seconds and keeps the samples of requests that took at least T ms, as
+    <name>-<pid>-<action>.collapsed (one "frame;frame;... count" line per
+    stack, for flamegraph.pl or speedscope).
+
+    Files are rewritten in out_dir every dump_interval seconds and on
+    close(). Threads start on first use in each process, so a profiler can
+    be handed to pre-forked workers. Callers keep `profiler=None` when
+    profiling is off, which costs one attribute check per request.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        sample_every=None,
+        slow_ms=None,
+        sample_interval=0.005,
+        dump_interval=60,
+        name="server",
+    ):
+        if not sample_every and slow_ms is None:
+            raise ValueError(
+                "[Profiler] Set sample_every and/or slow_ms to profile."
+            )
+        self.out_dir = out_dir
+        self.sample_every = sample_every
+        self.slow_ms = slow_ms
+        self.sample_interval = sample_interval
+        self.dump_interval = dump_interval
+        self.name = name
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # First use in this process (or in a forked child): start from
+            # empty aggregates with threads of our own.
+            self._counter = itertools.count()
+            self._cprofile_lock = threading.Lock()
+            self._stats = {}  # action -> pstats.Stats
+            self._stacks = {}  # action -> Counter of folded stacks
+            self._slow = Counter()  # action -> slow requests seen
+            self._active = {}  # thread id -> sampled stacks of its request
+            self._stop = threading.Event()
+            os.makedirs(self.out_dir, exist_ok=True)
+            threading.Thread(
+                target=self._dump_loop, name="profiler-dump", daemon=True
+            ).start()
+            if self.slow_ms is not None:
+                threading.Thread(
+                    target=self._sample_loop,
+                    name="profiler-sampler",
+                    daemon=True,
+                ).start()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def request(self, action):
+        """Profile the body of a with-block as one request for `action`."""
+        self._ensure_started()
+        profile = None
+        if (
+            self.sample_every
+            and next(self._counter) % self.sample_every == 0
+            and self._cprofile_lock.acquire(blocking=False)
+        ):
+            profile = cProfile.Profile()
+        samples = None
+        if self.slow_ms is not None:
+            tid = threading.get_ident()
+            with self._lock:
+                if tid not in self._active:  # Not nested in a request.
+                    samples = self._active[tid] = []
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                profile.enable()
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._cprofile_lock.release()
+                self._add_profile(action, profile)
+            if samples is not None:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    del self._active[tid]
+                    if elapsed_ms >= self.slow_ms:
+                        self._slow[action] += 1
+                        stacks = self._stacks.setdefault(action, Counter())
+                        stacks.update(_collapse(s) for s in samples)
+
+    def _add_profile(self, action, profile):
+        with self._lock:
+            stats = self._stats.get(action)
+            if stats is None:
+                self._stats[action] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for tid, samples in active:
+                frame = frames.get(tid)
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                if codes:
+                    samples.append(codes)
+
+    def _dump_loop(self):
+        while not self._stop.wait(self.dump_interval):
+            self.dump()
+
+    def dump(self):
+        """Write the aggregates collected so far to out_dir."""
+        if self._pid != os.getpid():
+            return
+        prefix = os.path.join(self.out_dir, f"{self.name}-{os.getpid()}-")
+        with self._lock:
+            for action, stats in self._stats.items():
+                path = prefix + f"{action}.pstats"
+                stats.dump_stats(path + ".tmp")
+                os.replace(path + ".tmp", path)
+            stacks = {a: dict(c) for a, c in self._stacks.items()}
+            slow = dict(self._slow)
+        for action, counts in stacks.items():
+            path = prefix + f"{action}.collapsed"
+            with open(path + ".tmp", "w") as f:
+                for stack, n in sorted(counts.items()):
+                    f.write(f"{stack} {n}\n")
+            os.replace(path + ".tmp", path)
+        if stacks or self._stats:
+            print(
+                f"[Profiler] Dumped {len(self._stats)} profiles and "
+                f"{sum(slow.values())} slow requests to {self.out_dir}"
+            )
+
+    def close(self):
+        """Stop the threads and write a final dump."""
+        if self._pid == os.getpid():
+            self._stop.set()
+            self.dump()
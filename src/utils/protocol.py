@@ -0,0 +1,275 @@
+import socket
+import struct
+import time
+
+# Framed wire protocol shared by the voting and identification servers.
+#
+# A framed connection starts with MAGIC, after which every message in either
+# direction is a 4-byte big-endian length followed by a value encoded with
+# encode(). The connection stays open, so a client can send several requests
+# back to back (pipelining) and read the responses in the same order. While
+# it is idle between requests it does not occupy a server worker thread.
+# Connections that do not start with MAGIC are served with the legacy
+# one-pickle-per-connection protocol.
+
+MAGIC = b"EVF1"
+MAX_FRAME = 16 * 1024 * 1024
+# Deepest nesting of lists/tuples/dicts decode() accepts.
+MAX_DEPTH = 32
+
+_LEN = struct.Struct(">I")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _encode_into(value, out):
+    if value is None:
+        out.append(b"N")
+    elif value is True:
+        out.append(b"T")
+    elif value is False:
+        out.append(b"F")
+    elif isinstance(value, int):
+        tag = b"I" if value >= 0 else b"J"
+        mag = abs(value)
+        data = mag.to_bytes((mag.bit_length() + 7) // 8, "big")
+        out += (tag, _LEN.pack(len(data)), data)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += (b"S", _LEN.pack(len(data)), data)
+    elif isinstance(value, (bytes, bytearray)):
+        out += (b"B", _LEN.pack(len(value)), bytes(value))
+    elif isinstance(value, (list, tuple)):
+        out += (
+            b"L" if isinstance(value, list) else b"U",
+            _LEN.pack(len(value)),
+        )
+        for item in value:
+            _encode_into(item, out)
+    elif isinstance(value, dict):
+        out += (b"D", _LEN.pack(len(value)))
+        for k, v in value.items():
+            _encode_into(k, out)
+            _encode_into(v, out)
+    else:
+        raise ProtocolError(f"Cannot encode {type(value).__name__}")
+
+
+def encode(value):
+    """
+    Encode None/bool/int/str/bytes/list/tuple/dict into the compact binary form.
+    """
+    out = []
+    _encode_into(value, out)
+    return b"".join(out)
+
+
+def _decode_from(data, pos, depth=0):
+    tag = data[pos : pos + 1]
+    pos += 1
+    if tag == b"N":
+        return None, pos
+    if tag == b"T":
+        return True, pos
+    if tag == b"F":
+        return False, pos
+    if tag in (b"I", b"J", b"S", b"B"):
+        (length,) = _LEN.unpack_from(data, pos)
+        pos += 4
+        raw = data[pos : pos + length]
+        if len(raw) != length:
+            raise ProtocolError("Truncated value")
+        pos += length
+        if tag == b"S":
+            return raw.decode("utf-8"), pos
+        if tag == b"B":
+            return bytes(raw), pos
+        value = int.from_bytes(raw, "big")
+        return (value if tag == b"I" else -value), pos
+    if tag in (b"L", b"U", b"D"):
+        if depth >= MAX_DEPTH:
+            raise ProtocolError(f"Value nested deeper than {MAX_DEPTH}")
+        (count,) = _LEN.unpack_from(data, pos)
+        pos += 4
+        if tag == b"D":
+            result = {}
+            for _ in range(count):
+                k, pos = _decode_from(data, pos, depth + 1)
+                v, pos = _decode_from(data, pos, depth + 1)
+                try:
+                    result[k] = v
+                except TypeError:
+                    raise ProtocolError(
+                        f"Unhashable dict key of type {type(k).__name__}"
+                    )
+            return result, pos
+        items = []
+        for _ in range(count):
+            item, pos = _decode_from(data, pos, depth + 1)
+            items.append(item)
+        return (items if tag == b"L" else tuple(items)), pos
+    raise ProtocolError(f"Unknown type tag {tag!r}")
+
+
+def decode(data):
+    try:
+        value, pos = _decode_from(data, 0)
+    except struct.error as e:
+        raise ProtocolError(f"Truncated value: {e}")
+    except (UnicodeDecodeError, RecursionError, TypeError) as e:
+        raise ProtocolError(f"Malformed value: {e}")
+    if pos != len(data):
+        raise ProtocolError("Trailing bytes after value")
+    return value
+
+
+def recv_exact(sock, size):
+    """Read exactly `size` bytes, or return None if the peer closed first."""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock, value):
+    payload = encode(value)
+    sock.sendall(_LEN.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """
+    Read one frame and return the decoded value.
+    Raises EOFError when the peer closes the connection between frames.
+    """
+    header = recv_exact(sock, 4)
+    if header is None:
+        raise EOFError
+    (length,) = _LEN.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+    payload = recv_exact(sock, length)
+    if payload is None:
+        raise ProtocolError("Connection closed mid-frame")
+    return decode(payload)
+
+
+def is_framed(conn, timeout=None):
+    """
+    Peek at the start of a new connection to see whether it speaks the
+    framed protocol; nothing is consumed except the magic itself. Raises
+    socket.timeout if the client sends nothing within `timeout` seconds.
+    """
+    conn.settimeout(timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        head = conn.recv(len(MAGIC), socket.MSG_PEEK)
+        if len(head) == len(MAGIC) or not head or not MAGIC.startswith(head):
+            break
+        # Only part of the magic has arrived so far.
+        if deadline is not None and time.monotonic() > deadline:
+            raise socket.timeout("incomplete protocol header")
+        time.sleep(0.001)
+    if head == MAGIC:
+        conn.recv(len(MAGIC))
+        return True
+    return False
+
+
+def serve_framed(conn, handle_request, timeout=None, invalid_request=None):
+    """
+    Serve the framed requests already sent on `conn`, in order, and return
+    once none is waiting: True if the connection should stay open, False
+    if the client disconnected. A frame that has started arriving must be
+    complete within `timeout` seconds. The caller waits for the next
+    request (see ConnectionWorkerPool) instead of holding a thread on an
+    idle connection.
+
+    A malformed or oversized frame is answered with
+    invalid_request(error) (by default an "Invalid request" message) and
+    the connection is closed.
+    """
+    conn.settimeout(timeout)
+    while True:
+        try:
+            request = recv_frame(conn)
+        except (EOFError, socket.timeout, ConnectionError):
+            return False
+        except ProtocolError as e:
+            if invalid_request is None:
+                response = f"Invalid request: {e}".encode()
+            else:
+                response = invalid_request(e)
+            try:
+                send_frame(conn, response)
+            except (socket.timeout, ConnectionError):
+                pass
+            return False
+        send_frame(conn, handle_request(request))
+        # Pipelined requests: keep going while more are buffered (or the
+        # client has closed, which the next recv_frame reports).
+        conn.setblocking(False)
+        try:
+            conn.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except ConnectionError:
+            return False
+        finally:
+            conn.settimeout(timeout)
+
+
+class FramedConnection:
+    """
+    Client side of a persistent framed connection. request() sends one
+    request and waits for its response; pipeline() sends a batch before
+    reading any responses.
+    """
+
+    def __init__(self, host, port, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self.sock.sendall(MAGIC)
+
+    def pipeline(self, requests):
+        """
+        Send every request, then read one response per request. A connection
+        that was closed by the server while idle is reopened once.
+        """
+        while True:
+            reused = self.sock is not None
+            if not reused:
+                self.connect()
+            try:
+                for request in requests:
+                    send_frame(self.sock, request)
+                return [recv_frame(self.sock) for _ in requests]
+            except (EOFError, ConnectionError):
+                self.close()
+                if not reused:
+                    raise
+            except Exception:
+                self.close()
+                raise
+
+    def request(self, request):
+        return self.pipeline([request])[0]
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
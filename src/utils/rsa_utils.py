@@ -1,4 +1,6 @@
+import hashlib
 import secrets
+from concurrent.futures import ProcessPoolExecutor
 
 
 def miller_rabin(n, k=40):
@@ -38,42 +40,88 @@ def miller_rabin(n, k=40):
     return True
 
 
-def generate_prime(bits=2048):
+def _primes_below(limit):
+    """Sieve of Eratosthenes: all primes < limit."""
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for i in range(2, int(limit**0.5) + 1):
+        if sieve[i]:
+            sieve[i * i :: i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+
+# Odd primes below 20000 (~2260 of them), used to sieve prime candidates.
+SIEVE_PRIMES = _primes_below(20000)[1:]
+
+
+def generate_prime(bits=2048, window=4096):
     """
     Generate a prime of specified bit length using Miller-Rabin.
     Using the 'secrets' module for cryptographic-quality randomness.
+
+    Candidates are searched incrementally from a random odd start: the
+    window of `window` odd numbers after it is sieved by SIEVE_PRIMES, and
+    survivors must pass a base-2 Fermat test before the full Miller-Rabin.
     """
-    while True:
-        # Get a random number of desired bit length, ensure it's odd
-        candidate = secrets.randbits(bits) | 1
-        # Make sure top bit is set (to ensure it truly is 'bits' length)
-        candidate |= 1 << (bits - 1)
+    if bits < 32:
+        # Too small to sieve: candidates could be sieve primes themselves.
+        while True:
+            candidate = secrets.randbits(bits) | 1 | (1 << (bits - 1))
+            if miller_rabin(candidate):
+                return candidate
 
-        if miller_rabin(candidate):
-            return candidate
+    while True:
+        # Random odd start with the top bit set (so it truly is 'bits' long)
+        start = secrets.randbits(bits) | 1 | (1 << (bits - 1))
+
+        # alive[j] == 0 once start + 2*j is known to have a small factor.
+        alive = bytearray([1]) * window
+        for p in SIEVE_PRIMES:
+            # Solve start + 2*j == 0 (mod p); (p + 1) // 2 is 2^-1 mod p.
+            j = ((p - start % p) * ((p + 1) // 2)) % p
+            alive[j::p] = bytes(len(range(j, window, p)))
+
+        j = alive.find(1)
+        while j != -1:
+            candidate = start + 2 * j
+            if candidate.bit_length() > bits:
+                break
+            if pow(2, candidate - 1, candidate) == 1 and miller_rabin(
+                candidate
+            ):
+                return candidate
+            j = alive.find(1, j + 1)
 
 
 def extended_gcd(a, b):
     """
     Return (gcd, x, y) such that a*x + b*y = gcd(a, b).
+    Iterative, so operands of thousands of bits cannot hit the recursion
+    limit.
     """
-    if b == 0:
-        return (a, 1, 0)
-    else:
-        g, x1, y1 = extended_gcd(b, a % b)
-        x = y1
-        y = x1 - (a // b) * y1
-        return (g, x, y)
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b:
+        q, r = divmod(a, b)
+        a, b = b, r
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return (a, x0, y0)
 
 
-def generate_rsa_keys(bits=2048):
+def generate_rsa_keys(bits=2048, parallel=False):
     """
     Generate RSA key pair (public, private) with the given bit size.
-    public = (e, n), private = (d, n)
+    public = (e, n), private = (d, n, p, q, dP, dQ, qInv)
+    The extra private components let decrypt() use the CRT fast path.
+    With parallel=True, p and q are searched for in two processes.
     """
     # 1) Generate two large random primes p and q
-    p = generate_prime(bits // 2)
-    q = generate_prime(bits // 2)
+    if parallel:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            p, q = pool.map(generate_prime, [bits // 2, bits // 2])
+    else:
+        p = generate_prime(bits // 2)
+        q = generate_prime(bits // 2)
     # Ensure p != q
     while q == p:
         q = generate_prime(bits // 2)
@@ -98,7 +146,17 @@ def generate_rsa_keys(bits=2048):
     _, d, _ = extended_gcd(e, phi)
     d %= phi  # ensure positive
 
-    return (e, n), (d, n)
+    return (e, n), crt_private_key(d, p, q)
+
+
+def crt_private_key(d, p, q):
+    """
+    Build a CRT private key (d, n, p, q, dP, dQ, qInv) from d and the primes.
+    """
+    dp = d % (p - 1)
+    dq = d % (q - 1)
+    qinv = pow(q, -1, p)
+    return (d, p * q, p, q, dp, dq, qinv)
 
 
 def encrypt(message, pub_key):
@@ -113,9 +171,18 @@ def encrypt(message, pub_key):
 def decrypt(ciphertext, priv_key):
     """
     RSA Decryption: m = ciphertext^d mod n
+    Keys carrying CRT parameters are decrypted with two half-width
+    exponentiations; legacy (d, n) keys use the plain path.
     """
-    d, n = priv_key
-    return pow(ciphertext, d, n)
+    if len(priv_key) == 2:
+        d, n = priv_key
+        return pow(ciphertext, d, n)
+
+    _, _, p, q, dp, dq, qinv = priv_key
+    m1 = pow(ciphertext, dp, p)
+    m2 = pow(ciphertext, dq, q)
+    h = (qinv * (m1 - m2)) % p
+    return m2 + h * q
 
 
 def str_to_int(s):
@@ -128,3 +195,12 @@ def int_to_str(i):
     # Ensure at least one byte is used.
     byte_length = (i.bit_length() + 7) // 8 or 1
     return i.to_bytes(byte_length, "big").decode("utf-8")
+
+
+def key_fingerprint(pub_key):
+    """
+    Short, stable fingerprint of a public key (e, n): the first 16 hex
+    characters of SHA-256 over "e:n". Used as the key's version.
+    """
+    e, n = pub_key
+    return hashlib.sha256(f"{e}:{n}".encode()).hexdigest()[:16]
@@ -0,0 +1,48 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+# Response to a request whose token is malformed, forged or expired.
+INVALID_TOKEN = b"[Server] ERROR: Invalid or expired session token"
+
+
+class SessionTokens:
+    """
+    Short-lived, HMAC-signed session tokens bound to a users.id.
+    Token format: "<user_id>.<expires_unix>.<hex HMAC-SHA256>".
+    Without an explicit secret a random one is generated, so tokens do not
+    survive a server restart.
+    """
+
+    def __init__(self, secret=None, ttl=900):
+        self.secret = secret or secrets.token_bytes(32)
+        self.ttl = ttl
+
+    def _sign(self, payload):
+        return hmac.new(
+            self.secret, payload.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def issue(self, user_id):
+        expires = int(time.time()) + self.ttl
+        payload = f"{user_id}.{expires}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token):
+        """
+        Return the user id the token was issued for, or None if the token is
+        malformed, forged or expired.
+        """
+        if not isinstance(token, str):
+            return None
+        try:
+            user_id, expires, signature = token.split(".")
+            payload = f"{user_id}.{expires}"
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            if int(expires) < time.time():
+                return None
+            return int(user_id)
+        except ValueError:
+            return None
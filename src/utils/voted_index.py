@@ -0,0 +1,49 @@
+import threading
+
+
+class VotedIndex:
+    """
+    In-memory record of who has already voted, so repeat CAST_VOTE requests
+    can be rejected before any PIN hashing or database access.
+
+    Users are tracked twice: in a bitmap keyed by users.id (for session
+    tokens) and in a set of deterministic CNP hashes, as raw digests (for
+    CNP+PIN requests). Whole digests are kept, not prefixes, so a CNP whose
+    hash merely starts like a voter's is not turned away. The index only
+    ever says "has voted"; a miss falls through to the normal checks, so it
+    is safe for it to lag behind the database, e.g. for votes accepted by
+    another server process.
+    """
+
+    def __init__(self):
+        self._ids = bytearray()
+        self._cnps = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cnp_key(hashed_cnp):
+        return bytes.fromhex(hashed_cnp)
+
+    def add(self, user_id, hashed_cnp=None):
+        with self._lock:
+            byte, bit = divmod(user_id, 8)
+            if byte >= len(self._ids):
+                self._ids.extend(bytes(byte + 1 - len(self._ids)))
+            self._ids[byte] |= 1 << bit
+            if hashed_cnp:
+                self._cnps.add(self._cnp_key(hashed_cnp))
+
+    def has_id(self, user_id):
+        byte, bit = divmod(user_id, 8)
+        return byte < len(self._ids) and bool(self._ids[byte] & (1 << bit))
+
+    def has_cnp(self, hashed_cnp):
+        return self._cnp_key(hashed_cnp) in self._cnps
+
+    def load(self, rows):
+        """Add (user_id, hashed_cnp) rows, e.g. from UsersDb.voted_users()."""
+        count = 0
+        for user_id, hashed_cnp in rows:
+            self.add(user_id, hashed_cnp)
+            count += 1
+        return count
@@ -0,0 +1,176 @@
+import collections
+import queue
+import selectors
+import socket
+import threading
+import time
+from utils.event_log import LOG
+
+
+class ConnectionWorkerPool:
+    """
+    Bounded pool of worker threads that serve accepted connections.
+    At most `queue_depth` connections wait for a worker; once the queue is
+    full, submit() blocks the accept loop so clients back up in the
+    kernel's listen backlog instead of in memory.
+
+    A handler that returns a callable keeps the connection open: it is
+    handed back to the pool's idle watcher, which waits (in one thread, with
+    a selector) until the client sends more and then queues
+    callable(conn) for a worker. Idle persistent connections therefore do
+    not hold worker threads; they are closed after `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers=8,
+        queue_depth=64,
+        name="Server",
+        idle_timeout=None,
+    ):
+        self.handler = handler
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.active = 0  # connections with a request being served
+        self._active_lock = threading.Lock()
+        # Connections handed back by workers, picked up by the idle watcher
+        # (a selector may only be used from one thread).
+        self._to_park = []
+        self._park_lock = threading.Lock()
+        self._stopping = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        # conn -> (addr, resume, deadline), oldest first
+        self._parked = collections.OrderedDict()
+        self._watcher = threading.Thread(
+            target=self._watch_idle, name=f"{name}-idle", daemon=True
+        )
+        self._watcher.start()
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(
+                target=self._worker, name=f"{name}-worker-{i}", daemon=True
+            )
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, conn, addr):
+        self.queue.put((conn, addr, self.handler))
+
+    def pending(self):
+        """Number of accepted connections waiting for a worker."""
+        return self.queue.qsize()
+
+    def idle(self):
+        """Number of open connections waiting for their next request."""
+        return len(self._parked)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            conn, addr, handler = item
+            with self._active_lock:
+                self.active += 1
+            resume = None
+            try:
+                resume = handler(conn)
+            except Exception as e:
+                LOG.error(
+                    "handler_error", server=self.name, addr=addr[0], error=e
+                )
+            finally:
+                if callable(resume):
+                    self._park(conn, addr, resume)
+                else:
+                    conn.close()
+                with self._active_lock:
+                    self.active -= 1
+                self.queue.task_done()
+
+    def _park(self, conn, addr, resume):
+        with self._park_lock:
+            if self._stopping:
+                conn.close()
+                return
+            self._to_park.append((conn, addr, resume))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass  # A wake-up is already pending.
+
+    def _watch_idle(self):
+        while True:
+            with self._park_lock:
+                to_park, self._to_park = self._to_park, []
+                stopping = self._stopping
+            if stopping:
+                break
+            now = time.monotonic()
+            deadline = now + self.idle_timeout if self.idle_timeout else None
+            for conn, addr, resume in to_park:
+                self._selector.register(conn, selectors.EVENT_READ)
+                self._parked[conn] = (addr, resume, deadline)
+
+            timeout = None
+            if self._parked and self.idle_timeout:
+                oldest = next(iter(self._parked.values()))[2]
+                timeout = max(0, oldest - now)
+            for key, _ in self._selector.select(timeout):
+                conn = key.fileobj
+                if conn is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(conn)
+                addr, resume, _ = self._parked.pop(conn)
+                self.queue.put((conn, addr, resume))
+
+            # Close connections idle for longer than idle_timeout.
+            now = time.monotonic()
+            while self._parked:
+                conn, (addr, _, deadline) = next(iter(self._parked.items()))
+                if deadline is None or deadline > now:
+                    break
+                del self._parked[conn]
+                self._selector.unregister(conn)
+                conn.close()
+                LOG.debug("idle_timeout", server=self.name, addr=addr[0])
+
+        for conn in self._parked:
+            self._selector.unregister(conn)
+            conn.close()
+        self._parked.clear()
+
+    def shutdown(self):
+        """
+        Let queued connections finish, then stop the workers. Idle
+        persistent connections are closed.
+        """
+        with self._park_lock:
+            self._stopping = True
+            to_park, self._to_park = self._to_park, []
+        for conn, _, _ in to_park:
+            conn.close()
+        self._wake()
+        self._watcher.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
@@ -1,19 +1,60 @@
 import socket
 import pickle
-from models.candidates import Candidate
-from utils.rsa_utils import encrypt
+from models.candidates import BALLOT_CODES, Candidate
+from utils.rsa_utils import encrypt, key_fingerprint
+from utils.paillier_utils import encrypt_one_hot, is_paillier_key
+from utils.protocol import FramedConnection
+from utils.key_cache import STALE_KEY, default_key_cache
 
 
 class VotingClient:
-    def __init__(self, host="localhost", port=65432, cnp="", pin=""):
+    def __init__(
+        self,
+        host="localhost",
+        port=65432,
+        cnp="",
+        pin="",
+        framed=True,
+        conn=None,
+        key_cache=None,
+    ):
         self.host = host
         self.port = port
         self.cnp = cnp
         self.pin = pin
         self.public_key = None
+        # Session token from login(); sent instead of CNP+PIN when set.
+        self.token = None
+        # framed=True reuses one persistent connection for every request;
+        # framed=False sends one pickle per connection (legacy protocol).
+        # `conn` lets a caller lend an existing FramedConnection (see ClientPool).
+        self.framed = framed or conn is not None
+        if conn is None and framed:
+            conn = FramedConnection(host, port)
+        self._conn = conn
+        self.key_cache = key_cache or default_key_cache
+
+    def _credentials(self):
+        if self.token:
+            return {"token": self.token}
+        return {"cnp": self.cnp, "pin": self.pin}
+
+    def login(self):
+        """
+        Check CNP+PIN once and keep the session token the server issues.
+        Returns the server's response dict, or None on failure.
+        """
+        response = self._send_request(
+            {"action": "LOGIN", "cnp": self.cnp, "pin": self.pin}
+        )
+        if isinstance(response, dict) and response.get("token"):
+            self.token = response["token"]
+            return response
+        print("[Client] Login failed:", response)
+        return None
 
     def get_public_key(self):
-        request = {"action": "GET_PUBKEY", "cnp": self.cnp, "pin": self.pin}
+        request = {"action": "GET_PUBKEY", **self._credentials()}
         response = self._send_request(request)
         if isinstance(response, tuple) and len(response) == 2:
             self.public_key = response
@@ -21,26 +62,73 @@ class VotingClient:
         else:
             print("[Client] Could not retrieve public key:", response)
 
+    def load_public_key(self):
+        """
+        Unauthenticated key lookup through the key cache (GET_KEYINFO); the
+        server is only asked when the cached entry is missing or stale.
+        """
+        self.public_key = self.key_cache.get(
+            self.host,
+            self.port,
+            lambda fingerprint: self._send_request(
+                {"action": "GET_KEYINFO", "fingerprint": fingerprint}
+            ),
+        )
+        return self.public_key
+
     def cast_vote(self, vote_text):
-        if not self.public_key:
-            print(
-                "[Client] No public key available. Please call get_public_key first."
-            )
-            return
+        # The ballot names the key it was encrypted with. If the server's
+        # key has changed since it was cached, the server answers
+        # STALE_KEY; the key is fetched again and the ballot re-encrypted.
+        for attempt in range(2):
+            if not self.public_key:
+                self.load_public_key()
+            if not self.public_key:
+                print(
+                    "[Client] No public key available. Please call get_public_key first."
+                )
+                return
 
-        vote_num = int.from_bytes(vote_text.encode(), "big")
-        enc_vote = encrypt(vote_num, self.public_key)
-
-        request = {
-            "action": "CAST_VOTE",
-            "cnp": self.cnp,
-            "pin": self.pin,
-            "encrypted_vote": enc_vote,
-        }
-        response = self._send_request(request)
+            enc_vote = self._encrypt_ballot(vote_text)
+            if enc_vote is None:
+                return
+            request = {
+                "action": "CAST_VOTE",
+                **self._credentials(),
+                "encrypted_vote": enc_vote,
+                "key_fingerprint": key_fingerprint(self.public_key),
+            }
+            response = self._send_request(request)
+            if response != STALE_KEY.decode() or attempt:
+                break
+            print("[Client] Server key has changed, fetching it again.")
+            self.key_cache.invalidate(self.host, self.port)
+            self.public_key = None
         print("[Client] Server response:", response)
+        return response
+
+    def _encrypt_ballot(self, vote_text):
+        if is_paillier_key(self.public_key):
+            # Homomorphic ballot: one ciphertext per candidate, 1 for the
+            # chosen one and 0 for the rest.
+            if vote_text not in BALLOT_CODES:
+                print("[Client] Unknown candidate:", vote_text)
+                return None
+            return encrypt_one_hot(
+                BALLOT_CODES.index(vote_text),
+                len(BALLOT_CODES),
+                self.public_key,
+            )
+        vote_num = int.from_bytes(vote_text.encode(), "big")
+        return encrypt(vote_num, self.public_key)
 
     def _send_request(self, request_dict):
+        if self.framed:
+            response = self._conn.request(request_dict)
+            if isinstance(response, bytes):
+                return response.decode(errors="ignore")
+            return response
+
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(5)  # Set a 5-second timeout
             s.connect((self.host, self.port))
@@ -51,6 +139,23 @@ class VotingClient:
         except Exception:
             return data.decode(errors="ignore")
 
+    def get_stats(self):
+        """
+        The server's metrics snapshot (STATS action). Always sent framed: a
+        snapshot can be larger than the legacy protocol's single read.
+        """
+        if self.framed:
+            return self._conn.request({"action": "STATS"})
+        conn = FramedConnection(self.host, self.port)
+        try:
+            return conn.request({"action": "STATS"})
+        finally:
+            conn.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
 
 if __name__ == "__main__":
     cnp = input("CNP: ")
@@ -61,9 +166,10 @@ if __name__ == "__main__":
         Candidate("C", "Angela Merkel"),
     ]
     client = VotingClient(cnp=cnp, pin=pin)
-    client.get_public_key()
+    if client.login():
+        client.load_public_key()
 
-    while client.public_key:
+    while client.token and client.public_key:
         print("Please choose from the following:")
         for c in candidates:
             print(c)
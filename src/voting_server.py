@@ -1,16 +1,80 @@
 import socket
 import pickle
-from models.db import UsersDb
-from utils.rsa_utils import generate_rsa_keys
+import time
+from functools import partial
+from models.candidates import BALLOT_CODES
+from models.db import GroupCommitter, deterministic_hash
+from models.storage import open_users_db
+from utils.worker_pool import ConnectionWorkerPool
+from utils.protocol import is_framed, serve_framed
+from utils.rsa_utils import generate_rsa_keys, key_fingerprint
+from utils.ballot_file import ballot_size
+from utils.event_log import LOG
+from utils.key_cache import STALE_KEY, key_info
+from utils.metrics import REGISTRY, serve_metrics
+from utils.session_tokens import INVALID_TOKEN, SessionTokens
+from utils.voted_index import VotedIndex
+from utils.paillier_utils import (
+    PAILLIER,
+    add_vectors,
+    generate_paillier_keys,
+    pack_vector,
+)
+
+# Actions with their own request metrics; anything else counts as "OTHER".
+ACTIONS = ("LOGIN", "GET_PUBKEY", "GET_KEYINFO", "CAST_VOTE")
 
 
 class VotingServer:
     def __init__(
-        self, host="localhost", port=65432, db_file="voting_db.sqlite"
+        self,
+        host="localhost",
+        port=65432,
+        db_file="voting_db.sqlite",
+        workers=8,
+        queue_depth=64,
+        idle_timeout=60,
+        read_timeout=5,
+        token_ttl=900,
+        token_secret=None,
+        group_commit=False,
+        group_commit_max=256,
+        group_commit_delay=0.002,
+        ballot_scheme="rsa",
+        ballot_key_bits=2048,
+        vote_log=None,
+        storage=None,
+        db=None,
+        metrics_port=None,
+        profiler=None,
     ):
         self.host = host
         self.port = port
-        self.db = UsersDb(db_file)
+        # Request/database metrics are always recorded and returned by the
+        # STATS action; with metrics_port they are also served as
+        # Prometheus text at http://host:metrics_port/metrics.
+        self.metrics = REGISTRY
+        self.metrics_port = metrics_port
+        # Optional utils.profiling.RequestProfiler (cProfile on 1-in-N
+        # requests and/or stack samples of slow ones, per action).
+        self.profiler = profiler
+        # Concurrency: worker threads handling connections, and how many
+        # accepted connections may wait for a free worker.
+        self.workers = workers
+        self.queue_depth = queue_depth
+        # Seconds a persistent (framed) connection may sit idle; idle
+        # connections wait in the pool's selector, not in a worker.
+        self.idle_timeout = idle_timeout
+        # Seconds a client may take to send its first bytes, or the rest of
+        # a request it has started.
+        self.read_timeout = read_timeout
+        # LOGIN checks the PIN once and hands out a token that later
+        # requests present instead of CNP+PIN.
+        self.tokens = SessionTokens(token_secret, token_ttl)
+        # Storage backend: "sqlite" or "sharded:N" (default from
+        # EVOTE_STORAGE, see models/storage.py); `db` shares one that is
+        # already open, such as a MemoryUsersDb used by a test.
+        self.db = db if db is not None else open_users_db(db_file, storage)
 
         # 1) Try to load keys from DB
         keys = self.db.load_keys()
@@ -26,19 +90,100 @@ class VotingServer:
             self.public_key, self.private_key = keys
             print("[Server] Loaded RSA keys from DB.")
 
+        # Ballot scheme, fixed when the ballot keys are first generated:
+        # "rsa" encrypts the candidate code with the keys above; "paillier"
+        # encrypts a one-hot vector over BALLOT_CODES, and the server keeps a
+        # running encrypted sum so a tally is one decryption per candidate.
+        # Clients get the ballot key from GET_PUBKEY/GET_KEYINFO.
+        ballot_keys = self.db.load_ballot_keys()
+        if ballot_keys is None and ballot_scheme == PAILLIER:
+            print("[Server] Generating Paillier ballot keys...")
+            pub, priv = generate_paillier_keys(ballot_key_bits)
+            self.db.save_ballot_keys(PAILLIER, pub, priv)
+            ballot_keys = PAILLIER, pub, priv
+        self.ballot_scheme = "rsa"
+        if ballot_keys is not None:
+            self.ballot_scheme, self.public_key, _ = ballot_keys
+        print(f"[Server] Ballot scheme: {self.ballot_scheme}")
+        self.key_fingerprint = key_fingerprint(self.public_key)
+
+        # Ballots go to the votes table, or to an append-only ballot log
+        # file once one has been configured for this database.
+        vote_log = vote_log or self.db.vote_log_path()
+        if vote_log:
+            self.db.attach_vote_log(
+                vote_log,
+                ballot_size(self.public_key, len(BALLOT_CODES)),
+                self.ballot_scheme,
+                self.key_fingerprint,
+            )
+
+        # Votes are committed through UsersDb.cast_vote (one transaction per
+        # ballot), or batched across concurrent requests by a GroupCommitter.
+        self.committer = None
+        if group_commit:
+            self.committer = GroupCommitter(
+                self.db, group_commit_max, group_commit_delay
+            )
+
+        # Users known to have voted; repeat CAST_VOTEs are rejected from
+        # memory without hashing the PIN or touching the database.
+        self.voted = VotedIndex()
+        count = self.voted.load(self.db.voted_users())
+        print(f"[Server] Voted index loaded ({count} users).")
+
     def start(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((self.host, self.port))
-            s.listen()
-            print(f"[Server] Listening on {self.host}:{self.port}")
+            s.listen(self.queue_depth)
+            self.serve(s)
 
+    def serve(self, s):
+        """
+        Accept connections on an already listening socket until interrupted.
+        Queued connections are drained before returning.
+        """
+        pool = ConnectionWorkerPool(
+            self.handle_client,
+            self.workers,
+            self.queue_depth,
+            "Server",
+            self.idle_timeout,
+        )
+        self.metrics.set_gauge(
+            "active_connections", lambda: pool.active, server="voting"
+        )
+        self.metrics.set_gauge("queue_depth", pool.pending, server="voting")
+        self.metrics.set_gauge("idle_connections", pool.idle, server="voting")
+        if self.committer:
+            self.metrics.set_gauge(
+                "group_commit_queue", self.committer.pending, server="voting"
+            )
+        if self.metrics_port:
+            serve_metrics(self.host, self.metrics_port, self.metrics)
+        print(
+            f"[Server] Listening on {self.host}:{self.port} "
+            f"({self.workers} workers)"
+        )
+        try:
             while True:
                 conn, addr = s.accept()
-                print(f"[Server] Connection from {addr}")
-                self.handle_client(conn)
-                conn.close()
+                LOG.debug(
+                    "connection", server="voting", addr=addr[0], port=addr[1]
+                )
+                pool.submit(conn, addr)
+        finally:
+            pool.shutdown()
 
     def handle_client(self, conn):
+        try:
+            framed = is_framed(conn, self.read_timeout)
+        except (socket.timeout, ConnectionError):
+            return None
+        # Framed clients keep the connection open for many requests.
+        if framed:
+            return self.serve_framed(conn)
+
         data = conn.recv(4096)
         if not data:
             return
@@ -49,49 +194,184 @@ class VotingServer:
             conn.sendall(f"[Server] Invalid request: {e}".encode())
             return
 
+        response = self.process_request(request)
+        if isinstance(response, bytes):
+            conn.sendall(response)
+        else:
+            conn.sendall(pickle.dumps(response))
+
+    def serve_framed(self, conn):
+        """
+        Answer the requests waiting on a framed connection. Returns itself
+        so the worker pool calls it again when the next request arrives.
+        """
+        if serve_framed(
+            conn,
+            self.process_request,
+            self.read_timeout,
+            lambda e: f"[Server] Invalid request: {e}".encode(),
+        ):
+            return self.serve_framed
+        return None
+
+    def process_request(self, request):
+        """
+        Handle one decoded request and return the response: bytes for
+        status/error messages, otherwise a value to be serialised.
+        """
+        action = request.get("action") if isinstance(request, dict) else None
+        if action == "STATS":
+            return self.metrics.snapshot()
+        if action not in ACTIONS:
+            action = "OTHER"
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                return self._process_request(request)
+            with self.profiler.request(action):
+                return self._process_request(request)
+        finally:
+            us = int((time.perf_counter() - start) * 1e6)
+            labels = {"server": "voting", "action": action}
+            self.metrics.inc("requests", **labels)
+            self.metrics.observe("request_latency", us, **labels)
+            LOG.debug("request", us=us, **labels)
+
+    def _process_request(self, request):
+        if not isinstance(request, dict):
+            return b"[Server] Invalid request: expected a dict"
+
         action = request.get("action")
-        cnp = request.get("cnp")
-        pin = request.get("pin")
+        if action == "GET_KEYINFO":
+            # Public information: no credentials, so no PIN hashing.
+            return key_info(
+                self.public_key,
+                self.key_fingerprint,
+                request.get("fingerprint"),
+            )
 
-        # Verify user
-        user_row = self.db.authenticate_user(cnp, pin)
-        if not user_row:
-            conn.sendall(b"[Server] ERROR: Invalid CNP or PIN")
-            return
+        token = request.get("token")
+        if token is not None and action == "LOGIN":
+            # A token must not renew itself, or it would never expire.
+            return b"[Server] ERROR: LOGIN requires CNP and PIN"
+        if token is not None:
+            # Session token: no PIN hashing. has_voted is enforced when the
+            # ballot is committed.
+            user_id = self.tokens.verify(token)
+            if user_id is None:
+                return INVALID_TOKEN
+            if action == "CAST_VOTE" and self.voted.has_id(user_id):
+                return b"[Server] ERROR: You have already voted."
+            user_cnp, has_voted = None, 0
+        else:
+            cnp = request.get("cnp")
+            pin = request.get("pin")
+            if (
+                action == "CAST_VOTE"
+                and isinstance(cnp, str)
+                and self.voted.has_cnp(deterministic_hash(cnp))
+            ):
+                return b"[Server] ERROR: You have already voted."
+
+            # Verify user
+            user_row = self.db.authenticate_user(cnp, pin)
+            if not user_row:
+                return b"[Server] ERROR: Invalid CNP or PIN"
 
-        user_id, user_cnp, has_voted = user_row
+            user_id, user_cnp, has_voted = user_row
+            if has_voted == 1:
+                self.voted.add(user_id, user_cnp)
+
+        if action == "LOGIN":
+            return {
+                "status": "OK",
+                "token": self.tokens.issue(user_id),
+                "expires_in": self.tokens.ttl,
+                "has_voted": has_voted == 1,
+            }
 
-        if action == "GET_PUBKEY":
-            conn.sendall(pickle.dumps(self.public_key))
+        elif action == "GET_PUBKEY":
+            return self.public_key
 
         elif action == "CAST_VOTE":
             if has_voted == 1:
-                conn.sendall(b"[Server] ERROR: You have already voted.")
-                return
+                return b"[Server] ERROR: You have already voted."
 
             encrypted_vote_int = request.get("encrypted_vote")
             if encrypted_vote_int is None:
-                conn.sendall(b"[Server] ERROR: No vote provided")
-                return
+                return b"[Server] ERROR: No vote provided"
+            # A ballot encrypted with a rotated key could not be tallied.
+            fingerprint = request.get("key_fingerprint")
+            if fingerprint is not None and fingerprint != self.key_fingerprint:
+                return STALE_KEY
 
             # Convert int → bytes for DB storage
             try:
-                ciphertext_bytes = encrypted_vote_int.to_bytes(
-                    (encrypted_vote_int.bit_length() + 7) // 8, "big"
-                )
-                self.db.store_encrypted_vote(ciphertext_bytes)
-                self.db.mark_user_has_voted(user_id)
+                add_to_tally = None
+                if self.ballot_scheme == PAILLIER:
+                    ciphertext_bytes, add_to_tally = self._paillier_ballot(
+                        encrypted_vote_int
+                    )
+                else:
+                    ciphertext_bytes = encrypted_vote_int.to_bytes(
+                        (encrypted_vote_int.bit_length() + 7) // 8, "big"
+                    )
+                # The ballot insert, has_voted flip and tally update commit
+                # together; a concurrent duplicate finds has_voted already set.
+                if self.committer:
+                    vote_id = self.committer.submit(
+                        user_id, ciphertext_bytes, add_to_tally
+                    )
+                else:
+                    vote_id = self.db.cast_vote(
+                        user_id, ciphertext_bytes, add_to_tally
+                    )
+                if user_cnp is None:
+                    # Token request: look up the CNP hash for the index.
+                    user_cnp = self.db.get_user_cnp(user_id)
+                self.voted.add(user_id, user_cnp)
+                if vote_id is None:
+                    return b"[Server] ERROR: You have already voted."
 
-                conn.sendall(b"[Server] VOTE_ACCEPTED (encrypted vote stored)")
-                print(f"[Server] Stored vote for user cnp={user_cnp}")
+                # UsersDb logs vote_stored; this adds the request's side.
+                # Like vote_stored it names neither the voter nor the ballot.
+                LOG.debug(
+                    "vote_accepted", server="voting", token=token is not None
+                )
+                return b"[Server] VOTE_ACCEPTED (encrypted vote stored)"
             except Exception as e:
-                conn.sendall(f"[Server] ERROR storing vote: {e}".encode())
+                return f"[Server] ERROR storing vote: {e}".encode()
 
         else:
-            conn.sendall(b"[Server] ERROR: Unknown action")
+            return b"[Server] ERROR: Unknown action"
+
+    def _paillier_ballot(self, vector):
+        """
+        Check a Paillier ballot (one ciphertext per candidate) and return the
+        bytes to store plus the function that adds it to the encrypted tally.
+        Only the shape is checked: without a zero-knowledge proof the server
+        cannot tell that the vector really is one-hot, so results read from
+        the encrypted tally are provisional (see DataCollection.provisional)
+        until a recount.
+        """
+        n_sq = self.public_key[1] ** 2
+        if (
+            not isinstance(vector, (list, tuple))
+            or len(vector) != len(BALLOT_CODES)
+            or not all(isinstance(c, int) and 0 < c < n_sq for c in vector)
+        ):
+            raise ValueError(
+                f"expected {len(BALLOT_CODES)} Paillier ciphertexts"
+            )
+        return pack_vector(vector, self.public_key), partial(
+            add_vectors, vector=vector, pub_key=self.public_key
+        )
 
 
 if __name__ == "__main__":
-    server = VotingServer()
+    import sys
+
+    # python voting_server.py [rsa|paillier]
+    server = VotingServer(ballot_scheme=sys.argv[1] if sys.argv[1:] else "rsa")
     server.start()
 # sdadsadsa da sd as
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from models.db import UsersDb
+from utils.ballot_file import (
+    HEADER_SIZE,
+    BallotFileError,
+    BallotFileReader,
+    BallotFileWriter,
+)
+
+FINGERPRINT = "0123456789abcdef"
+
+
+def test_round_trip_and_header_mismatch(tmp_path):
+    path = str(tmp_path / "ballots.evb")
+    with BallotFileWriter(path, 8, "rsa", FINGERPRINT) as writer:
+        writer.write(1, b"\x01\x02")
+        writer.write(5, b"12345678")
+    with BallotFileReader(path) as reader:
+        assert (reader.scheme, reader.fingerprint) == ("rsa", FINGERPRINT)
+        records = [(v, bytes(c)) for v, c in reader]
+    # Short ciphertexts are left-padded to the fixed size.
+    assert records == [(1, b"\0" * 6 + b"\x01\x02"), (5, b"12345678")]
+
+    # Reopening for another key, scheme or size is refused.
+    with pytest.raises(BallotFileError):
+        BallotFileWriter(path, 8, "rsa", "f" * 16)
+    with pytest.raises(BallotFileError):
+        BallotFileWriter(path, 8, "paillier", FINGERPRINT)
+    with pytest.raises(BallotFileError):
+        BallotFileWriter(path, 16, "rsa", FINGERPRINT)
+    with pytest.raises(BallotFileError):
+        BallotFileWriter(path, 4, "rsa", FINGERPRINT).write(9, b"too long")
+
+    other = tmp_path / "other.bin"
+    other.write_bytes(b"x" * HEADER_SIZE)
+    with pytest.raises(BallotFileError):
+        BallotFileReader(str(other))
+
+
+def test_partial_trailing_record_is_ignored(tmp_path):
+    path = str(tmp_path / "ballots.evb")
+    with BallotFileWriter(path, 8, "rsa", FINGERPRINT) as writer:
+        for vote_id in range(1, 4):
+            writer.write(vote_id, b"ballot%d" % vote_id)
+    # An append interrupted halfway through a record.
+    with open(path, "ab") as f:
+        f.write(b"\0\0\0\0\0\0\0\x04ba")
+
+    with BallotFileReader(path) as reader:
+        assert len(reader) == 3
+        assert [v for v, _ in reader] == [1, 2, 3]
+
+    # The next record overwrites the partial one.
+    with BallotFileWriter(path, 8, "rsa", FINGERPRINT) as writer:
+        assert writer.count == 3
+        writer.write(4, b"ballot4")
+    assert os.path.getsize(path) == HEADER_SIZE + 4 * 16
+    with BallotFileReader(path) as reader:
+        assert [(v, bytes(c)) for v, c in reader][-1] == (4, b"\0ballot4")
+
+
+def _log_db(tmp_path, voters):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    db.attach_vote_log(str(tmp_path / "votes.evb"), 8, "rsa", FINGERPRINT)
+    ids = []
+    for i in range(voters):
+        cnp = "2900101%06d" % i
+        pin = db.register_citizen(cnp, "Ana", "Pop")
+        ids.append(db.authenticate_user(cnp, pin)[0])
+    return db, ids
+
+
+def test_reader_stops_at_committed_records(tmp_path):
+    db, (a, b) = _log_db(tmp_path, 2)
+    assert db.cast_vote(a, b"a") == 1
+    assert db.cast_votes([(b, b"b")]) == [2]
+    # A record written past `committed`, as by a crashed transaction.
+    db.vote_log.write_at(2, 3, b"orphan")
+    db.vote_log.sync()
+
+    assert [(v, bytes(c)) for v, c in db.iter_votes()] == [
+        (1, b"\0" * 7 + b"a"),
+        (2, b"\0" * 7 + b"b"),
+    ]
+    assert db.vote_version() == (2, 2)
+    with pytest.raises(ValueError):
+        db.insert_votes([(7, b"x")])
+    db.close()
+
+
+def test_rolled_back_slot_is_reused(tmp_path):
+    db, (a, b) = _log_db(tmp_path, 2)
+    assert db.cast_vote(a, b"a") == 1
+
+    def failing_tally(tally):
+        raise RuntimeError("tally unavailable")
+
+    # The ballot reaches the log before the transaction fails.
+    with pytest.raises(RuntimeError):
+        db.cast_vote(b, b"lost", failing_tally)
+    assert db.vote_log_state()[1] == 1
+    assert not db.has_voted(b)
+    with BallotFileReader(db.vote_log_path()) as reader:
+        assert [bytes(c) for _, c in reader][-1] == b"\0\0\0\0lost"
+
+    assert db.cast_vote(b, b"b") == 2
+    assert [bytes(c) for _, c in db.iter_votes()] == [
+        b"\0" * 7 + b"a",
+        b"\0" * 7 + b"b",
+    ]
+    db.close()
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+from models.db import GroupCommitter, UsersDb
+
+
+def _voters(db, count):
+    """Register `count` citizens and return their user ids."""
+    ids = []
+    for i in range(count):
+        cnp = "1900101%06d" % i
+        pin = db.register_citizen(cnp, "Ana", "Pop")
+        ids.append(db.authenticate_user(cnp, pin)[0])
+    return ids
+
+
+def _add(amount):
+    """add_to_tally stand-in: the tally is a plain running sum."""
+    return lambda tally: (tally or 0) + amount
+
+
+def test_cast_vote_is_atomic(tmp_path):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    (user,) = _voters(db, 1)
+
+    def failing_tally(tally):
+        raise RuntimeError("tally unavailable")
+
+    # A failure after the has_voted flip rolls the whole vote back.
+    with pytest.raises(RuntimeError):
+        db.cast_vote(user, b"ballot", failing_tally)
+    assert not db.has_voted(user)
+    assert db.vote_version() == (0, 0)
+
+    vote_id = db.cast_vote(user, b"ballot")
+    assert vote_id is not None
+    assert db.has_voted(user)
+    # A second vote is refused and leaves the first ballot alone.
+    assert db.cast_vote(user, b"again") is None
+    assert db.vote_version() == (1, vote_id)
+    assert list(db.iter_votes()) == [(vote_id, b"ballot")]
+    db.close()
+
+
+def test_cast_votes_records_one_ballot_per_voter(tmp_path):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    a, b, c = _voters(db, 3)
+    first = db.cast_vote(a, b"a")
+
+    results = db.cast_votes([(a, b"a2"), (b, b"b"), (b, b"b2"), (c, b"c")])
+    assert results[0] is None  # Voted before the batch.
+    assert results[2] is None  # Repeated within the batch.
+    assert first < results[1] < results[3]
+    assert [ct for _, ct in db.iter_votes()] == [b"a", b"b", b"c"]
+    db.close()
+
+
+def test_record_vote_updates_encrypted_tally(tmp_path):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    a, b, c = _voters(db, 3)
+    assert db.load_encrypted_tally() is None
+
+    db.cast_vote(a, b"a", _add(5))
+    # A refused vote does not reach the tally.
+    assert db.cast_vote(a, b"a", _add(100)) is None
+    db.cast_votes([(b, b"b", _add(7)), (c, b"c", _add(11)), (b, b"b")])
+    assert db.load_encrypted_tally() == (23, 3)
+    db.close()
+
+
+class _RecordingDb:
+    """Wraps a UsersDb and records the size of each cast_votes batch."""
+
+    def __init__(self, db):
+        self.db = db
+        self.batches = []
+
+    def cast_votes(self, ballots):
+        self.batches.append(len(ballots))
+        return self.db.cast_votes(ballots)
+
+
+def test_group_committer_batches_concurrent_votes(tmp_path):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    users = _voters(db, 8)
+    recording = _RecordingDb(db)
+    committer = GroupCommitter(recording, max_delay=0.5)
+    results = {}
+
+    def vote(user):
+        results[user] = committer.submit(user, b"x")
+
+    threads = [threading.Thread(target=vote, args=(u,)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Duplicates are answered with None, like cast_vote.
+    assert committer.submit(users[0], b"x") is None
+    committer.close()
+
+    assert sorted(results) == users
+    assert len(set(results.values())) == len(users)
+    assert sum(recording.batches) == len(users) + 1
+    assert recording.batches[0] > 1
+    db.close()
+
+
+def test_group_committer_closes_batch_at_deadline(tmp_path):
+    db = UsersDb(str(tmp_path / "votes.db"))
+    users = _voters(db, 12)
+    recording = _RecordingDb(db)
+    committer = GroupCommitter(recording, max_delay=0.1, max_batch=1000)
+
+    # A ballot trickles in every 20ms for about 0.24s; the first batch
+    # still closes 0.1s after it opened instead of waiting for a lull.
+    threads = []
+    start = time.monotonic()
+    for user in users:
+        t = threading.Thread(target=committer.submit, args=(user, b"x"))
+        t.start()
+        threads.append(t)
+        time.sleep(0.02)
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    committer.close()
+
+    assert sum(recording.batches) == len(users)
+    assert len(recording.batches) >= 2
+    assert elapsed < 1
+    db.close()
@@ -0,0 +1,85 @@
+from functools import partial
+
+import pytest
+from data_collection import DataCollection
+from models.candidates import BALLOT_CODES
+from models.storage import MemoryUsersDb
+from utils import paillier_utils
+from utils.rsa_utils import generate_rsa_keys
+
+KEYS = paillier_utils.generate_paillier_keys(512)
+
+
+def test_encrypt_add_decrypt_round_trip():
+    pub, priv = KEYS
+    c1 = paillier_utils.encrypt(20, pub)
+    c2 = paillier_utils.encrypt(22, pub)
+    # Encryption is randomised; the sum is not.
+    assert c1 != paillier_utils.encrypt(20, pub)
+    assert paillier_utils.decrypt(c1, priv) == 20
+    assert paillier_utils.decrypt(paillier_utils.add(c1, c2, pub), priv) == 42
+
+    vector = [paillier_utils.encrypt(m, pub) for m in (3, 0, 5)]
+    packed = paillier_utils.pack_vector(vector, pub)
+    assert len(packed) == 3 * paillier_utils.ciphertext_size(pub)
+    assert paillier_utils.unpack_vector(packed, pub) == vector
+
+
+def test_encrypt_one_hot():
+    pub, priv = KEYS
+    aggregate = None
+    for index in (2, 0, 2, 2):
+        vector = paillier_utils.encrypt_one_hot(index, 3, pub)
+        plain = [paillier_utils.decrypt(c, priv) for c in vector]
+        assert plain == [int(i == index) for i in range(3)]
+        aggregate = paillier_utils.add_vectors(aggregate, vector, pub)
+    totals = [paillier_utils.decrypt(c, priv) for c in aggregate]
+    assert totals == [1, 0, 3]
+
+
+def _paillier_store(plaintexts):
+    """
+    A MemoryUsersDb holding Paillier ballots with the given per-candidate
+    plaintexts, each added to the encrypted tally as the server does.
+    """
+    pub, priv = KEYS
+    db = MemoryUsersDb()
+    db.save_keys(*generate_rsa_keys(512))
+    db.save_ballot_keys(paillier_utils.PAILLIER, pub, priv)
+    db.bulk_insert_voters(
+        [("cnp%d" % i, "first", "last", "pin") for i in range(len(plaintexts))]
+    )
+    for user_id, plain in enumerate(plaintexts, 1):
+        vector = [paillier_utils.encrypt(m, pub) for m in plain]
+        add = partial(paillier_utils.add_vectors, vector=vector, pub_key=pub)
+        db.cast_vote(user_id, paillier_utils.pack_vector(vector, pub), add)
+    return db
+
+
+def test_homomorphic_statistics_match_ballots():
+    ballots = [[1, 0, 0], [0, 1, 0], [0, 1, 0], [0, 0, 1]]
+    collector = DataCollection(db=_paillier_store(ballots))
+    assert collector.provisional
+    stats = dict(zip(BALLOT_CODES, (1, 2, 1)))
+    assert collector.get_statistics() == stats
+    assert collector.get_statistics_incremental() == stats
+    assert collector.recount() == (stats, True)
+
+
+def test_inflated_tally_is_rejected_and_recount_finds_it():
+    # One ballot worth 1000 votes for A.
+    collector = DataCollection(db=_paillier_store([[0, 1, 0], [1000, 0, 0]]))
+    with pytest.raises(ValueError, match="1001 votes for 2 ballots"):
+        collector.get_statistics()
+    stats, ok = collector.recount()
+    assert stats == {BALLOT_CODES[1]: 1, "INVALID": 1}
+    assert not ok
+
+
+def test_cancelling_invalid_ballots_pass_the_total_check():
+    # (2, 0, 0) and (0, 0, 0) add up to two votes for two ballots: the
+    # total check cannot catch them, which is why the counts are
+    # provisional until a recount.
+    collector = DataCollection(db=_paillier_store([[2, 0, 0], [0, 0, 0]]))
+    assert collector.get_statistics() == {BALLOT_CODES[0]: 2}
+    assert collector.recount() == ({"INVALID": 2}, False)
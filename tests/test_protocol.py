@@ -0,0 +1,172 @@
+import pickle
+import select
+import socket
+import struct
+import threading
+
+import pytest
+from utils.protocol import (
+    MAGIC,
+    MAX_DEPTH,
+    MAX_FRAME,
+    FramedConnection,
+    ProtocolError,
+    decode,
+    encode,
+    is_framed,
+    recv_frame,
+    send_frame,
+    serve_framed,
+)
+
+
+def test_encode_decode_round_trip():
+    value = {
+        "action": "REGISTER_BATCH",
+        "none": None,
+        "flags": [True, False],
+        "ints": [0, 1, -1, 2**4096, -(2**300)],
+        "text": "Ștefan",
+        "blob": b"\x00\xffEVF1",
+        "pair": ("a", (1, [2, {"k": b""}])),
+        7: "int key",
+    }
+    assert decode(encode(value)) == value
+    assert isinstance(decode(encode((1, 2))), tuple)
+    assert isinstance(decode(encode([1, 2])), list)
+
+
+def test_decode_rejects_malformed_payloads():
+    data = encode({"action": "LOGIN", "cnp": "1234567890123"})
+    with pytest.raises(ProtocolError):
+        decode(data[:-1])  # Truncated string body.
+    with pytest.raises(ProtocolError):
+        decode(data[:3])  # Truncated length prefix.
+    with pytest.raises(ProtocolError):
+        decode(data + b"N")
+    with pytest.raises(ProtocolError):
+        decode(b"X")
+    with pytest.raises(ProtocolError):
+        decode(b"S" + struct.pack(">I", 2) + b"\xff\xfe")
+    # A list used as a dict key.
+    with pytest.raises(ProtocolError):
+        decode(b"D" + struct.pack(">I", 1) + encode([1]) + b"N")
+
+
+def test_decode_caps_nesting_depth():
+    ok = b"L\x00\x00\x00\x01" * MAX_DEPTH + b"N"
+    assert decode(ok) is not None
+    with pytest.raises(ProtocolError):
+        decode(b"L\x00\x00\x00\x01" * (MAX_DEPTH + 1) + b"N")
+    # Far deeper than the interpreter's recursion limit.
+    with pytest.raises(ProtocolError):
+        decode(b"L\x00\x00\x00\x01" * 100000 + b"N")
+
+
+def test_recv_frame_rejects_oversize_frame():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(struct.pack(">I", MAX_FRAME + 1))
+        with pytest.raises(ProtocolError):
+            recv_frame(b)
+
+
+def test_is_framed_detects_legacy_client():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pickle.dumps({"action": "GET_PUBLIC_KEY"}))
+        assert not is_framed(b, timeout=1)
+        # The legacy request is left unread for the pickle handler.
+        assert pickle.loads(b.recv(4096)) == {"action": "GET_PUBLIC_KEY"}
+
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(MAGIC)
+        assert is_framed(b, timeout=1)
+
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(MAGIC[:2])  # Stalls inside the magic.
+        with pytest.raises(socket.timeout):
+            is_framed(b, timeout=0.2)
+
+
+def test_serve_framed_answers_pipelined_requests_in_order():
+    a, b = socket.socketpair()
+    with a, b:
+        for i in range(5):
+            send_frame(a, {"n": i})
+        assert serve_framed(b, lambda r: r["n"] * 10, timeout=1)
+        assert [recv_frame(a) for _ in range(5)] == [0, 10, 20, 30, 40]
+
+        a.shutdown(socket.SHUT_WR)
+        assert not serve_framed(b, lambda r: r, timeout=1)
+
+
+def test_serve_framed_reports_bad_frame_and_closes():
+    a, b = socket.socketpair()
+    with a, b:
+        payload = b"L\x00\x00\x00\x01" * (MAX_DEPTH + 1) + b"N"
+        a.sendall(struct.pack(">I", len(payload)) + payload)
+        assert not serve_framed(
+            b, lambda r: r, timeout=1, invalid_request=lambda e: "BAD"
+        )
+        assert recv_frame(a) == "BAD"
+
+
+def _one_batch_server():
+    """Serve requests until the client goes quiet, then hang up."""
+    listener = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+    hung_up = threading.Event()
+
+    def run():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            accepted.append(conn)
+            with conn:
+                assert is_framed(conn, timeout=1)
+                while select.select([conn], [], [], 0.2)[0]:
+                    if not serve_framed(conn, lambda r: ("echo", r), 1):
+                        break
+            hung_up.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return listener, accepted, hung_up
+
+
+def test_pipeline_reconnects_once_after_idle_close():
+    listener, accepted, hung_up = _one_batch_server()
+    client = FramedConnection(*listener.getsockname(), timeout=2)
+    try:
+        assert client.pipeline([1, 2]) == [("echo", 1), ("echo", 2)]
+        assert hung_up.wait(2)
+        # The server closed the connection; the next call reopens it.
+        assert client.request("again") == ("echo", "again")
+        assert len(accepted) == 2
+    finally:
+        client.close()
+        listener.close()
+
+
+def test_pipeline_does_not_retry_a_fresh_connection():
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = FramedConnection(*listener.getsockname(), timeout=2)
+
+    def hang_up():
+        conn, _ = listener.accept()
+        conn.recv(len(MAGIC))
+        conn.close()
+
+    thread = threading.Thread(target=hang_up, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises((EOFError, ConnectionError)):
+            client.request("x")
+        assert client.sock is None
+    finally:
+        thread.join()
+        listener.close()
@@ -0,0 +1,126 @@
+import importlib
+from functools import partial
+
+import pytest
+import results_cache
+from models.storage import MemoryUsersDb
+from results_cache import ResultsCache
+from utils import paillier_utils
+from utils.rsa_utils import encrypt, generate_rsa_keys, str_to_int
+
+RSA_KEYS = generate_rsa_keys(512)
+
+
+def _store(voters):
+    db = MemoryUsersDb()
+    db.save_keys(*RSA_KEYS)
+    db.bulk_insert_voters(
+        [("cnp%d" % i, "first", "last", "pin") for i in range(voters)]
+    )
+    return db
+
+
+def _vote(db, user_id, code):
+    c = encrypt(str_to_int(code), RSA_KEYS[0])
+    db.cast_vote(user_id, c.to_bytes((c.bit_length() + 7) // 8, "big"))
+
+
+@pytest.fixture
+def tallies(monkeypatch):
+    """Counts the tallies ResultsCache computes."""
+    calls = []
+    tally = results_cache.DataCollection.get_statistics_incremental
+
+    def counting(self):
+        calls.append(1)
+        return tally(self)
+
+    monkeypatch.setattr(
+        results_cache.DataCollection, "get_statistics_incremental", counting
+    )
+    return calls
+
+
+def test_recomputes_only_when_vote_version_changes(tallies):
+    db = _store(3)
+    _vote(db, 1, "A")
+    cache = ResultsCache(db=db)
+
+    etag, _ = cache.validators()
+    assert cache.stats(etag) == {"A": 1}
+    assert cache.validators()[0] == etag
+    assert cache.stats(etag) == {"A": 1}
+    assert len(tallies) == 1
+    assert not cache.provisional
+
+    _vote(db, 2, "B")
+    new_etag, _ = cache.validators()
+    assert new_etag != etag
+    assert cache.stats(new_etag) == {"A": 1, "B": 1}
+    assert len(tallies) == 2
+
+
+def test_ttl_expires_cached_counts(tallies):
+    db = _store(1)
+    cache = ResultsCache(db=db, ttl=0)
+    etag, _ = cache.validators()
+    cache.stats(etag)
+    cache.stats(etag)
+    assert len(tallies) == 2
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # app.py opens voting_db.sqlite in the working directory on import.
+    monkeypatch.chdir(tmp_path)
+    app_module = importlib.import_module("app")
+    db = _store(3)
+    _vote(db, 1, "A")
+    monkeypatch.setattr(app_module, "results_cache", ResultsCache(db=db))
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session["admin"] = True
+    client.db = db
+    return client
+
+
+def test_results_answers_304_for_matching_etag(client, tallies):
+    response = client.get("/results")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert b"Donald Trump" in response.data
+    assert b"Provisional" not in response.data
+
+    response = client.get("/results", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert len(tallies) == 1
+
+    _vote(client.db, 2, "B")
+    response = client.get("/results", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert b"Boris Johnson" in response.data
+    assert len(tallies) == 2
+
+
+def test_results_requires_admin(client):
+    with client.session_transaction() as session:
+        session.clear()
+    response = client.get("/results")
+    assert response.status_code == 302
+
+
+def test_results_marks_paillier_counts_provisional(client, monkeypatch):
+    pub, priv = paillier_utils.generate_paillier_keys(512)
+    db = _store(1)
+    db.save_ballot_keys(paillier_utils.PAILLIER, pub, priv)
+    vector = paillier_utils.encrypt_one_hot(0, 3, pub)
+    add = partial(paillier_utils.add_vectors, vector=vector, pub_key=pub)
+    db.cast_vote(1, paillier_utils.pack_vector(vector, pub), add)
+    app_module = importlib.import_module("app")
+    monkeypatch.setattr(app_module, "results_cache", ResultsCache(db=db))
+
+    response = client.get("/results")
+    assert response.status_code == 200
+    assert b"Provisional results" in response.data
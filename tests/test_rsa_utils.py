@@ -0,0 +1,38 @@
+from math import gcd
+from utils.rsa_utils import (
+    crt_private_key,
+    decrypt,
+    encrypt,
+    extended_gcd,
+    generate_rsa_keys,
+    int_to_str,
+    str_to_int,
+)
+
+
+def test_extended_gcd_large_operands():
+    # Consecutive Fibonacci numbers are the worst case for Euclid: ~2900
+    # steps here, well past the default recursion limit.
+    a, b = 1, 1
+    for _ in range(3000):
+        a, b = b, a + b
+    g, x, y = extended_gcd(b, a)
+    assert g == gcd(a, b) == 1
+    assert b * x + a * y == g
+
+
+def test_keygen_crt_round_trip_4096():
+    pub, priv = generate_rsa_keys(4096)
+    e, n = pub
+    d, n2, p, q, dp, dq, qinv = priv
+    assert n == n2 == p * q
+    assert n.bit_length() >= 4095
+    assert (q * qinv) % p == 1
+    assert priv == crt_private_key(d, p, q)
+
+    message = str_to_int("Candidate A")
+    ciphertext = encrypt(message, pub)
+    assert decrypt(ciphertext, priv) == message
+    # The CRT path agrees with the legacy (d, n) key.
+    assert decrypt(ciphertext, (d, n)) == message
+    assert int_to_str(decrypt(ciphertext, priv)) == "Candidate A"
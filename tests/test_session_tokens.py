@@ -0,0 +1,49 @@
+import time
+
+from utils import session_tokens
+from utils.session_tokens import SessionTokens
+
+
+def test_issue_and_verify():
+    tokens = SessionTokens(b"secret", ttl=60)
+    token = tokens.issue(42)
+    assert tokens.verify(token) == 42
+    # Another instance with the same secret accepts it (e.g. a restart).
+    assert SessionTokens(b"secret").verify(token) == 42
+
+
+def test_expired_token(monkeypatch):
+    tokens = SessionTokens(b"secret", ttl=60)
+    token = tokens.issue(7)
+    now = time.time()
+    monkeypatch.setattr(session_tokens.time, "time", lambda: now + 59)
+    assert tokens.verify(token) == 7
+    monkeypatch.setattr(session_tokens.time, "time", lambda: now + 62)
+    assert tokens.verify(token) is None
+
+
+def test_tampered_token():
+    tokens = SessionTokens(b"secret", ttl=60)
+    user_id, expires, signature = tokens.issue(7).split(".")
+    flipped = "0" if signature[-1] != "0" else "1"
+    assert (
+        tokens.verify(f"{user_id}.{expires}.{signature[:-1]}{flipped}") is None
+    )
+    # Payload changes invalidate the signature.
+    assert tokens.verify(f"8.{expires}.{signature}") is None
+    assert (
+        tokens.verify(f"{user_id}.{int(expires) + 3600}.{signature}") is None
+    )
+
+
+def test_wrong_secret():
+    token = SessionTokens(b"secret").issue(7)
+    assert SessionTokens(b"other").verify(token) is None
+    # Without a secret each instance generates its own.
+    assert SessionTokens().verify(SessionTokens().issue(7)) is None
+
+
+def test_malformed_tokens():
+    tokens = SessionTokens(b"secret")
+    for token in (None, 7, b"7.1.ab", "", "7.1", "7.1.ab.cd", "x.y.z"):
+        assert tokens.verify(token) is None
@@ -0,0 +1,132 @@
+from functools import partial
+
+import pytest
+from data_collection import DataCollection
+from models.candidates import BALLOT_CODES
+from models.db import UsersDb, deterministic_hash
+from models.storage import MemoryUsersDb, ShardedUsersDb, open_users_db
+from utils import paillier_utils
+from utils.rsa_utils import encrypt, generate_rsa_keys, str_to_int
+
+RSA_KEYS = generate_rsa_keys(512)
+PAILLIER_KEYS = paillier_utils.generate_paillier_keys(512)
+
+
+def _voters(db, count):
+    """Register `count` citizens; returns [(cnp, user_id)]."""
+    voters = []
+    for i in range(count):
+        cnp = "5900101%06d" % i
+        pin = db.register_citizen(cnp, "Ana", "Pop")
+        voters.append((cnp, db.authenticate_user(cnp, pin)[0]))
+    return voters
+
+
+def _rsa_ballot(code):
+    c = encrypt(str_to_int(code), RSA_KEYS[0])
+    return c.to_bytes((c.bit_length() + 7) // 8, "big")
+
+
+def test_open_users_db_refuses_memory(tmp_path, monkeypatch):
+    with pytest.raises(ValueError, match="db="):
+        open_users_db(str(tmp_path / "x.db"), "memory")
+    monkeypatch.setenv("EVOTE_STORAGE", "memory")
+    with pytest.raises(ValueError):
+        open_users_db(str(tmp_path / "x.db"))
+    with pytest.raises(ValueError):
+        open_users_db(str(tmp_path / "x.db"), "postgres")
+
+
+def test_id_stride_and_offset(tmp_path):
+    db = UsersDb(str(tmp_path / "shard.db"), id_stride=4, id_offset=3)
+    assert [db.store_encrypted_vote(b"x") for _ in range(3)] == [7, 11, 15]
+    assert db.vote_version() == (3, 15)
+    assert db.vote_id_chunks(2) == [(7, 11), (15, 15)]
+    # Global bounds between a shard's ids select the same local range.
+    assert [v for v, _ in db.iter_votes(8, 15)] == [11, 15]
+    assert [v for v, _ in db.iter_votes(7, 14)] == [11]
+    db.close()
+
+
+def test_sharded_ids_name_their_shard(tmp_path):
+    db = ShardedUsersDb(str(tmp_path / "votes.db"), shards=3)
+    voters = _voters(db, 12)
+    user_ids = [user_id for _, user_id in voters]
+    assert len(set(user_ids)) == len(user_ids)
+    assert {u % 3 for u in user_ids} == {0, 1, 2}
+    for cnp, user_id in voters:
+        shard = db.shards[user_id % 3]
+        assert shard.get_user_cnp(user_id) == deterministic_hash(cnp)
+
+    vote_ids = db.cast_votes([(u, b"%d" % u) for u in user_ids])
+    assert len(set(vote_ids)) == len(vote_ids)
+    # A ballot lives in its voter's shard.
+    assert [v % 3 for v in vote_ids] == [u % 3 for u in user_ids]
+    for i, partition in enumerate(db.vote_partitions()):
+        assert all(v % 3 == i for v, _ in partition.iter_votes())
+    assert db.cast_vote(user_ids[0], b"again") is None
+    db.close()
+
+    # The shard count is fixed once the files exist.
+    with pytest.raises(ValueError):
+        ShardedUsersDb(str(tmp_path / "votes.db"), shards=2)
+
+
+def test_memory_ids_stay_past_imported_ballots():
+    db = MemoryUsersDb()
+    assert db.insert_votes([(10, b"a"), (4, b"b"), (10, b"dup")]) == 2
+    assert db.store_encrypted_vote(b"c") == 11
+    assert [v for v, _ in db.iter_votes()] == [4, 10, 11]
+    assert db.vote_version() == (3, 11)
+
+
+def _store(kind, tmp_path):
+    if kind == "memory":
+        return MemoryUsersDb()
+    return open_users_db(str(tmp_path / "votes.db"), kind)
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "sharded:3", "memory"])
+def test_rsa_tally_across_partitions(kind, tmp_path):
+    db = _store(kind, tmp_path)
+    db.save_keys(*RSA_KEYS)
+    voters = _voters(db, 9)
+    choices = "ABCABBACB"
+    db.cast_votes(
+        [(u, _rsa_ballot(code)) for (_, u), code in zip(voters, choices)]
+    )
+    expected = {"A": 3, "B": 4, "C": 2}
+
+    collector = DataCollection(db=db)
+    assert not collector.provisional
+    assert collector.get_statistics() == expected
+    assert collector.get_statistics_parallel(workers=2) == expected
+    assert collector.get_statistics_incremental() == expected
+    assert collector.recount() == (expected, True)
+    db.close()
+
+
+@pytest.mark.parametrize("kind", ["sharded:3", "memory"])
+def test_paillier_tally_across_partitions(kind, tmp_path):
+    pub, priv = PAILLIER_KEYS
+    db = _store(kind, tmp_path)
+    db.save_keys(*RSA_KEYS)
+    db.save_ballot_keys(paillier_utils.PAILLIER, pub, priv)
+    voters = _voters(db, 7)
+    ballots = []
+    for (_, user_id), code in zip(voters, "ABBCCCA"):
+        vector = paillier_utils.encrypt_one_hot(
+            BALLOT_CODES.index(code), len(BALLOT_CODES), pub
+        )
+        add = partial(paillier_utils.add_vectors, vector=vector, pub_key=pub)
+        ballots.append((user_id, paillier_utils.pack_vector(vector, pub), add))
+    db.cast_votes(ballots)
+
+    collector = DataCollection(db=db)
+    # Each partition keeps its own encrypted tally.
+    tallies = [p.load_encrypted_tally() for p in db.vote_partitions()]
+    assert sum(t[1] for t in tallies if t) == 7
+    expected = {"A": 2, "B": 2, "C": 3}
+    assert collector.get_statistics() == expected
+    assert collector.recount() == (expected, True)
+    db.close()
@@ -0,0 +1,82 @@
+from models.db import deterministic_hash
+from models.storage import MemoryUsersDb
+from utils.rsa_utils import encrypt, generate_rsa_keys, str_to_int
+from utils.voted_index import VotedIndex
+from voting_server import VotingServer
+
+ALREADY_VOTED = b"[Server] ERROR: You have already voted."
+ACCEPTED = b"[Server] VOTE_ACCEPTED (encrypted vote stored)"
+
+
+def _colliding(hashed_cnp):
+    """Another CNP hash sharing the first 16 bytes of hashed_cnp."""
+    last = "0" if hashed_cnp[-1] != "0" else "1"
+    return hashed_cnp[:-1] + last
+
+
+def test_index_bitmap_and_cnp_hashes():
+    index = VotedIndex()
+    hashed = deterministic_hash("1900101000001")
+    assert index.load([(3, hashed), (17, None)]) == 2
+    assert index.has_id(3) and index.has_id(17)
+    assert not index.has_id(4)
+    assert not index.has_id(10**6)
+    assert index.has_cnp(hashed)
+    assert not index.has_cnp(deterministic_hash("1900101000002"))
+    assert not index.has_cnp(_colliding(hashed))
+
+
+def _server():
+    db = MemoryUsersDb()
+    db.save_keys(*generate_rsa_keys(512))
+    server = VotingServer(db=db)
+    voters = {}
+    for i in range(3):
+        cnp = "1900101%06d" % i
+        voters[cnp] = db.register_citizen(cnp, "Ana", "Pop")
+    return server, voters
+
+
+def _cast(server, cnp, pin):
+    ballot = encrypt(str_to_int("A"), server.public_key)
+    return server.process_request(
+        {
+            "action": "CAST_VOTE",
+            "cnp": cnp,
+            "pin": pin,
+            "encrypted_vote": ballot,
+        }
+    )
+
+
+def test_server_rejects_on_index_hit_before_pin_check():
+    server, voters = _server()
+    (a, pin_a), (b, pin_b), _ = voters.items()
+    assert _cast(server, a, pin_a) == ACCEPTED
+    # The index answers before the PIN is checked, so even a wrong PIN
+    # gets "already voted" rather than "Invalid CNP or PIN".
+    assert _cast(server, a, "0000") == ALREADY_VOTED
+
+    # A token for a user in the bitmap is refused without a database read.
+    login = server.process_request({"action": "LOGIN", "cnp": b, "pin": pin_b})
+    user_b = server.db.authenticate_user(b, pin_b)[0]
+    server.voted.add(user_b)
+    ballot = encrypt(str_to_int("B"), server.public_key)
+    response = server.process_request(
+        {
+            "action": "CAST_VOTE",
+            "token": login["token"],
+            "encrypted_vote": ballot,
+        }
+    )
+    assert response == ALREADY_VOTED
+    assert not server.db.has_voted(user_b)
+
+
+def test_prefix_collision_falls_through_to_database():
+    server, voters = _server()
+    _, _, (c, pin_c) = voters.items()
+    # A voter whose CNP hash starts like c's.
+    server.voted.add(99, _colliding(deterministic_hash(c)))
+    assert _cast(server, c, pin_c) == ACCEPTED
+    assert _cast(server, c, pin_c) == ALREADY_VOTED